@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+'''
+    Info
+
+    Offline benchmarks of the scanning stages. Nothing leaves the machine: a UDP DNS server (dnsServer.py) and
+    an aiohttp blob endpoint (blobServer.py) stand in for Azure, and ForgottenClouds is pointed at them through
+    config.DNS_NAMESERVERS, config.DNS_PORT and config.BLOB_ENDPOINT.
+
+    Usage (from the App folder):
+
+        python -m Benchmarks.benchmark
+        python -m Benchmarks.benchmark --scenario accounts --keywords 5000 --hit-rate 0.02 --latency-ms 20 --error-rate 0.01
+        python -m Benchmarks.benchmark --json results.json
+
+    Scenarios:
+        - accounts:   findStorageAccounts for every company.
+        - containers: findContainers for every storage account that exists.
+        - blobs:      getBlobs for every exposed container.
+        - prefixes:   getBlobsPartitioned for every exposed container (give the blob names folders with --folders).
+        - full:       the whole Azure() flow, writing its output to a temporary folder.
+
+    Every scenario runs in its own process, so the peak RSS reported is the one of that scenario only,
+    and the latencies are the ones its stages reported to metrics.METRICS.
+'''
+
+SCENARIOS = ["accounts", "containers", "blobs", "prefixes", "full"]
+
+RESOURCE = "blob.core.windows.net"
+
+# Stages of the metrics reported (see metrics.py)
+STAGES = ["dns", "http", "listing"]
+
+
+
+def buildWorld(options: argparse.Namespace) -> dict:
+    """
+        Builds the synthetic wordlists and decides which storage accounts and containers exist.
+
+        Args:
+            options (argparse.Namespace): The command line options.
+
+        Returns:
+            dict: companies, keywords, resources, the (company, FQDN) that resolve and the blobs of each exposed container.
+    """
+
+    from MicrosoftAzure.storageAccounts import storageAccountCandidates
+    from MicrosoftAzure.containers import permutation
+
+    generator = random.Random(options.seed)
+
+    companies = [f"company{index}" for index in range(options.companies)]
+    keywords = [f"kw{index}" for index in range(options.keywords)]
+    resources = [RESOURCE]
+
+    hits = []
+    exposed = {}
+
+    for company in companies:
+        candidates = list(storageAccountCandidates(company, keywords, resources))
+        company_hits = generator.sample(candidates, max(1, int(len(candidates) * options.hit_rate)))
+        hits.extend((company, storage_account) for storage_account in company_hits)
+
+        for storage_account in company_hits:
+            name = storage_account.split(".")[0]
+            containers = list(permutation(company, name, keywords))
+
+            for container in generator.sample(containers, max(1, int(len(containers) * options.hit_rate))):
+                exposed[(name, container)] = options.blobs
+
+    return {"companies": companies, "keywords": keywords, "resources": resources, "hits": hits, "exposed": exposed}
+
+
+
+def startStandIns(world: dict, options: argparse.Namespace) -> tuple[int, int]:
+    """
+        Starts the DNS and blob stand-ins in a background thread with its own event loop.
+
+        Args:
+            world (dict): The synthetic world (see buildWorld).
+            options (argparse.Namespace): The command line options.
+
+        Returns:
+            tuple[int, int]: The DNS port and the blob endpoint port.
+    """
+
+    from Benchmarks.dnsServer import startDNSServer
+    from Benchmarks.blobServer import startBlobServer
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    latency = options.latency_ms / 1000
+
+    async def start() -> tuple[int, int]:
+        transport, _ = await startDNSServer({storage_account for _, storage_account in world["hits"]}, latency=latency, error_rate=options.error_rate)
+        _, blob_port = await startBlobServer(world["exposed"], page_size=options.page_size, latency=latency, error_rate=options.error_rate, folders=options.folders)
+
+        return (transport.get_extra_info("sockname")[1], blob_port)
+
+    return asyncio.run_coroutine_threadsafe(start(), loop).result()
+
+
+
+def runScenario(scenario: str, world: dict, dns_port: int, blob_port: int, results: multiprocessing.Queue):
+    """
+        Runs a scenario in the current (child) process and puts its measures in the results queue.
+
+        Args:
+            scenario (str): The scenario name.
+            world (dict): The synthetic world (see buildWorld).
+            dns_port (int): The port of the DNS stand-in.
+            blob_port (int): The port of the blob stand-in.
+            results (multiprocessing.Queue): Where the measures are sent.
+    """
+
+    # Point ForgottenClouds at the stand-ins before anything else imports config
+    import config
+    config.DNS_NAMESERVERS = ["127.0.0.1"]
+    config.DNS_PORT = dns_port
+    config.BLOB_ENDPOINT = f"http://127.0.0.1:{blob_port}"
+    config.DNS_CACHE_ENABLED = False
+
+    # Prefixes are listed one at a time unless asked for (see config.py)
+    if scenario == "prefixes":
+        config.LISTING_PARTITION_CONCURRENCY = 8
+
+    # The full flow writes its CSV files, journal and cache to a throwaway folder
+    os.chdir(tempfile.mkdtemp(prefix="forgottenclouds-benchmark-"))
+
+    import MicrosoftAzure.containers as containers
+    import MicrosoftAzure.blobs as blobs
+    import MicrosoftAzure.storageAccounts as storageAccounts
+    import MicrosoftAzure.az as az
+    from metrics import METRICS
+
+    companies, keywords, resources = world["companies"], world["keywords"], world["resources"]
+
+    async def listAll(partitioned: bool = False) -> int:
+        listed = 0
+
+        async with await containers.createSession() as session:
+            for (name, container) in world["exposed"]:
+                storage_account = f"{name}.{RESOURCE}"
+                url = f"{containers.accountURL(storage_account)}/{container}?restype=container&comp=list"
+
+                pages = blobs.getBlobsPartitioned(storage_account, url, session) if partitioned else blobs.getBlobs(storage_account, url, session)
+
+                async for page, _ in pages:
+                    listed += len(page)
+
+        return listed
+
+    start = time.perf_counter()
+
+    # The colored lines of a run are not part of the measure
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scenario == "accounts":
+            for company in companies:
+                storageAccounts.findStorageAccounts(company, keywords, resources)
+            items = METRICS.latency["dns"].count
+
+        elif scenario == "containers":
+            loop = asyncio.get_event_loop()
+            session = loop.run_until_complete(containers.createSession())
+            for company, storage_account in world["hits"]:
+                containers.findContainers(storage_account, company, keywords, session)
+            loop.run_until_complete(session.close())
+            items = METRICS.latency["http"].count
+
+        elif scenario in ("blobs", "prefixes"):
+            items = asyncio.run(listAll(partitioned=scenario == "prefixes"))
+
+        else:
+            az.Azure(companies, keywords, resources)
+            items = METRICS.latency["dns"].count + METRICS.latency["http"].count
+
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    results.put({
+        "scenario": scenario,
+        "items": items,
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(items / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            stage: {"count": values["count"], "p50": values["p50_ms"], "p99": values["p99_ms"]}
+            for stage, values in METRICS.snapshot()["stages"].items() if stage in STAGES and values["count"] > 0
+        },
+        "peak_rss_mb": round(peak_rss, 1),
+    })
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of ForgottenClouds against local DNS and blob endpoint stand-ins")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Scenario to run, can be repeated (default: all)")
+    parser.add_argument("--companies", type=int, default=2, help="Number of companies")
+    parser.add_argument("--keywords", type=int, default=1000, help="Size of the keyword wordlist")
+    parser.add_argument("--hit-rate", type=float, default=0.005, help="Fraction of storage account and container candidates that exist")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Latency added by the stand-ins to every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of answers that are SERVFAIL (DNS) or 503 (blob endpoint)")
+    parser.add_argument("--blobs", type=int, default=20000, help="Number of blobs in every exposed container")
+    parser.add_argument("--page-size", type=int, default=5000, help="Maximum number of blobs in a listing page")
+    parser.add_argument("--folders", type=int, default=0, help="Folders of each of the two levels of the blob names (0: names without folders)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic world")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    options = parser.parse_args()
+
+    world = buildWorld(options)
+    dns_port, blob_port = startStandIns(world, options)
+
+    print(f"World: {len(world['companies'])} companies, {len(world['keywords'])} keywords, {len(world['hits'])} storage accounts, {len(world['exposed'])} exposed containers")
+    print(f"Stand-ins: DNS on 127.0.0.1:{dns_port}/udp, blob endpoint on http://127.0.0.1:{blob_port}")
+    print()
+    print(f"{'scenario':<12}{'items':>10}{'elapsed s':>12}{'items/s':>12}{'stage':>8}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>14}")
+
+    context = multiprocessing.get_context("spawn")
+    all_results = []
+
+    for scenario in options.scenario or SCENARIOS:
+        results = context.Queue()
+        process = context.Process(target=runScenario, args=(scenario, world, dns_port, blob_port, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        all_results.append(result)
+
+        stages = list(result["latency_ms"].items()) or [("-", {"p50": 0.0, "p99": 0.0})]
+
+        for index, (stage, latency) in enumerate(stages):
+            if index == 0:
+                print(f"{scenario:<12}{result['items']:>10}{result['elapsed_s']:>12}{result['items_per_s']:>12}{stage:>8}{latency['p50']:>10}{latency['p99']:>10}{result['peak_rss_mb']:>14}")
+
+            else:
+                print(f"{'':<46}{stage:>8}{latency['p50']:>10}{latency['p99']:>10}")
+
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump({"options": vars(options), "results": all_results}, file, indent=4)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+from aiohttp import web
+from bisect import bisect_left
+import asyncio
+import random
+
+'''
+    Info
+
+    aiohttp server standing in for the blob endpoint during the benchmarks. It answers path-style URLs,
+    the same ones ForgottenClouds sends when BLOB_ENDPOINT is set:
+
+        GET /<mystorageaccount>/<mycontainer>?restype=container&comp=list[&prefix=<prefix>][&delimiter=/][&marker=<marker>][&maxresults=<n>]
+
+        - Exposed containers answer 200 with a List Blobs page of at most `page_size` blobs and a NextMarker.
+          With a delimiter, the names with the delimiter after the prefix are grouped into <BlobPrefix> elements.
+        - With `folders`, the blob names are spread over two levels of folders: dir-<n>/part-<n>/file-<n>.bin
+        - Any other container answers 404.
+        - With probability `error_rate` the answer is 503 (Server Busy) instead.
+        - Every answer is delayed by `latency` seconds.
+'''
+
+BLOB_TEMPLATE = (
+    "<Blob><Name>{name}</Name><Properties>"
+    "<Creation-Time>Mon, 01 Jan 2024 10:00:00 GMT</Creation-Time>"
+    "<Last-Modified>Tue, 02 Jan 2024 10:00:00 GMT</Last-Modified>"
+    "<Etag>0x8DC{index:012X}</Etag>"
+    "<Content-Length>{size}</Content-Length>"
+    "<Content-Type>application/octet-stream</Content-Type>"
+    "<Content-Encoding /><Content-Language />"
+    "<Content-MD5>1B2M2Y8AsgTpgAmY7PhCfg==</Content-MD5>"
+    "<BlobType>BlockBlob</BlobType><LeaseStatus>unlocked</LeaseStatus><LeaseState>available</LeaseState>"
+    "</Properties></Blob>"
+)
+
+NOT_FOUND = '<?xml version="1.0" encoding="utf-8"?><Error><Code>ContainerNotFound</Code><Message>The specified container does not exist.</Message></Error>'
+SERVER_BUSY = '<?xml version="1.0" encoding="utf-8"?><Error><Code>ServerBusy</Code><Message>The server is busy.</Message></Error>'
+
+
+
+def blobName(index: int, count: int = 0, folders: int = 0) -> str:
+    """
+        Returns the name of the blob at the given position. Names sort in the same order as their positions.
+
+        Args:
+            index (int): The position of the blob.
+            count (int): The number of blobs in the container.
+            folders (int): The folders of each level, 0 for names without folders.
+    """
+
+    if folders == 0:
+        return f"file-{index:09d}.bin"
+
+    # Both levels grow with the position, so the names still sort in the same order
+    folder = index * folders * folders // count
+
+    return f"dir-{folder // folders:04d}/part-{folder % folders:04d}/file-{index:09d}.bin"
+
+
+
+def listPage(container: str, names: list[str], marker: int, max_results: int, prefix: str = "", delimiter: str = "") -> str:
+    """
+        Builds a List Blobs page.
+
+        Args:
+            container (str): The container name.
+            names (list[str]): The names of the blobs in the container, sorted.
+            marker (int): The position of the first blob of the page.
+            max_results (int): The maximum number of blobs and prefixes in the page.
+            prefix (str): Only the blobs whose name starts with it.
+            delimiter (str): Group the names with the delimiter after the prefix into <BlobPrefix> elements.
+
+        Returns:
+            str: The XML body.
+    """
+
+    position = max(marker, bisect_left(names, prefix))
+    end = bisect_left(names, prefix + "\U0010ffff")
+    entries = []
+
+    while position < end and len(entries) < max_results:
+        rest = names[position][len(prefix):]
+
+        if delimiter and delimiter in rest:
+            blob_prefix = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+            entries.append(f"<BlobPrefix><Name>{blob_prefix}</Name></BlobPrefix>")
+            position = bisect_left(names, blob_prefix + "\U0010ffff")
+
+        else:
+            entries.append(BLOB_TEMPLATE.format(name=names[position], index=position, size=position * 1024))
+            position += 1
+
+    next_marker = str(position) if position < end else ""
+
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f'<EnumerationResults ContainerName="{container}">'
+        f'{f"<Prefix>{prefix}</Prefix>" if prefix else ""}{f"<Delimiter>{delimiter}</Delimiter>" if delimiter else ""}'
+        f'{f"<Marker>{marker}</Marker>" if marker else ""}<MaxResults>{max_results}</MaxResults>'
+        f'<Blobs>{"".join(entries)}</Blobs><NextMarker>{next_marker}</NextMarker>'
+        '</EnumerationResults>'
+    )
+
+
+
+def createBlobApp(exposed: dict[tuple[str, str], int], page_size: int = 5000, latency: float = 0.0, error_rate: float = 0.0, folders: int = 0) -> web.Application:
+    """
+        Creates the blob endpoint stand-in.
+
+        Args:
+            exposed (dict[tuple[str, str], int]): Number of blobs of every exposed (storage account name, container).
+            page_size (int): The maximum number of blobs in a page.
+            latency (float): Seconds every answer is delayed.
+            error_rate (float): Probability of answering 503.
+            folders (int): The folders of each level of the blob names, 0 for names without folders.
+
+        Returns:
+            web.Application: The application, ready to be served.
+    """
+
+    # The names of every container size, built on the first listing
+    names = {}
+
+    async def handle(request: web.Request) -> web.Response:
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        if random.random() < error_rate:
+            return web.Response(status=503, text=SERVER_BUSY, content_type="application/xml", headers={"Retry-After": "0"})
+
+        count = exposed.get((request.match_info["account"], request.match_info["container"]))
+
+        if count is None or request.query.get("comp") != "list":
+            return web.Response(status=404, text=NOT_FOUND, content_type="application/xml")
+
+        if count not in names:
+            names[count] = [blobName(index, count, folders) for index in range(count)]
+
+        marker = int(request.query.get("marker") or 0)
+        max_results = min(int(request.query.get("maxresults") or 5000), page_size)
+        page = listPage(request.match_info["container"], names[count], marker, max_results, request.query.get("prefix", ""), request.query.get("delimiter", ""))
+
+        return web.Response(text=page, content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_get("/{account}/{container}", handle)
+
+    return app
+
+
+
+async def startBlobServer(exposed: dict[tuple[str, str], int], host: str = "127.0.0.1", port: int = 0, page_size: int = 5000, latency: float = 0.0, error_rate: float = 0.0, folders: int = 0) -> tuple[web.AppRunner, int]:
+    """
+        Starts the blob endpoint stand-in in the running event loop.
+
+        Args:
+            exposed (dict[tuple[str, str], int]): Number of blobs of every exposed (storage account name, container).
+            host (str): The address to listen on.
+            port (int): The TCP port, 0 for any free port.
+            page_size (int): The maximum number of blobs in a page.
+            latency (float): Seconds every answer is delayed.
+            error_rate (float): Probability of answering 503.
+            folders (int): The folders of each level of the blob names, 0 for names without folders.
+
+        Returns:
+            tuple[web.AppRunner, int]: The runner (call cleanup() to stop it) and the port.
+    """
+
+    runner = web.AppRunner(createBlobApp(exposed, page_size, latency, error_rate, folders), access_log=None)
+    await runner.setup()
+
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    return (runner, site._server.sockets[0].getsockname()[1])
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import struct
+
+'''
+    Info
+
+    Minimal UDP DNS server standing in for the Azure DNS zones during the benchmarks.
+
+        - Names in `hits` get an A record pointing to 127.0.0.1.
+        - Any other name gets NXDOMAIN.
+        - With probability `error_rate` the answer is SERVFAIL instead.
+        - Every answer is delayed by `latency` seconds.
+
+    Only what c-ares sends for an A query is understood: one question, no compression in the question.
+'''
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+QTYPE_A = 1
+
+
+
+def parseQuestion(packet: bytes) -> tuple[str, int, int]:
+    """
+        Extracts the question of a DNS query.
+
+        Args:
+            packet (bytes): The query.
+
+        Returns:
+            tuple[str, int, int]: The queried name (lowercase), the qtype and the offset where the question ends.
+    """
+
+    labels = []
+    offset = 12
+
+    while packet[offset] != 0:
+        length = packet[offset]
+        labels.append(packet[offset + 1:offset + 1 + length].decode("ascii"))
+        offset += 1 + length
+
+    # Skip the root label, read qtype and qclass
+    qtype, _ = struct.unpack("!HH", packet[offset + 1:offset + 5])
+
+    return (".".join(labels).lower(), qtype, offset + 5)
+
+
+
+def buildAnswer(query: bytes, rcode: int, address: bytes = None) -> bytes:
+    """
+        Builds the response to a query, echoing its question.
+
+        Args:
+            query (bytes): The query.
+            rcode (int): The response code.
+            address (bytes, optional): The IPv4 address of the A record, if any.
+
+        Returns:
+            bytes: The response.
+    """
+
+    _, qtype, question_end = parseQuestion(query)
+
+    (query_id, query_flags) = struct.unpack("!HH", query[:4])
+
+    # QR=1, same opcode and RD, AA=1, RA=1
+    flags = 0x8000 | (query_flags & 0x7900) | 0x0400 | 0x0080 | rcode
+    answers = 1 if address is not None and qtype == QTYPE_A else 0
+
+    header = struct.pack("!HHHHHH", query_id, flags, 1, answers, 0, 0)
+    response = header + query[12:question_end]
+
+    if answers:
+        # Pointer to the name in the question, type A, class IN, TTL 60, 4 bytes of data
+        response += struct.pack("!HHHIH", 0xC00C, QTYPE_A, 1, 60, 4) + address
+
+    return response
+
+
+
+class DNSServerProtocol(asyncio.DatagramProtocol):
+    """
+        Answers the queries as described at the top of the module.
+
+        Args:
+            hits (set[str]): The names that exist.
+            latency (float): Seconds every answer is delayed.
+            error_rate (float): Probability of answering SERVFAIL.
+    """
+
+    def __init__(self, hits: set[str], latency: float = 0.0, error_rate: float = 0.0):
+        self.hits = hits
+        self.latency = latency
+        self.error_rate = error_rate
+        self.queries = 0
+
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.queries += 1
+
+        try:
+            name, _, _ = parseQuestion(data)
+
+        except (IndexError, struct.error, UnicodeDecodeError):
+            return
+
+        if random.random() < self.error_rate:
+            response = buildAnswer(data, RCODE_SERVFAIL)
+
+        elif name in self.hits:
+            response = buildAnswer(data, RCODE_NOERROR, bytes([127, 0, 0, 1]))
+
+        else:
+            response = buildAnswer(data, RCODE_NXDOMAIN)
+
+        if self.latency > 0:
+            asyncio.get_running_loop().call_later(self.latency, self.transport.sendto, response, addr)
+
+        else:
+            self.transport.sendto(response, addr)
+
+
+
+async def startDNSServer(hits: set[str], host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, error_rate: float = 0.0) -> tuple[asyncio.DatagramTransport, DNSServerProtocol]:
+    """
+        Starts the DNS stand-in in the running event loop.
+
+        Args:
+            hits (set[str]): The names that exist.
+            host (str): The address to listen on.
+            port (int): The UDP port, 0 for any free port.
+            latency (float): Seconds every answer is delayed.
+            error_rate (float): Probability of answering SERVFAIL.
+
+        Returns:
+            tuple[asyncio.DatagramTransport, DNSServerProtocol]: The transport (its socket tells the port) and the protocol.
+    """
+
+    return await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: DNSServerProtocol({hit.lower() for hit in hits}, latency, error_rate),
+        local_addr=(host, port),
+    )
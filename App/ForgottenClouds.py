@@ -1,9 +1,13 @@
 from utils import *
 from config import *
-from MicrosoftAzure.az import Azure
+from wordlists import loadWordlist
+from MicrosoftAzure.az import Azure, MODES
+from metrics import profiling
+import argparse
+import contextlib
 
 
-def ForgottenClouds():
+def ForgottenClouds(args: argparse.Namespace):
 
     HEADER = '''
                                                                                              ,,                           ,,             
@@ -20,20 +24,24 @@ def ForgottenClouds():
 
     print(HEADER)
 
+    # Wordlists are normalized and validated once, then loaded from their compiled form
+    wordlists_folder = WORDLISTS_FOLDER if WORDLISTS_CACHE_ENABLED else None
+
     # Keywords
-    keywords = readTXTFile(keywords_file)
+    keywords = loadWordlist(keywords_file, wordlists_folder)
     print(f"[{INFO}] Importing Keywords: {len(keywords)}")
 
     # Azure Resources
-    azure_resources = readTXTFile(azure_resources_file)
+    azure_resources = loadWordlist(azure_resources_file, wordlists_folder)
     print(f"[{INFO}] Importing Azure Resources: {len(azure_resources)}")
 
     # Containers
-    containers = readTXTFile(containers_file)
+    containers = loadWordlist(containers_file, wordlists_folder)
     print(f"[{INFO}] Importing Container Names: {len(containers)}")
 
     # Companies
-    companies = readTXTFile(companies_file)
+    # Company names keep their spelling: they name the output folders and the journal entries
+    companies = loadWordlist(companies_file, wordlists_folder, lowercase=False)
     print(f"[{INFO}] Importing Companies: {len(companies)}")
 
 
@@ -44,10 +52,46 @@ def ForgottenClouds():
     # Print the action in place
     print(f"[{INFO}] Checking Azure")
 
+    if args.coordinator:
+        from MicrosoftAzure.distributed import Distributed
+
+        if args.incremental or args.dns_budget is not None or args.http_budget is not None or args.workers > 1:
+            print(f"[{WARNING}] --incremental, --dns-budget, --http-budget and --workers are ignored in distributed scans")
+
+        # The work units are scanned by the --worker processes
+        Distributed(companies, keywords, azure_resources, args.coordinator, args.local_workers, args.token, args.resume, args.mode, args.reprobe)
+        return
+
     # Execute the flow for Azure Resources
-    Azure(companies, keywords, azure_resources)
+    Azure(companies, keywords, azure_resources, args.resume, args.workers, args.mode, args.incremental, args.dns_budget, args.http_budget, args.reprobe, args.events, args.quiet)
 
 
 if __name__ == "__main__":
-    ForgottenClouds()
+    parser = argparse.ArgumentParser(description="Search for exposed Azure Storage Accounts and Blob Containers")
+    parser.add_argument("--resume", action="store_true", help=f"Continue an interrupted run from the journal ({JOURNAL_FILE}) instead of starting from the first company")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes scanning companies in parallel, each one with its own event loop and the limits of config.py")
+    parser.add_argument("--mode", choices=MODES, default="full", help="accounts: DNS discovery only. containers: discovery and container probing. full: discovery, probing and blob listing")
+    parser.add_argument("--incremental", action="store_true", help=f"Write only the blobs added, modified or removed since the last scan of each container ({INVENTORY_FILE}) to a _changes CSV file")
+    parser.add_argument("--dns-budget", type=int, help="Maximum number of DNS lookups per company, the likely storage accounts first")
+    parser.add_argument("--http-budget", type=int, help="Maximum number of container probes per company, the likely containers first")
+    parser.add_argument("--reprobe", action="store_true", help=f"Probe again the containers that answered 404 in recent runs ({NEGATIVE_FILTER_FOLDER}), instead of skipping them")
+    parser.add_argument("--events", metavar="FILE", help="Write every finding (storage accounts, containers, blob pages, errors) to FILE as JSON lines, - for the standard output")
+    parser.add_argument("--quiet", action="store_true", help=f"Don't print the findings and errors (they are printed at most {CONSOLE_LINES_PER_SECOND} a second otherwise)")
+    parser.add_argument("--coordinator", metavar="HOST:PORT", help="Split the scan into work units and hand them out to --worker processes connecting to HOST:PORT")
+    parser.add_argument("--local-workers", type=int, default=0, help="With --coordinator, worker processes to start on this host")
+    parser.add_argument("--worker", metavar="HOST:PORT", help="Scan the work units of the coordinator at HOST:PORT (the Data files are not read)")
+    parser.add_argument("--workdir", help=f"With --worker, the folder of its Output and Cache, kept between runs. Default: a temporary folder in {DISTRIBUTED_WORKERS_FOLDER}")
+    parser.add_argument("--token", default=DISTRIBUTED_TOKEN, help="Shared secret of the coordinator and its workers")
+    parser.add_argument("--profile", action="store_true", help=f"Record the run with cProfile and tracemalloc, the results are written to {PROFILE_FOLDER} (main process only)")
+
+    args = parser.parse_args()
+
+    with profiling(PROFILE_FOLDER) if args.profile else contextlib.nullcontext():
+        if args.worker:
+            from MicrosoftAzure.distributed import Worker
+
+            Worker(args.worker, args.token, args.workdir)
+
+        else:
+            ForgottenClouds(args)
 
@@ -1,42 +1,791 @@
-from MicrosoftAzure.storageAccounts import findStorageAccounts
-from MicrosoftAzure.containers import findContainers
-from MicrosoftAzure.blobs import getBlobs
-from config import INFO, NO_RESULTS
-from utils import writeBlobs
+import asyncio
+import contextlib
+import math
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+from MicrosoftAzure.storageAccounts import storageAccountCandidates, resolveStorageAccount, serviceEndpoints, isBlobEndpoint, endpointGroups, permutation, ACCOUNT_PATTERNS
+from limiter import AdaptiveLimiter
+from config import INFO, WARNING, ERROR, JOURNAL_FILE, DNS_CONCURRENCY, DNS_CACHE_ENABLED, DNS_CACHE_FILE, HIT_RATES_ENABLED, HIT_RATES_FILE, NEGATIVE_FILTER_ENABLED, NEGATIVE_FILTER_FOLDER, INVENTORY_FILE, OUTPUT_FORMAT, ACCOUNTS_QUEUE_SIZE, CONTAINERS_QUEUE_SIZE, PROBE_WORKERS, LISTING_WORKERS, LISTING_PARTITION_CONCURRENCY, HTTP_CONCURRENCY, METRICS_FILE, METRICS_INTERVAL, EVENTS_QUEUE_SIZE, COMPANY_DEADLINE, STAGE_DEADLINE
+from utils import writeBlobs, runBounded
+from dnsCache import DNSCache
+from inventory import Inventory
+from planner import HitRates, Budget, Deadline, ACCOUNT, CONTAINER, CONTAINER_PATTERNS
+from resolver import ResolverPool, FOUND, ABSENT, FAILED, UNKNOWN
+from journal import Journal
+from wordlists import CONTAINER_PART, usableKeywords
+from events import EventStream, createEventStream, AccountFound, ContainerExposed, PageListed, ScanError, ScanNotice, Event
+from metrics import METRICS, metricsFilePath, reportPeriodically
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from itertools import islice
 
-def Azure(companies: list[str], keywords: list[str], resources: list[str]):
+# aiohttp takes most of the startup time and memory: it is imported by the stages that use it
+if TYPE_CHECKING:
+    import aiohttp
+    from columnar import ParquetSink
+    from negativeFilter import NegativeFilter
 
-    storage_account = []
-    containers = []
+'''
+    Pipeline
+
+    Every stage runs in the same event loop and hands its results to the next one through a bounded queue:
+
+        DNS lookups (storage accounts) -> accounts_queue -> container probes -> containers_queue -> blob listing
+
+    A storage account is probed as soon as it resolves and a container is listed as soon as it answers 200,
+    so the stages overlap. When a queue is full the previous stage waits, which keeps memory bounded.
+
+    Every stage records its progress in the journal. On --resume, the work already recorded is not repeated:
+    the stage hands the recorded results to the next stage instead.
+
+    The candidates come by expected yield, from the hit rates of previous runs (see planner.py), and the
+    --dns-budget and --http-budget options cap the lookups and probes of each company. A company whose
+    budget ran out is not recorded as done, so --resume (with a larger budget) continues it.
+
+    The stages report their latencies, errors and bytes to METRICS, written to METRICS_FILE every METRICS_INTERVAL seconds,
+    and what they find to an EventStream (see events.py): the console, --events and the library consumer of scanEvents.
+
+    The mode decides how far the pipeline goes:
+        - accounts:   DNS discovery only. aiohttp is not loaded.
+        - containers: discovery and container probing.
+        - full:       discovery, container probing and blob listing.
+'''
+
+MODES = ["accounts", "containers", "full"]
+
+
+
+async def discoveryStage(companies: list[str], keywords: list[str], resources: list[str], resolver: ResolverPool, cache: DNSCache, journal: Journal, accounts_queue: asyncio.Queue, ranking: Optional[HitRates] = None, budget: Optional[Budget] = None, candidate_range: Optional[tuple[int, int]] = None, events: Optional[EventStream] = None, deadline: Optional[Deadline] = None):
+    """
+        Resolves the storage account candidates of every company and puts every endpoint of each one that exists in the accounts queue.
+            The candidates of all the companies go through a single bounded stream, so there is no pause between companies.
+            A name is resolved once, the other endpoints of its account come from serviceEndpoints.
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            resolver (ResolverPool): The resolvers shared by the whole run.
+            cache (DNSCache): The DNS cache, or None when it is disabled.
+            journal (Journal): The checkpoint journal.
+            accounts_queue (asyncio.Queue): Queue of (company, storage_account) for the container probing stage.
+            ranking (HitRates, optional): The hit rates of previous runs, to resolve the likely storage accounts first.
+            budget (Budget, optional): The DNS lookups of each company.
+            candidate_range (tuple[int, int], optional): Only resolve the candidates from start to stop (a work unit of a distributed scan).
+                They are taken in wordlist order, the same on every host, so the ranking is left out.
+            events (EventStream, optional): Where every endpoint found, every failed lookup and the end of every company are reported.
+            deadline (Deadline, optional): The time of each company and of the stage (COMPANY_DEADLINE, STAGE_DEADLINE).
+    """
 
+    budget = budget or Budget()
+    deadline = deadline or Deadline()
+    events = events or EventStream()
+
+    if candidate_range is not None:
+        ranking = None
+
+    # Companies already discovered in a previous run: hand over the recorded storage accounts
     for company in companies:
-        print(f"[{INFO}] Searching Storage Accounts for company: {company}")
-        storage_accounts = findStorageAccounts(company, keywords, resources)
+        if company in journal.discovered:
+            for storage_account in journal.foundAccounts(company):
+                await accounts_queue.put((company, storage_account))
+
+    pending = [company for company in companies if company not in journal.discovered]
+
+    # Lookups launched, completed and failed per company, to know when a company is done
+    launched = dict.fromkeys(pending, 0)
+    completed = dict.fromkeys(pending, 0)
+    failed = dict.fromkeys(pending, 0)
+    exhausted = set()
+    finished = set()
+
+    def candidates():
+        for company in pending:
+            fqdns = storageAccountCandidates(company, keywords, resources, ranking)
+
+            if candidate_range is not None:
+                fqdns = islice(fqdns, *candidate_range)
+
+            for fqdn in deadline.cap(company, budget.cap(company, fqdns)):
+                launched[company] += 1
+                yield (company, fqdn)
+
+            exhausted.add(company)
+
+    async def discovered(company: str):
+        finished.add(company)
+
+        # A failed or unknown lookup says nothing about the name: the company is not recorded as discovered, so --resume asks again
+        if failed[company] > 0:
+            await events.emit(ScanNotice("dns", company, f"{failed[company]} DNS lookups failed or unknown for company: {company}", "warning"))
+
+        elif deadline.exceeded(company):
+            await events.emit(ScanNotice("dns", company, f"Deadline reached for company: {company}, the candidates left are unknown", "warning"))
+
+        elif budget.exhausted(company):
+            await events.emit(ScanNotice("dns", company, f"DNS budget of {budget.limit} lookups reached for company: {company}"))
 
-        if len(storage_accounts) == 0:
-            print(f"\t[{NO_RESULTS}] No Storage Accounts found for company: {company}")
-        
         else:
-            for storage_account in storage_accounts:
-                print(f"\t\t[{INFO}] Searching Containers for Storage Account: {storage_account}")
-                containers_results = findContainers(storage_account, company, keywords)
+            journal.record("discovered", company=company)
+
+        if len(journal.foundAccounts(company)) == 0:
+            await events.emit(ScanNotice("dns", company, f"No Storage Accounts found for company: {company}", "no_results"))
+
+    async def lookup(candidate: tuple[str, str]) -> tuple[str, str, str]:
+        company, fqdn = candidate
+
+        # A lookup still in flight when the deadline is reached is cut off: the name is unknown
+        return (company, fqdn, await deadline.within(company, resolveStorageAccount(fqdn, resolver, cache), UNKNOWN))
+
+    async for company, storage_account, outcome in runBounded(lookup, candidates(), DNS_CONCURRENCY):
+        completed[company] += 1
+
+        if outcome == FOUND:
+            if ranking is not None:
+                ranking.hit(ACCOUNT, storage_account.split(".")[0], company, ACCOUNT_PATTERNS)
+
+            endpoints = serviceEndpoints(storage_account, resources)
+            METRICS.increment("endpoints_expanded", len(endpoints) - 1)
+
+            for endpoint in endpoints:
+                await events.emit(AccountFound(company, endpoint))
+
+                if endpoint not in journal.foundAccounts(company):
+                    journal.record("account", company=company, storage_account=endpoint)
+
+                await accounts_queue.put((company, endpoint))
+
+        elif outcome in (FAILED, UNKNOWN):
+            failed[company] += 1
+            await events.emit(ScanError("dns", storage_account, f"DNS lookup {outcome}"))
+
+        if company in exhausted and completed[company] == launched[company]:
+            await discovered(company)
+
+    # Companies whose last lookup completed before their candidates were known to be exhausted
+    for company in pending:
+        if company not in finished:
+            await discovered(company)
+
+
+
+async def probeStage(accounts_queue: asyncio.Queue, containers_queue: asyncio.Queue, keywords: list[str], session: "aiohttp.ClientSession", limiter: AdaptiveLimiter, journal: Journal, containers: list[str], ranking: Optional[HitRates] = None, budget: Optional[Budget] = None, negatives: Optional["NegativeFilter"] = None, events: Optional[EventStream] = None, deadline: Optional[Deadline] = None):
+    """
+        Takes storage accounts from the accounts queue and puts every exposed container in the containers queue.
+            Only blob endpoints are probed, the other endpoints of the accounts are skipped. It stops when it receives None.
+
+        Args:
+            accounts_queue (asyncio.Queue): Queue of (company, storage_account) from the discovery stage.
+            containers_queue (asyncio.Queue): Queue of (company, storage_account, container_url, first_page) for the listing stage.
+                first_page is the body of the probe, the first page of the listing (None for containers probed in a previous run).
+            keywords (list[str]): A list of keywords to be included in the container names.
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            limiter (AdaptiveLimiter): The limiter of in-flight probes shared by the whole run.
+            journal (Journal): The checkpoint journal.
+            containers (list[str]): Every exposed container found, to show them at the end of the script execution.
+            ranking (HitRates, optional): The hit rates of previous runs, to probe the likely containers first.
+            budget (Budget, optional): The container probes of each company, shared by every probing worker.
+            negatives (NegativeFilter, optional): The containers that answered 404 in recent runs, skipped.
+            events (EventStream, optional): Where every exposed container, every failed storage account and the probe retries are reported.
+            deadline (Deadline, optional): The time of each company and of the stage, shared by every probing worker.
+    """
+
+    from MicrosoftAzure.containers import streamContainers
+    from MicrosoftAzure.blobs import containerName
+
+    events = events or EventStream()
+
+    while (item := await accounts_queue.get()) is not None:
+        company, storage_account = item
+
+        # Only blob endpoints have containers
+        if not isBlobEndpoint(storage_account):
+            continue
+
+        # Probed in a previous run: hand over the recorded containers
+        if (company, storage_account) in journal.probed:
+            for container in journal.foundContainers(company, storage_account):
+                containers.append(container)
+                await containers_queue.put((company, storage_account, container, None))
+
+            continue
+
+        await events.emit(ScanNotice("probe", storage_account, f"Searching Containers for Storage Account: {storage_account}"))
+
+        found = 0
+        unknown = []
+
+        try:
+            async for container, first_page in streamContainers(storage_account, company, keywords, session, limiter, ranking, budget, negatives, deadline, unknown, events):
+                found += 1
+                containers.append(container)
+                await events.emit(ContainerExposed(company, storage_account, container))
+
+                if ranking is not None:
+                    ranking.hit(CONTAINER, containerName(container), company, CONTAINER_PATTERNS)
+
+                if container not in journal.foundContainers(company, storage_account):
+                    journal.record("container", company=company, storage_account=storage_account, container=container)
 
-                if len(containers_results) == 0:
-                    print(f"\t\t\t[{NO_RESULTS}] No Containers found for Storage Account: {storage_account}")
+                await containers_queue.put((company, storage_account, container, first_page))
+
+            if budget is not None and budget.exhausted(company):
+                await events.emit(ScanNotice("probe", storage_account, f"HTTP budget of {budget.limit} probes reached for company: {company}"))
+
+            elif deadline is not None and deadline.exceeded(company):
+                await events.emit(ScanNotice("probe", storage_account, f"Deadline reached for company: {company}, the containers left are unknown", "warning"))
+
+            # Probes without an answer say nothing about the containers: the account is not recorded as probed, so --resume asks again
+            elif unknown:
+                await events.emit(ScanError("probe", storage_account, f"{len(unknown)} container probes unknown"))
+
+            else:
+                journal.record("probed", company=company, storage_account=storage_account)
+
+        except Exception as e:
+            await events.emit(ScanError("probe", storage_account, str(e)))
+
+        if found == 0:
+            await events.emit(ScanNotice("probe", storage_account, f"No Containers found for Storage Account: {storage_account}", "no_results"))
+
+
+
+async def listingStage(containers_queue: asyncio.Queue, session: "aiohttp.ClientSession", journal: Journal, inventory: Optional[Inventory] = None, sink: Optional["ParquetSink"] = None, events: Optional[EventStream] = None):
+    """
+        Takes exposed containers from the containers queue, lists their blobs and writes them to a CSV file (or to the Parquet sink).
+            With an inventory (--incremental), only the blobs added, modified or removed since the last scan are written.
+            It stops when it receives None.
+
+        Args:
+            containers_queue (asyncio.Queue): Queue of (company, storage_account, container_url, first_page) from the probing stage.
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            journal (Journal): The checkpoint journal.
+            inventory (Inventory, optional): The last known inventory of every container, for --incremental scans.
+            sink (ParquetSink, optional): The Parquet dataset shared by the whole run, when OUTPUT_FORMAT is "parquet".
+            events (EventStream, optional): Where every page written, every failed listing and the listing retries are reported.
+    """
+
+    from MicrosoftAzure.blobs import getBlobs, getBlobsPartitioned, containerName
+
+    events = events or EventStream()
+
+    while (item := await containers_queue.get()) is not None:
+        company, storage_account, container, first_page = item
+
+        # Listed in a previous run
+        if (company, container) in journal.listed:
+            continue
+
+        # Continue a partial listing from its last written page
+        marker = journal.listingMarker(company, container)
+
+        # The whole listing fits in the probe answer and it is the same as last time
+        if inventory is not None and first_page is not None and marker is None and inventory.unchanged(container, first_page):
+            await events.emit(ScanNotice("listing", container, f"No changes since the last scan for Container: {container}"))
+            journal.record("listed", company=company, container=container)
+            continue
+
+        async def diffed(pages):
+            scan = inventory.start(container, resumed=marker is not None)
+            count = 0
+
+            async for blobs, next_marker in pages:
+                count += 1
+                yield (inventory.diff(container, scan, blobs), next_marker)
+
+            # Only a container whose listing fit in the probe answer can be skipped next time
+            single_page = first_page is not None and marker is None and count == 1
+
+            yield (inventory.finish(container, scan, first_page if single_page else None), None)
+
+        async def checkpointed(pages):
+            async for blobs, next_marker in pages:
+                yield blobs
+
+                await events.emit(PageListed(company, storage_account, container, blobs, next_marker))
+
+                # The writer asks for the next page once this one is on disk. Parquet pages are not readable before their part file is complete
+                if next_marker and sink is None:
+                    journal.record("page", company=company, container=container, marker=next_marker)
+
+        # The files and folders the writers create or delete
+        notices = []
+
+        try:
+            # The first page comes from the probe, unless the listing continues from a marker.
+            # Listing by prefix is opt-in (see config.py): those pages have no marker, a listing stopped halfway starts over
+            if LISTING_PARTITION_CONCURRENCY > 1 and marker is None:
+                pages = getBlobsPartitioned(storage_account, container, session, first_page, events=events)
+
+            else:
+                pages = getBlobs(storage_account, container, session, marker, first_page, events)
+
+            if inventory is not None:
+                pages = diffed(pages)
+
+            if sink is not None:
+                from columnar import writeParquet
+
+                # The container is listed once its part file is complete. A failed listing leaves no rows behind
+                written = await writeParquet(checkpointed(pages), sink, company, storage_account, containerName(container), partial(journal.record, "listed", company=company, container=container))
+
+            else:
+                # Write the blobs (or their changes) to a CSV file while the listing goes on
+                written = await writeBlobs(checkpointed(pages), company, storage_account, containerName(container), append=marker is not None, changes=inventory is not None, notices=notices)
+
+                journal.record("listed", company=company, container=container)
+
+            if written == 0 and marker is None:
+                if inventory is not None:
+                    await events.emit(ScanNotice("listing", container, f"No changes since the last scan for Container: {container}"))
 
                 else:
-                    # Add the containers to the list of containers to show them at the end of the script execution
-                    containers.extend(containers_results)
+                    await events.emit(ScanNotice("listing", container, f"Blob is empty for Container: {container}", "no_results"))
+
+        except Exception as e:
+            await events.emit(ScanError("listing", container, str(e)))
+
+        # Part files completed by any listing worker are reported by the first one to see them
+        if sink is not None:
+            notices.extend(sink.notices)
+            sink.notices.clear()
+
+        for level, message in notices:
+            await events.emit(ScanNotice("listing", container, message, level))
+
+
+
+async def collectStage(queue: asyncio.Queue, found: Optional[list[str]] = None):
+    """
+        Takes items from a queue that no further stage consumes and keeps their storage account.
+            It stops when it receives None.
+
+        Args:
+            queue (asyncio.Queue): The queue of the last stage that runs in this mode.
+            found (list[str], optional): Where the storage account of every item is appended. None to only empty the queue.
+    """
+
+    while (item := await queue.get()) is not None:
+        if found is not None:
+            found.append(item[1])
+
+
+
+async def azurePipeline(companies: list[str], keywords: list[str], resources: list[str], journal: Journal, mode: str = "full", incremental: bool = False, dns_budget: Optional[int] = None, http_budget: Optional[int] = None, reprobe: bool = False, candidate_range: Optional[tuple[int, int]] = None, events: Optional[EventStream] = None, summary: Optional[dict] = None) -> list[str]:
+    """
+        Runs the discovery, container probing and blob listing stages concurrently in the current event loop.
+            Nothing is printed: what the stages find goes to the events, and the counts of the run to the summary.
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            journal (Journal): The checkpoint journal. Work already recorded in it is not repeated.
+            mode (str): How far the pipeline goes, one of MODES.
+            incremental (bool): Write only the blobs added, modified or removed since the last scan (see inventory.py).
+            dns_budget (int, optional): DNS lookups per company. None for no limit.
+            http_budget (int, optional): Container probes per company. None for no limit.
+            reprobe (bool): Probe again the containers that answered 404 in recent runs (see negativeFilter.py).
+            candidate_range (tuple[int, int], optional): Only resolve these storage account candidates (see distributed.py).
+            events (EventStream, optional): Where the stages report what they find. The caller closes it.
+            summary (dict, optional): Filled with the counts of the run once it ends, for the command line to print (see printSummary).
+
+        Returns:
+            list[str]: Every storage account found in accounts mode, every exposed container URL found otherwise.
+    """
+
+    accounts = []
+    summary = summary if summary is not None else {}
+    containers = []
+    events = events or EventStream()
+
+    accounts_queue = asyncio.Queue(maxsize=ACCOUNTS_QUEUE_SIZE)
+    containers_queue = asyncio.Queue(maxsize=CONTAINERS_QUEUE_SIZE)
+
+    resolver = ResolverPool()
+    limiter = None
+    cache = DNSCache(DNS_CACHE_FILE) if DNS_CACHE_ENABLED else None
+    inventory = Inventory(INVENTORY_FILE) if incremental and mode == "full" else None
+    ranking = HitRates(HIT_RATES_FILE) if HIT_RATES_ENABLED else None
+    probe_budget = Budget(http_budget)
+    probe_deadline = Deadline(COMPANY_DEADLINE, STAGE_DEADLINE)
+    negatives = None
+    sink = None
+
+    # Values that go up and down, read before every metrics snapshot
+    def gauges() -> dict:
+        values = {"accounts_queue": accounts_queue.qsize(), "containers_queue": containers_queue.qsize()}
+
+        if limiter is not None:
+            values["http_limit"] = round(limiter.limit, 2)
+
+        return values
+
+    metrics_file = metricsFilePath(METRICS_FILE) if METRICS_FILE is not None else None
+
+    async with contextlib.AsyncExitStack() as stack:
+        if mode == "accounts":
+            probers = [asyncio.create_task(collectStage(accounts_queue, accounts))]
+            listers = []
+
+        else:
+            from MicrosoftAzure.containers import createSession, createLimiter
+
+            limiter = createLimiter()
+
+            if NEGATIVE_FILTER_ENABLED:
+                from negativeFilter import NegativeFilter
+
+                negatives = NegativeFilter(NEGATIVE_FILTER_FOLDER, reprobe=reprobe)
+
+            # One HTTP session (and connection pool) shared by every container probe and blob listing of the run
+            session = await stack.enter_async_context(await createSession())
+
+            probers = [asyncio.create_task(probeStage(accounts_queue, containers_queue, keywords, session, limiter, journal, containers, ranking, probe_budget, negatives, events, probe_deadline)) for _ in range(PROBE_WORKERS)]
+
+            if mode == "full":
+                if OUTPUT_FORMAT == "parquet":
+                    from columnar import ParquetSink
+
+                    sink = ParquetSink(changes=incremental)
+
+                listers = [asyncio.create_task(listingStage(containers_queue, session, journal, inventory, sink, events)) for _ in range(LISTING_WORKERS)]
+
+            else:
+                # The containers are already recorded by the probing stage, the queue only has to be emptied
+                listers = [asyncio.create_task(collectStage(containers_queue))]
+
+        reporter = asyncio.create_task(reportPeriodically(metrics_file, METRICS_INTERVAL, gauges)) if metrics_file is not None else None
+
+        try:
+            await discoveryStage(companies, keywords, resources, resolver, cache, journal, accounts_queue, ranking, Budget(dns_budget), candidate_range, events, Deadline(COMPANY_DEADLINE, STAGE_DEADLINE))
+
+            # Each stage is drained before the next one is told to stop
+            for _ in probers:
+                await accounts_queue.put(None)
+            await asyncio.gather(*probers)
+
+            for _ in listers:
+                await containers_queue.put(None)
+            await asyncio.gather(*listers)
+
+        finally:
+            for task in probers + listers + ([reporter] if reporter is not None else []):
+                task.cancel()
+
+            # Before the journal is closed: completing the part files records their containers as listed
+            if sink is not None:
+                sink.close()
+
+            summary["dns"] = resolver.close()
+
+            if cache is not None:
+                summary["dns_cache"] = cache.close()
+
+            if inventory is not None:
+                summary["inventory"] = inventory.close()
+
+            if negatives is not None:
+                summary["negatives"] = negatives.close()
+
+            # After the last latencies are measured: they are kept for the next estimate
+            if ranking is not None:
+                summary["hit_rates"] = ranking.close()
+
+            # Last snapshot, with the final values
+            for name, value in gauges().items():
+                METRICS.gauge(name, value)
+
+            if metrics_file is not None:
+                METRICS.write(metrics_file)
+                summary["metrics_file"] = metrics_file
+
+            summary["metrics"] = METRICS.summary()
+
+    # The part files completed at the end of the run. Not on the way out of a cancelled run: nobody reads the events anymore
+    if sink is not None:
+        for level, message in sink.notices:
+            await events.emit(ScanNotice("listing", str(sink.root), message, level))
+
+    return accounts if mode == "accounts" else containers
+
+
+
+def printSummary(summary: dict):
+    """
+        Prints the counts of a run, as filled in by azurePipeline. Only the command line prints them: scanEvents prints nothing.
+
+        Args:
+            summary (dict): The summary of the run.
+    """
+
+    if "dns" in summary:
+        counts = summary["dns"]
+        print(f"[{INFO}] DNS lookups: {counts[FOUND]} found, {counts[ABSENT]} absent, {counts[FAILED]} failed, {counts[UNKNOWN]} unknown")
+
+        if counts[FAILED] + counts[UNKNOWN] > 0:
+            print(f"[{WARNING}] {counts[FAILED] + counts[UNKNOWN]} DNS lookups failed or ran past their deadline (timeout, SERVFAIL, ...). Their names may exist")
+
+    if "dns_cache" in summary:
+        print(f"[{INFO}] DNS cache: {summary['dns_cache']['hits']} hits, {summary['dns_cache']['misses']} misses")
+
+    if "inventory" in summary:
+        counts = summary["inventory"]
+        print(f"[{INFO}] Inventory: {counts['added']} added, {counts['modified']} modified, {counts['removed']} removed, {counts['unchanged_containers']} containers unchanged")
+
+    if "negatives" in summary:
+        counts = summary["negatives"]
+        print(f"[{INFO}] Negative filter: {counts['skipped']} probes skipped, {counts['added']} 404 answers added, {counts['pairs']} pairs in {counts['generations']} generations")
+
+    if "hit_rates" in summary:
+        tries, hits = summary["hit_rates"]["tries"], summary["hit_rates"]["hits"]
+        print(f"[{INFO}] Hit rates: {hits[ACCOUNT]} storage accounts out of {tries[ACCOUNT]} keyword candidates, {hits[CONTAINER]} containers out of {tries[CONTAINER]}")
+
+    if "metrics_file" in summary:
+        print(f"[{INFO}] Metrics written to {summary['metrics_file']}")
+
+    for line in summary.get("metrics", "").splitlines():
+        print(f"\t[{INFO}] {line}")
+
+
+
+async def scanEvents(companies: list[str], keywords: list[str], resources: list[str], mode: str = "full", incremental: bool = False, dns_budget: Optional[int] = None, http_budget: Optional[int] = None, reprobe: bool = False, resume: bool = False) -> AsyncIterator[Event]:
+    """
+        Library entry point: runs the pipeline in the current event loop and yields what it finds as typed events (see events.py).
+            The stages wait while EVENTS_QUEUE_SIZE events wait for the consumer. The stages print nothing: their progress comes as ScanNotice events.
+            Leaving the loop stops the scan, resume=True continues it later.
+
+                async for event in scanEvents(["contoso"], keywords, resources):
+                    if isinstance(event, ContainerExposed):
+                        ...
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            mode (str): How far the pipeline goes, one of MODES.
+            incremental (bool): The pages only hold the blobs added, modified or removed since the last scan.
+            dns_budget (int, optional): DNS lookups per company.
+            http_budget (int, optional): Container probes per company.
+            reprobe (bool): Probe again the containers that answered 404 in recent runs.
+            resume (bool): Continue from the journal instead of starting a new one. Findings recorded in it are not yielded again.
+
+        Yields:
+            Event: AccountFound, ContainerExposed, PageListed, ScanError or ScanNotice.
+
+        Raises:
+            Exception: Whatever stopped the pipeline.
+    """
+
+    queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+    journal = Journal(JOURNAL_FILE, resume)
+
+    async def scan():
+        try:
+            await azurePipeline(companies, keywords, resources, journal, mode, incremental, dns_budget, http_budget, reprobe, events=EventStream(queue=queue))
+
+        except Exception as e:
+            await queue.put(e)
+            return
+
+        # End of the events
+        await queue.put(None)
+
+    scanner = asyncio.create_task(scan())
+
+    try:
+        while (event := await queue.get()) is not None:
+            if isinstance(event, Exception):
+                raise event
+
+            yield event
+
+    finally:
+        scanner.cancel()
+
+        with contextlib.suppress(asyncio.CancelledError):
+            await scanner
+
+        journal.close()
+
+
+
+def scanShard(companies: list[str], keywords: list[str], resources: list[str], mode: str = "full", incremental: bool = False, dns_budget: Optional[int] = None, http_budget: Optional[int] = None, reprobe: bool = False, events_file: Optional[str] = None, quiet: bool = False) -> list[str]:
+    """
+        Runs the pipeline for a shard of companies in a worker process, with its own event loop, session and limits.
+            The worker appends to the journal and the events file started by the parent process.
+
+        Args:
+            companies (list[str]): The company names of the shard.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            mode (str): How far the pipeline goes, one of MODES.
+            incremental (bool): Write only the changes since the last scan.
+            dns_budget (int, optional): DNS lookups per company.
+            http_budget (int, optional): Container probes per company.
+            reprobe (bool): Probe again the containers that answered 404 in recent runs.
+            events_file (str, optional): The JSONL file of the events.
+            quiet (bool): Don't print the findings and errors.
+
+        Returns:
+            list[str]: Every storage account found in accounts mode, every exposed container URL found otherwise.
+    """
+
+    journal = Journal(JOURNAL_FILE, resume=True)
+    events = createEventStream(events_file, quiet, append=True)
+    summary = {}
+
+    try:
+        return asyncio.run(azurePipeline(companies, keywords, resources, journal, mode, incremental, dns_budget, http_budget, reprobe, events=events, summary=summary))
+
+    finally:
+        journal.close()
+        events.close()
+        printSummary(summary)
+
+
+
+def scanParallel(companies: list[str], keywords: list[str], resources: list[str], workers: int, mode: str = "full", incremental: bool = False, dns_budget: Optional[int] = None, http_budget: Optional[int] = None, reprobe: bool = False, events_file: Optional[str] = None, quiet: bool = False) -> list[str]:
+    """
+        Spreads the companies across a pool of worker processes and merges the results they find.
+            Companies are handed out in small shards, so a worker that finishes early takes the next one.
+            Each worker writes its CSV files to the usual Output/<company>/ folders.
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            workers (int): The number of worker processes.
+            mode (str): How far the pipeline goes, one of MODES.
+            incremental (bool): Write only the changes since the last scan.
+            dns_budget (int, optional): DNS lookups per company.
+            http_budget (int, optional): Container probes per company.
+            reprobe (bool): Probe again the containers that answered 404 in recent runs.
+            events_file (str, optional): The JSONL file of the events, every worker appends to it.
+            quiet (bool): Don't print the findings and errors.
+
+        Returns:
+            list[str]: Every storage account found in accounts mode, every exposed container URL found otherwise.
+    """
+
+    results = []
+
+    # About four shards per worker, to balance companies with very different amounts of work
+    shard_size = max(1, math.ceil(len(companies) / (workers * 4)))
+    shards = [companies[i:i + shard_size] for i in range(0, len(companies), shard_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(scanShard, shard, keywords, resources, mode, incremental, dns_budget, http_budget, reprobe, events_file, quiet) for shard in shards]
+
+        for future in as_completed(futures):
+            try:
+                results.extend(future.result())
+
+            except Exception as e:
+                print(f"[{ERROR}] scanParallel - {e}")
+
+    return results
+
+
+
+def estimateRun(companies: list[str], keywords: list[str], resources: list[str], mode: str = "full", workers: int = 1, dns_budget: Optional[int] = None, http_budget: Optional[int] = None) -> dict:
+    """
+        Counts the candidates of a run and estimates its duration from the hit rates and latencies of previous runs (see planner.py).
+            The number of storage accounts found is only known from previous runs, and the blob listings are left out.
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            mode (str): How far the pipeline goes, one of MODES.
+            workers (int): The number of worker processes.
+            dns_budget (int, optional): DNS lookups per company.
+            http_budget (int, optional): Container probes per company.
+
+        Returns:
+            dict: dns_lookups, probes_per_account (the container candidates of a storage account), accounts and http_probes
+                (expected, None without history), the estimated seconds of each stage (dns_s, http_s) and the stages whose latency was measured.
+    """
+
+    rates = HitRates(HIT_RATES_FILE)
+
+    try:
+        groups = len(endpointGroups(resources))
+        dns_lookups = 0
+        accounts = None if rates.rate(ACCOUNT) is None else 0.0
+
+        for company in companies:
+            lookups = sum(1 for _ in permutation(company, keywords)) * groups
+            lookups = min(lookups, dns_budget) if dns_budget is not None else lookups
+            dns_lookups += lookups
+
+            if accounts is not None:
+                accounts += lookups * rates.rate(ACCOUNT)
+
+        # Before validation and duplicates: the company and storage account names, then every usable keyword in every pattern
+        probes_per_account = 2 + len(usableKeywords(keywords, CONTAINER_PART)) * len(CONTAINER_PATTERNS)
+        http_probes = None
+
+        if mode != "accounts" and accounts is not None:
+            http_probes = accounts * probes_per_account
+
+            if http_budget is not None:
+                http_probes = min(http_probes, http_budget * len(companies))
+
+        return {
+            "dns_lookups": dns_lookups,
+            "probes_per_account": probes_per_account,
+            "accounts": accounts,
+            "http_probes": http_probes,
+            "dns_s": dns_lookups * rates.latency["dns"] / DNS_CONCURRENCY / workers,
+            "http_s": http_probes * rates.latency["http"] / HTTP_CONCURRENCY / workers if http_probes is not None else None,
+            "measured": sorted(rates.measured),
+        }
+
+    finally:
+        rates.close(save=False)
+
+
+
+def Azure(companies: list[str], keywords: list[str], resources: list[str], resume: bool = False, workers: int = 1, mode: str = "full", incremental: bool = False, dns_budget: Optional[int] = None, http_budget: Optional[int] = None, reprobe: bool = False, events_file: Optional[str] = None, quiet: bool = False):
+
+    print(f"[{INFO}] Searching Storage Accounts for companies: {', '.join(companies)}")
+
+    estimate = estimateRun(companies, keywords, resources, mode, workers, dns_budget, http_budget)
+    source = "latencies of the last run" if estimate["measured"] else "default latencies"
+
+    print(f"[{INFO}] Candidate space: {estimate['dns_lookups']} DNS lookups, up to {estimate['probes_per_account']} container probes per Storage Account found")
+
+    if estimate["http_s"] is not None:
+        print(f"[{INFO}] Expected from previous runs: ~{estimate['accounts']:.0f} Storage Accounts, ~{estimate['http_probes']:.0f} container probes")
+        print(f"[{INFO}] Estimated duration: ~{estimate['dns_s'] + estimate['http_s']:.0f}s (DNS ~{estimate['dns_s']:.0f}s, probes ~{estimate['http_s']:.0f}s, from the {source}, blob listings not included)")
+
+    else:
+        print(f"[{INFO}] Estimated duration of the DNS discovery: ~{estimate['dns_s']:.0f}s (from the {source})")
+
+    # A new run starts a new journal, --resume keeps appending to the previous one
+    journal = Journal(JOURNAL_FILE, resume)
+
+    if resume:
+        print(f"[{INFO}] Resuming from journal {JOURNAL_FILE}: {journal.summary()}")
+
+    # Same as the journal: a new run starts a new events file
+    events = createEventStream(events_file, quiet, append=resume)
+
+    if workers > 1:
+        # The worker processes append to the journal and the events file on their own
+        journal.close()
+        events.close()
+        results = scanParallel(companies, keywords, resources, workers, mode, incremental, dns_budget, http_budget, reprobe, events_file, quiet)
+
+    else:
+        summary = {}
 
-                    # Get the blobs for each container
-                    for container in containers_results:
-                        blobs, container_name = getBlobs(storage_account, container)
+        try:
+            results = asyncio.run(azurePipeline(companies, keywords, resources, journal, mode, incremental, dns_budget, http_budget, reprobe, events=events, summary=summary))
 
-                        if len(blobs) == 0:
-                            print(f"\t\t\t\t[{NO_RESULTS}] Blob is empty for Container: {container}")
-                        
-                        else:
-                            # Write the blobs to a CSV file
-                            writeBlobs(blobs, company, storage_account, container_name)
+        finally:
+            journal.close()
+            events.close()
+            printSummary(summary)
 
-    print(containers.__str__())
+    print(results.__str__())
@@ -1,52 +1,434 @@
-from azure.storage.blob import BlobServiceClient
-import base64
+from MicrosoftAzure.containers import backoff
+from metrics import METRICS
+from config import HTTP_RETRIES, HTTP_RETRY_STATUSES, LISTING_DELIMITER, LISTING_PARTITION_CONCURRENCY, LISTING_PARTITION_DEPTH
+from utils import BlobRecord
+from events import EventStream, ScanNotice
+from typing import AsyncIterator, Optional
+from urllib.parse import quote, urlsplit
+import xml.etree.ElementTree as ElementTree
+import asyncio
+import aiohttp
 
+'''
+    Info
 
+    The blobs are listed with the List Blobs REST call, the same one the container probes send:
 
-def getBlobs(storage_account: str, container_url: str) -> list[dict]:
+        https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list[&marker=<NextMarker>]
+
+    Every page (up to 5000 blobs) goes through the HTTP session of the run and its XML is parsed straight into
+    BlobRecord tuples, keeping the fields as they come. Formatting (dates, URL, ...) happens when they are written.
+
+    A marker is only known once the previous page arrives, so a container is listed one page at a time. Large containers
+    are split instead (see getBlobsPartitioned): a listing with a delimiter returns the blobs of a level and its prefixes
+    ("folders"), and the prefixes are listed at the same time. A prefix that is still large is split again, down to
+    LISTING_PARTITION_DEPTH levels:
+
+        <container_url>&prefix=<prefix>&delimiter=/     The blobs right under <prefix> and its <BlobPrefix> elements
+        <container_url>&prefix=<prefix>                 Every blob under <prefix>, in name order
+
+    Names are listed in order inside a prefix, so every blob before the last name already written can be left out.
+    The prefix holding the last name of a page already listed continues that listing from its marker instead of
+    starting over, and a level without prefixes (a flat container) is listed one page at a time from the first one.
+'''
+
+# XML tags of the blob properties, in the order of the BlobRecord fields after the name
+PROPERTY_TAGS = (
+    "Creation-Time",
+    "Last-Modified",
+    "BlobType",
+    "Etag",
+    "Content-Length",
+    "Content-Type",
+    "Content-Encoding",
+    "Content-Language",
+    "Content-MD5",
+    "LeaseStatus",
+    "LeaseState",
+)
+
+
+
+def containerName(container_url: str) -> str:
+    """
+        Extracts the container name from a container URL.
+
+        Args:
+            container_url (str): "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"
+
+        Returns:
+            str: "<mycontainer>"
+    """
+
+    # The container is the last segment of the path, for both the Azure and the path-style (emulator) URLs
+    return urlsplit(container_url).path.rstrip("/").split("/")[-1]
+
+
+
+def listingURL(container_url: str, marker: Optional[str] = None, prefix: Optional[str] = None, delimiter: Optional[str] = None) -> str:
     """
-        Retrieves a list of blobs from a given container in a storage account.
+        Builds the URL of a listing page.
 
         Args:
-            storage_account (str): The storage account name.
-            container (str): The container name.
+            container_url (str): "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"
+            marker (str, optional): The marker of the page, None for the first one.
+            prefix (str, optional): Only the blobs whose name starts with it.
+            delimiter (str, optional): Group the names with the delimiter after the prefix into <BlobPrefix> elements.
 
         Returns:
-            list[dict]: A list of dictionaries containing blob information.
+            str: The URL.
+    """
+
+    parameters = [("prefix", prefix), ("delimiter", delimiter), ("marker", marker)]
+
+    return "".join([container_url, *(f"&{name}={quote(value, safe='')}" for name, value in parameters if value)])
+
+
+
+def parseBlobs(root: ElementTree.Element) -> list[BlobRecord]:
+    """
+        Parses the blobs of a List Blobs response into blob records.
     """
 
     blobs = []
 
-    # From this: "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"; to this: "<mycontainer>"
-    container = container_url.split("/")[3].split("?")[0]
-
-    # Create a BlobServiceClient object with the storage account URL
-    blob_service_client = BlobServiceClient(
-        account_url = storage_account,
-    )
-
-    # Get a reference to the container
-    container_client = blob_service_client.get_container_client(container)
-
-    # List all blobs in the container
-    for blob in container_client.list_blobs():
-
-        blob_dict = {}
-        blob_dict["name"] = blob.__dict__.get("name")
-        blob_dict["container"] = blob.__dict__.get("container")
-        blob_dict["url"] = "".join([storage_account, "/", container, "/", blob.name])
-        blob_dict["creation_time"] = blob.__dict__.get("creation_time").strftime("%Y-%m-%d %H:%M:%S")
-        blob_dict["last_modified"] = blob.__dict__.get("last_modified").strftime("%Y-%m-%d %H:%M:%S")
-        blob_dict["blob_type"] = blob.__dict__.get("blob_type").name
-        blob_dict["etag"] = blob.__dict__.get("etag")
-        blob_dict["size"] = blob.__dict__.get("size")
-        blob_dict["content_type"] = blob.__dict__.get("content_settings").get("content_type")        
-        blob_dict["content_encoding"] = blob.__dict__.get("content_settings").get("content_encoding")
-        blob_dict["content_language"] = blob.__dict__.get("content_settings").get("content_language")
-        blob_dict["content_md5"] = base64.b64encode(blob.__dict__.get("content_settings").get("content_md5")).decode("utf-8") if blob.__dict__.get("content_settings").get("content_md5") is not None else None
-        blob_dict["status"] = blob.__dict__.get("lease").get("status")
-        blob_dict["state"] = blob.__dict__.get("lease").get("state")
-
-        blobs.append(blob_dict)
-
-    return (blobs, container)
\ No newline at end of file
+    for blob in root.iterfind("Blobs/Blob"):
+        properties = blob.find("Properties")
+
+        # One pass over the properties; empty elements (<Content-Encoding />) are None
+        values = {child.tag: child.text or None for child in properties} if properties is not None else {}
+        fields = [values.get(tag) for tag in PROPERTY_TAGS]
+
+        # Content-Length is the only number
+        if fields[4] is not None:
+            fields[4] = int(fields[4])
+
+        blobs.append(BlobRecord(blob.findtext("Name"), *fields))
+
+    return blobs
+
+
+
+def parseListing(body: bytes) -> tuple[list[BlobRecord], Optional[str]]:
+    """
+        Parses a List Blobs response (a listing page, or the body of a container probe) into blob records.
+
+        Args:
+            body (bytes): The XML body of "<container_url>?restype=container&comp=list".
+
+        Returns:
+            tuple[list[BlobRecord], Optional[str]]: The blobs of the page and the marker of the next page (None for the last page).
+    """
+
+    root = ElementTree.fromstring(body)
+
+    return (parseBlobs(root), root.findtext("NextMarker") or None)
+
+
+
+def parseDelimitedListing(body: bytes) -> tuple[list[BlobRecord], list[str], Optional[str]]:
+    """
+        Parses a List Blobs response of a delimiter listing.
+
+        Args:
+            body (bytes): The XML body of "<container_url>&prefix=<prefix>&delimiter=<delimiter>".
+
+        Returns:
+            tuple[list[BlobRecord], list[str], Optional[str]]: The blobs right under the prefix, the prefixes of the next level and the marker of the next page.
+    """
+
+    root = ElementTree.fromstring(body)
+
+    return (parseBlobs(root), [prefix.findtext("Name") for prefix in root.iterfind("Blobs/BlobPrefix")], root.findtext("NextMarker") or None)
+
+
+
+async def fetchPage(session: aiohttp.ClientSession, URL: str, events: Optional[EventStream] = None) -> bytes:
+    """
+        Requests a listing page. Throttling (HTTP_RETRY_STATUSES), timeouts and dropped connections are retried up to HTTP_RETRIES times with jittered backoff.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            URL (str): The container URL, with the marker of the page.
+            events (EventStream, optional): Where the retries are reported.
+
+        Returns:
+            bytes: The XML body.
+
+        Raises:
+            aiohttp.ClientResponseError: Any other status (e.g. the container is not public anymore), or the last retry failed.
+    """
+
+    events = events or EventStream()
+
+    for attempt in range(HTTP_RETRIES + 1):
+        retry_after = None
+
+        try:
+            async with session.get(URL) as response:
+                body = await response.read()
+
+                if response.status == 200:
+                    METRICS.addBytes("listing", len(body))
+                    return body
+
+                if response.status not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+                    response.raise_for_status()
+
+                    # Not an error status, but not a listing either
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status, message="Unexpected listing answer")
+
+                await events.emit(ScanNotice("listing", URL, f"HTTP {response.status} for {URL}", "warning"))
+                METRICS.error("listing", f"HTTP {response.status}")
+                retry_after = response.headers.get("Retry-After")
+
+        except (aiohttp.ClientOSError, aiohttp.ServerDisconnectedError, asyncio.TimeoutError) as e:
+            if attempt == HTTP_RETRIES:
+                raise
+
+            await events.emit(ScanNotice("listing", URL, f"aiohttp error for {URL} - {type(e).__name__} {e}", "warning"))
+            METRICS.error("listing", type(e).__name__)
+
+        await asyncio.sleep(backoff(attempt, retry_after))
+
+
+
+async def getBlobs(storage_account: str, container_url: str, session: aiohttp.ClientSession, marker: Optional[str] = None, first_page: Optional[bytes] = None, events: Optional[EventStream] = None) -> AsyncIterator[tuple[list[BlobRecord], Optional[str]]]:
+    """
+        Retrieves the blobs from a given container in a storage account, one listing page at a time.
+            Only the current page is kept in memory.
+
+        Args:
+            storage_account (str): The storage account FQDN.
+            container_url (str): The container URL.
+            session (aiohttp.ClientSession): The session shared by the whole run (see createSession).
+            marker (str, optional): Continuation marker of a previous, partial listing. The listing starts from it.
+            first_page (bytes, optional): The body of the container probe, i.e. the first page of the listing.
+                It is parsed instead of being requested again, and the listing continues from its NextMarker.
+            events (EventStream, optional): Where the retries are reported.
+
+        Yields:
+            tuple[list[BlobRecord], Optional[str]]: The blobs of a listing page and the marker of the next page (None for the last page).
+    """
+
+    if first_page is not None and marker is None:
+        blobs, marker = parseListing(first_page)
+        METRICS.increment("listing_pages_reused")
+
+        yield (blobs, marker)
+
+        # Small containers fit in the probe answer: no request at all
+        if marker is None:
+            return
+
+    while True:
+        # A page is measured from its request to its last blob parsed, the time the caller spends on it is left out
+        async with METRICS.track("listing"):
+            body = await fetchPage(session, listingURL(container_url, marker), events)
+            blobs, marker = parseListing(body)
+
+        yield (blobs, marker)
+
+        if marker is None:
+            return
+
+
+
+async def continueListing(session: aiohttp.ClientSession, container_url: str, prefix: str, query_prefix: str, marker: Optional[str], events: Optional[EventStream] = None) -> tuple[list[BlobRecord], Optional[str]]:
+    """
+        Fetches a page of the listing of query_prefix and keeps the blobs under prefix, which query_prefix leads to.
+            A partition continues the listing of its parent this way, from a marker that is only valid in that listing.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            container_url (str): The container URL.
+            prefix (str): The prefix of the partition.
+            query_prefix (str): The prefix of the listing the marker belongs to.
+            marker (str, optional): The marker of the page, None for the first one.
+            events (EventStream, optional): Where the retries are reported.
+
+        Returns:
+            tuple[list[BlobRecord], Optional[str]]: The blobs under prefix and the marker of the next page (None once the listing is past prefix).
+    """
+
+    async with METRICS.track("listing"):
+        blobs, marker = parseListing(await fetchPage(session, listingURL(container_url, marker, query_prefix), events))
+
+    inside = [blob for blob in blobs if blob.name.startswith(prefix)]
+
+    # Names come in order: past the first one outside prefix, the rest of the listing belongs to other partitions
+    return (inside, marker if len(inside) == len(blobs) else None)
+
+
+
+async def listPartition(session: aiohttp.ClientSession, container_url: str, prefix: str, level: int, after: Optional[str], pages: asyncio.Queue, partitions: asyncio.Queue, depth: int, first: Optional[tuple[list[BlobRecord], Optional[str]]] = None, resume: Optional[tuple[str, str]] = None, events: Optional[EventStream] = None):
+    """
+        Lists the blobs under a prefix (a partition of getBlobsPartitioned) and puts its pages in the pages queue.
+            A prefix that doesn't fit in a page is split with a delimiter listing: its blobs are put with the pages,
+            and its sub-prefixes in the partitions queue, to be listed by any worker.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            container_url (str): The container URL.
+            prefix (str): The prefix of the partition, "" for the whole container.
+            level (int): The number of splits that led to the partition.
+            after (str, optional): The blobs up to this name are already listed and left out.
+            pages (asyncio.Queue): Where the pages of blobs are put.
+            partitions (asyncio.Queue): Where the sub-prefixes are put, as (prefix, level, after, resume).
+            depth (int): The levels a partition can be split into.
+            first (tuple[list[BlobRecord], Optional[str]], optional): The first page of the partition, already put with the pages.
+            resume (tuple[str, str], optional): The prefix of the parent listing and its marker: the partition continues
+                that listing instead of fetching again the names up to `after`.
+            events (EventStream, optional): Where the retries are reported.
+    """
+
+    query_prefix, marker = resume or (prefix, None)
+
+    if first is None:
+        first = await continueListing(session, container_url, prefix, query_prefix, marker, events)
+
+        await pages.put([blob for blob in first[0] if after is None or blob.name > after])
+
+    blobs, marker = first
+
+    if marker is None:
+        return
+
+    # Every name up to the last one of the first page is listed
+    last = max(after or "", blobs[-1].name if blobs else "")
+
+    # Deep enough: the rest of the prefix is listed one page at a time
+    if level >= depth:
+        await followListing(session, container_url, prefix, query_prefix, marker, last, pages, events)
+        return
+
+    # The marker of the first page, for the sub-prefix holding its last name
+    first_marker = marker
+    marker = None
+    split = False
+
+    while True:
+        async with METRICS.track("listing"):
+            blobs, prefixes, marker = parseDelimitedListing(await fetchPage(session, listingURL(container_url, marker, prefix, LISTING_DELIMITER), events))
+
+        # No sub-prefix in a whole page (e.g. a flat container): nothing to split, the first page is followed instead
+        if not split and not prefixes and marker is not None:
+            METRICS.increment("listing_unsplit")
+            await followListing(session, container_url, prefix, query_prefix, first_marker, last, pages, events)
+            return
+
+        split = True
+
+        await pages.put([blob for blob in blobs if blob.name > last])
+
+        for sub_prefix in prefixes:
+            # Every name under a prefix before the last one listed (and not leading to it) is already listed
+            if sub_prefix < last and not last.startswith(sub_prefix):
+                continue
+
+            if last.startswith(sub_prefix):
+                partitions.put_nowait((sub_prefix, level + 1, last, (query_prefix, first_marker)))
+
+            else:
+                partitions.put_nowait((sub_prefix, level + 1, None, None))
+
+        if marker is None:
+            return
+
+
+
+async def followListing(session: aiohttp.ClientSession, container_url: str, prefix: str, query_prefix: str, marker: str, last: str, pages: asyncio.Queue, events: Optional[EventStream] = None):
+    """
+        Lists the rest of a partition one page at a time, following the markers of the listing of query_prefix.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            container_url (str): The container URL.
+            prefix (str): The prefix of the partition.
+            query_prefix (str): The prefix of the listing the marker belongs to.
+            marker (str): The marker of the next page.
+            last (str): The blobs up to this name are already listed and left out.
+            pages (asyncio.Queue): Where the pages of blobs are put.
+            events (EventStream, optional): Where the retries are reported.
+    """
+
+    while marker is not None:
+        blobs, marker = await continueListing(session, container_url, prefix, query_prefix, marker, events)
+
+        await pages.put([blob for blob in blobs if blob.name > last])
+
+
+
+async def getBlobsPartitioned(storage_account: str, container_url: str, session: aiohttp.ClientSession, first_page: Optional[bytes] = None, concurrency: int = LISTING_PARTITION_CONCURRENCY, depth: int = LISTING_PARTITION_DEPTH, events: Optional[EventStream] = None) -> AsyncIterator[tuple[list[BlobRecord], Optional[str]]]:
+    """
+        Retrieves the blobs from a given container in a storage account, listing its prefixes at the same time (see the top of the module).
+            A container that fits in a page is listed as with getBlobs. Otherwise the pages come in no particular order,
+            every blob once, and at most `concurrency` pages are kept in memory.
+
+        Args:
+            storage_account (str): The storage account FQDN.
+            container_url (str): The container URL.
+            session (aiohttp.ClientSession): The session shared by the whole run (see createSession).
+            first_page (bytes, optional): The body of the container probe, i.e. the first page of the listing.
+            concurrency (int): The prefixes listed at the same time.
+            depth (int): The levels of prefixes a large container can be split into.
+            events (EventStream, optional): Where the retries are reported.
+
+        Yields:
+            tuple[list[BlobRecord], Optional[str]]: The blobs of a page, and None: the pages of the prefixes don't make a marker to continue from.
+    """
+
+    if first_page is not None:
+        first = parseListing(first_page)
+        METRICS.increment("listing_pages_reused")
+
+    else:
+        async with METRICS.track("listing"):
+            first = parseListing(await fetchPage(session, container_url, events))
+
+    yield (first[0], None)
+
+    if first[1] is None:
+        return
+
+    partitions = asyncio.Queue()
+    pages = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        while True:
+            prefix, level, after, resume = await partitions.get()
+
+            try:
+                await listPartition(session, container_url, prefix, level, after, pages, partitions, depth, resume=resume, events=events)
+
+            except Exception as e:
+                await pages.put(e)
+
+            finally:
+                partitions.task_done()
+
+    async def root():
+        try:
+            await listPartition(session, container_url, "", 0, None, pages, partitions, depth, first, events=events)
+
+        except Exception as e:
+            await pages.put(e)
+
+        # The partitions found by the root are queued before it returns: once they are all done, so is the listing
+        await partitions.join()
+        await pages.put(None)
+
+    tasks = [asyncio.ensure_future(root())] + [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+
+    try:
+        while (page := await pages.get()) is not None:
+            if isinstance(page, Exception):
+                raise page
+
+            if page:
+                yield (page, None)
+
+    finally:
+        # The listing failed or the consumer stopped early: do not leave orphan tasks behind
+        for task in tasks:
+            task.cancel()
@@ -1,22 +1,41 @@
 import asyncio
 import aiohttp
-from config import INFO, BUCKET, ERROR, WARNING
+import random
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Iterator, Optional, Union
+from urllib.parse import urlsplit
+from config import BLOB_ENDPOINT, AZURE_STORAGE_API_VERSION, HTTP_CONCURRENCY, HTTP_CONCURRENCY_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_STATUSES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, HTTP_ADAPTIVE_INITIAL, HTTP_ADAPTIVE_MINIMUM, HTTP_TIMEOUT, HTTP_REQUEST_DEADLINE, HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MAX_RATIO
+from utils import runBounded
+from events import EventStream, ConsoleView, ContainerExposed, ScanError, ScanNotice
+from limiter import AdaptiveLimiter
+from metrics import METRICS
+from planner import HitRates, Budget, Deadline, CONTAINER, CONTAINER_PATTERNS, affixes
+from resolver import UNKNOWN
+from wordlists import VALID_CONTAINER, CONTAINER_PART, usableKeywords
+
+if TYPE_CHECKING:
+    from negativeFilter import NegativeFilter
 
 ''' 
     Info
 
     1. https://learn.microsoft.com/en-us/azure/storage/blobs/storage-blobs-introduction#blob-storage-resources
         - Container names can be between 3 and 63 characters long.
-        - Container names must start with a letter or number, and can contain only lowercase letters, numbers, and the dash (-) character.
+        - Container names must start and end with a letter or number, and can contain only lowercase letters, numbers, and the dash (-) character.
         - Two or more consecutive dash characters aren't permitted in container names.
 
         https://<mystorageaccount>.blob.core.windows.net/<mycontainer>
 
         https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list
 
-'''
+    2. With BLOB_ENDPOINT set (emulators), URLs are path-style:
+
+        http://127.0.0.1:10000/<mystorageaccount>/<mycontainer>?restype=container&comp=list
+
+    3. Every request has HTTP_TIMEOUT seconds to connect and for each read, HTTP_REQUEST_DEADLINE in all, and a probe slower than HEDGE_PERCENTILE of the probes
+       measured so far is sent a second time: the first answer wins and the other request is cancelled
+       (at most HEDGE_MAX_RATIO of the probes). A probe with no answer after its retries is UNKNOWN, not absent.
 
-ALLOWED_CHARACTERS = "abcdefghijklmnopqrstuvwxyz0123456789-"
+'''
 
 
 
@@ -25,6 +44,8 @@ def validatePermutation(permutation: str) -> bool:
         Validates the container name permutation by checking if it meets the following criteria:
             - The permutation is between 3 and 63 characters in length.
             - The permutation contains only lowercase letters, numbers and the dash (-) character.
+            - The permutation starts and ends with a letter or number.
+            - The permutation doesn't contain two consecutive dashes.
         
         Args:
             permutation (str): The container name permutation to be validated.
@@ -33,167 +54,519 @@ def validatePermutation(permutation: str) -> bool:
             bool: True if the permutation is valid, False otherwise.
     """
 
-    # Set True by default
-    is_valid_permutation = True
+    return VALID_CONTAINER.fullmatch(permutation) is not None
+
+
 
-    # length between 3 and 63
-    if 3 <= len(permutation) <= 63:
-        # All characters are allowed
-        if all(char in ALLOWED_CHARACTERS for char in permutation):
-            is_valid_permutation = True
+def permutation(company_name: str, storage_account: str, keywords: Iterable[str], ranking: Optional[HitRates] = None) -> Iterator[str]:
+    """
+        Generates permutations of container names by combining company name, keywords and "-" (see CONTAINER_PATTERNS).
+            Candidates are yielded lazily, only once each and only if they are valid container names.
+
+        Args:
+            company_name (str): The company name to be used in the container names.
+            storage_account (str): The storage account name to be used in the container names.
+            keywords (Iterable[str]): The keywords to be included in the container names.
+            ranking (HitRates, optional): The hit rates of previous runs. The candidates come by expected yield instead of in wordlist order.
+
+        Yields:
+            str: A potential container
+    """
+
+    # Container names are lowercase, the company name keeps its spelling everywhere else
+    company_name = company_name.lower()
+
+    # Candidates already yielded for this storage account (e.g. a keyword equal to the company name)
+    seen = set()
+
+    patterns = {pattern: affixes(template, company_name) for pattern, template in CONTAINER_PATTERNS.items()}
+
+    def candidates() -> Iterator[tuple[str, Optional[str], Optional[str]]]:
+        # company_name as container name
+        yield (company_name, None, None)
+
+        # storage_account as container name
+        yield (storage_account, None, None)
+
+        # Keywords that can't make a valid name are left out before building anything
+        usable = usableKeywords(keywords, CONTAINER_PART)
+
+        if ranking is None:
+            order = ((keyword, pattern) for keyword in usable for pattern in patterns)
 
         else:
-            # Invalid characters in container name
-            is_valid_permutation = False
+            order = ranking.rank(CONTAINER, list(usable), list(patterns))
+
+        for keyword, pattern in order:
+            before, after = patterns[pattern]
+            yield ("".join([before, keyword, after]), keyword, pattern)
 
-    else:
-        # Invalid container name length
-        is_valid_permutation = False
+    for candidate, keyword, pattern in candidates():
+        if candidate not in seen and validatePermutation(candidate):
+            seen.add(candidate)
 
-    return is_valid_permutation
+            if ranking is not None and keyword is not None:
+                ranking.tried(CONTAINER, keyword, pattern)
 
+            yield candidate
 
 
-def permutation(company_name: str, storage_account: str, keywords: list[str]) -> list[str]:
+
+async def createSession() -> aiohttp.ClientSession:
     """
-        Generates permutations of container names by combining company name, keywords and "-".
+        Creates the HTTP session shared by every container probe of the run.
+            The connector caps the total number of connections and the connections per storage account,
+            and keeps idle connections alive so each <mystorageaccount>.blob.core.windows.net only pays the TLS handshake once.
+
+        Returns:
+            aiohttp.ClientSession: The session. The caller is responsible for closing it.
+    """
+
+    connector = aiohttp.TCPConnector(
+        limit = HTTP_CONCURRENCY,
+        limit_per_host = HTTP_CONCURRENCY_PER_HOST,
+        keepalive_timeout = HTTP_KEEPALIVE_TIMEOUT,
+    )
+
+    # A black-holed endpoint holds a request until the timeout, not forever, and a trickling answer until the total.
+    # The total includes the time spent waiting for a free connection of the pool, so it is well above HTTP_TIMEOUT
+    timeout = aiohttp.ClientTimeout(total=HTTP_REQUEST_DEADLINE, sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT)
+
+    # Without x-ms-version, anonymous requests get the oldest List Blobs format: the probes ask for the same version as the listings
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=True, headers={"x-ms-version": AZURE_STORAGE_API_VERSION})
+
+
+
+def createLimiter() -> AdaptiveLimiter:
+    """
+        Creates the adaptive limiter shared by every container probe of the run.
+
+        Returns:
+            AdaptiveLimiter: The limiter, between HTTP_ADAPTIVE_MINIMUM and HTTP_CONCURRENCY in-flight probes.
+    """
+
+    return AdaptiveLimiter(HTTP_ADAPTIVE_INITIAL, HTTP_ADAPTIVE_MINIMUM, HTTP_CONCURRENCY)
+
+
+
+def backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+        Returns the seconds to wait before the next attempt: exponential backoff with full jitter,
+            and never less than the Retry-After header when the service sends one.
 
         Args:
-            company_name (str): The company name to be used in the container names.
-            storage_account (str): The storage account name to be used in the container names.
-            keywords (list[str]): A list of keywords to be included in the container names.
+            attempt (int): The attempt that just failed, starting at 0.
+            retry_after (str, optional): The Retry-After header of the response.
+
+        Returns:
+            float: The seconds to wait.
+    """
+
+    delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    if retry_after is not None and retry_after.isdigit():
+        delay = max(delay, min(HTTP_BACKOFF_MAX, int(retry_after)))
+
+    return delay
+
+
+
+def probeKey(URL: str) -> str:
+    """
+        Returns the pair a container URL probes, as recorded in the negative filter (see negativeFilter.py).
+
+        Args:
+            URL (str): "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list",
+                or the path-style URL when BLOB_ENDPOINT is set.
 
         Returns:
-            list[str]: A list of potential containers
+            str: "<mystorageaccount>/<mycontainer>"
     """
 
-    permutations = []
+    parts = urlsplit(URL)
+    path = parts.path.strip("/")
 
-    # company_name as container name
-    permutations.append(f"{company_name}")
+    if BLOB_ENDPOINT is not None:
+        return path
 
-    # storage_account as container name
-    permutations.append(f"{storage_account}")
+    return "".join([parts.hostname.split(".")[0], "/", path])
 
-    for keyword in keywords:
-        # Keyword as container name
-        permutations.append(f"{keyword}") if validatePermutation(f"{keyword}") else None
 
-        # Prepend 
-        # Prepend company name to keywords and resource -> <keyword><company_name>
-        permutation = None
-        permutation = f"{keyword}{company_name}"
-        permutations.append(permutation) if validatePermutation(permutation) else None
-        # Prepend company name to keywords and resource -> <keyword>-<company_name> ! Notice the "-" character in comparision with above
-        permutation = None
-        permutation = f"{keyword}-{company_name}"
-        permutations.append(permutation) if validatePermutation(permutation) else None
 
-        # Append
-        # Append company name to keywords and resource -> <company_name><keyword>
-        permutation = None
-        permutation = f"{company_name}{keyword}"
-        permutations.append(permutation) if validatePermutation(permutation) else None
-        # Prepend company name to keywords and resource -> <keyword>-<company_name> ! Notice the "-" character in comparision with above
-        permutation = None
-        permutation = f"{company_name}-{keyword}"
-        permutations.append(permutation) if validatePermutation(permutation) else None
+def hedgeDelay() -> Optional[float]:
+    """
+        Returns the seconds after which a probe is sent a second time: HEDGE_PERCENTILE of the probe latencies of the run.
+
+        Returns:
+            float: The delay, or None when probes are not hedged (disabled, too few probes measured, or HEDGE_MAX_RATIO reached).
+    """
+
+    if not HEDGE_ENABLED:
+        return None
+
+    histogram = METRICS.latency.get("http")
+
+    if histogram is None or histogram.count < HEDGE_MIN_SAMPLES or METRICS.counters.get("http_hedged", 0) >= HEDGE_MAX_RATIO * histogram.count:
+        return None
+
+    return histogram.quantile(HEDGE_PERCENTILE)
 
-    return permutations
 
 
+async def request(session: aiohttp.ClientSession, URL: str, limiter: Optional[AdaptiveLimiter] = None) -> tuple[int, bytes, Optional[str]]:
+    """
+        Sends a single GET of a container URL, in a slot of the limiter, and measures it as an http operation.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            URL (str): The container URL.
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run.
+
+        Returns:
+            tuple[int, bytes, Optional[str]]: The status, the body and the Retry-After header.
+    """
+
+    if limiter is not None:
+        await limiter.acquire()
+
+    start = METRICS.begin("http")
+    cancelled = False
+
+    try:
+        async with session.get(URL) as response:
+
+            # Drain the body so the connection goes back to the pool instead of being closed
+            body = await response.read()
+
+        METRICS.addBytes("http", len(body))
+
+        return (response.status, body, response.headers.get("Retry-After"))
+
+    except asyncio.CancelledError:
+        # The other request of a hedged probe answered first: its latency says nothing about the endpoint
+        cancelled = True
+        raise
+
+    except Exception as e:
+        METRICS.error("http", type(e).__name__)
+        raise
+
+    finally:
+        METRICS.end("http", start, observe=not cancelled)
+
+        if limiter is not None:
+            limiter.release()
+
+
+
+async def hedgedRequest(session: aiohttp.ClientSession, URL: str, limiter: Optional[AdaptiveLimiter] = None) -> tuple[int, bytes, Optional[str]]:
+    """
+        Sends a GET of a container URL, and a second one if the first takes longer than hedgeDelay. The first answer wins, the other request is cancelled.
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            URL (str): The container URL.
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run. Each request takes its own slot.
+
+        Returns:
+            tuple[int, bytes, Optional[str]]: The status, the body and the Retry-After header of the first answer.
 
-async def fetchALL(session: aiohttp.ClientSession, URL: str) -> str:
+        Raises:
+            Exception: The error of the last request, when none of them answered.
+    """
+
+    delay = hedgeDelay()
+
+    if delay is None:
+        return await request(session, URL, limiter)
+
+    tasks = [asyncio.ensure_future(request(session, URL, limiter))]
+
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=delay)
+
+        if not done:
+            METRICS.increment("http_hedged")
+            tasks.append(asyncio.ensure_future(request(session, URL, limiter)))
+            pending = set(tasks)
+
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        METRICS.increment("http_hedge_wins")
+
+                    return task.result()
+
+            if not pending:
+                raise done.pop().exception()
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+
+async def fetchContainer(session: aiohttp.ClientSession, URL: str, limiter: Optional[AdaptiveLimiter] = None, negatives: Optional["NegativeFilter"] = None, events: Optional[EventStream] = None) -> Union[tuple[str, bytes], str, None]:
     '''
-        Performs asynchronous GET HTTP requests for a list of URLs and returns a list of URLs that return a 200 status code.
+        Performs an asynchronous GET HTTP request for a container URL and returns it, with the body, if the status code is 200.
+            The body of a 200 is the first page of the blob listing (up to 5000 blobs), so the listing stage doesn't have to ask for it again.
+            Throttling (HTTP_RETRY_STATUSES), timeouts and dropped connections are retried up to HTTP_RETRIES times with jittered backoff,
+            and they are reported to the limiter so the whole run slows down. Slow requests are hedged (see hedgedRequest).
 
         Args:
-            URLs (list[str]): A list of URLs to check.
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            URL (str): The URL to check.
                 - URLs are formatted as "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run (see createLimiter).
+            negatives (NegativeFilter, optional): Where a 404 answer is recorded, so the next runs skip the container.
+            events (EventStream, optional): Where the retries and the probes given up are reported.
 
         Returns:
-            list[str]: A list of URLs that return a 200 status code.
+            tuple[str, bytes]: The URL and the List Blobs body if it returns a 200 status code.
+            str: UNKNOWN if no attempt got an answer (it may exist), otherwise None.
     '''
 
-    try:
-        async with session.get(URL) as response:
+    events = events or EventStream()
 
-            # If the bucket exists: HTTP status code 200
-            if str(response.status).startswith("200"):
+    for attempt in range(HTTP_RETRIES + 1):
+        retry_after = None
 
-                #print(f'[{config.BUCKET}] bucket found: {Fore.LIGHTYELLOW_EX}{Style.BRIGHT}{URL}{Style.RESET_ALL}')
-                print(f'\t\t\t[{BUCKET}] Exposed container found in: {URL}')
+        try:
+            status, body, retry_after = await hedgedRequest(session, URL, limiter)
 
-                return URL
+            if status in HTTP_RETRY_STATUSES:
+                await events.emit(ScanNotice("probe", URL, f"HTTP {status} for {URL}", "warning"))
+                METRICS.error("http", f"HTTP {status}")
 
+                if limiter is not None:
+                    limiter.throttled()
 
-    except aiohttp.client_exceptions.ClientOSError as e:
-            # If we get a peer reset connection error we will call this funcion again
-            print(f"\t\t\t[{WARNING}] aiohttp error for {URL} - {e}")
+            else:
+                if limiter is not None:
+                    limiter.success()
 
-            async with session.get(URL) as response:
-                print(f"\t\t\t\t[{INFO}] Trying again {URL}")
-                await fetchALL(session, URL)
+                # If the bucket exists: HTTP status code 200. The caller reports it (see fetchALL and az.probeStage)
+                if status == 200:
+                    return (URL, body)
 
-    except Exception as e:
-            print(f'\t\t\t[{ERROR}]Unexpected exception - fetchALL - {e}')
+                # The container doesn't exist. Any other answer (403, 409, ...) is asked again next time
+                if status == 404 and negatives is not None:
+                    negatives.add(probeKey(URL))
+
+                return None
+
+        except (aiohttp.ClientOSError, aiohttp.ServerDisconnectedError) as e:
+            # Peer reset connection or similar: the endpoint is probably overloaded
+            await events.emit(ScanNotice("probe", URL, f"aiohttp error for {URL} - {e}", "warning"))
+
+            if limiter is not None:
+                limiter.throttled()
 
+        except asyncio.TimeoutError:
+            await events.emit(ScanNotice("probe", URL, f"No answer within {HTTP_TIMEOUT}s for {URL}", "warning"))
 
+            if limiter is not None:
+                limiter.throttled()
 
-async def checkContainers(URLs: list[str]) -> list[str]:
+        except Exception as e:
+            await events.emit(ScanError("probe", URL, f"Unexpected exception - fetchContainer - {e}"))
+            return UNKNOWN
+
+        if attempt < HTTP_RETRIES:
+            await asyncio.sleep(backoff(attempt, retry_after))
+            await events.emit(ScanNotice("probe", URL, f"Trying again {URL}"))
+
+    await events.emit(ScanError("probe", URL, f"Giving up after {HTTP_RETRIES + 1} attempts"))
+
+    return UNKNOWN
+
+
+
+async def fetchALL(session: aiohttp.ClientSession, URL: str, limiter: Optional[AdaptiveLimiter] = None, negatives: Optional["NegativeFilter"] = None, events: Optional[EventStream] = None) -> str:
+    '''
+        Performs an asynchronous GET HTTP request for a container URL and returns it if the status code is 200 (see fetchContainer).
+
+        Args:
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            URL (str): The URL to check.
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run (see createLimiter).
+            negatives (NegativeFilter, optional): Where a 404 answer is recorded.
+            events (EventStream, optional): Where the retries and the probes given up are reported.
+
+        Returns:
+            str: The URL if it returns a 200 status code, otherwise None. The caller reports it (see findContainers).
+    '''
+
+    result = await fetchContainer(session, URL, limiter, negatives, events)
+
+    if result is None or result == UNKNOWN:
+        return None
+
+    return result[0]
+
+
+
+async def checkContainers(URLs: Iterable[str], session: aiohttp.ClientSession, limiter: Optional[AdaptiveLimiter] = None, negatives: Optional["NegativeFilter"] = None, events: Optional[EventStream] = None) -> list[str]:
     """
         Performs asynchronous GET HTTP requests for a list of URLs and returns a list of URLs that return a 200 status code.
+            At most HTTP_CONCURRENCY requests are in flight at any time, whatever the number of URLs.
 
         Args:
-            URLs (list[str]): A list of URLs to check.
+            URLs (Iterable[str]): The URLs to check. It can be a generator.
                 - URLs are formatted as "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"
+            session (aiohttp.ClientSession): The session shared by the whole run.
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run.
+            negatives (NegativeFilter, optional): Where the 404 answers are recorded.
+            events (EventStream, optional): Where the retries and the probes given up are reported.
 
         Returns:
             list[str]: A list of URLs that return a 200 status code.
     """
 
-    tasks = []
+    # Return only successful requests, http status code 200
+    return [result async for result in runBounded(lambda URL: fetchALL(session, URL, limiter, negatives, events), URLs, HTTP_CONCURRENCY) if result is not None]
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        # Create list of tasks. In this case all the URLs to be checked
-        for URL in URLs:
-            tasks.append(asyncio.ensure_future(fetchALL(session, URL)))
-        
-        # Execute them in concurrent manner
-        results = await asyncio.gather(*tasks)
 
-        # Return only successful requests, http status code 200
-        return [result for result in results if result is not None]
 
+def accountURL(storage_account: str) -> str:
+    """
+        Returns the blob endpoint URL of a storage account.
 
+        Args:
+            storage_account (str): The storage account FQDN.
 
-def findContainers(storage_account: str, company: str, keywords: list[str]) -> list[str]:
+        Returns:
+            str: "https://<mystorageaccount>.blob.core.windows.net", or "<BLOB_ENDPOINT>/<mystorageaccount>" when BLOB_ENDPOINT is set.
+    """
+
+    if BLOB_ENDPOINT is not None:
+        return "".join([BLOB_ENDPOINT, "/", storage_account.split('.')[0]])
+
+    return "".join(["https://", storage_account])
+
+
+
+def containerURLs(storage_account: str, company: str, keywords: list[str], ranking: Optional[HitRates] = None, budget: Optional[Budget] = None, negatives: Optional["NegativeFilter"] = None, deadline: Optional[Deadline] = None) -> Iterator[str]:
+    """
+        Yields the URLs to probe for a storage account, one per container name permutation.
+
+        Args:
+            storage_account (str): The storage account FQDN where the containers are searched.
+            company (str): The company name to be used in the container names.
+            keywords (list[str]): A list of keywords to be included in the container names.
+            ranking (HitRates, optional): The hit rates of previous runs, to yield the likely containers first.
+            budget (Budget, optional): The container probes left for the company. The URLs stop when it runs out.
+            negatives (NegativeFilter, optional): The containers that answered 404 in recent runs are skipped, without spending budget.
+            deadline (Deadline, optional): The time left for the company. The URLs stop when it runs out.
+
+        Yields:
+            str: "https://<mystorageaccount>.blob.core.windows.net/<mycontainer>?restype=container&comp=list"
+    """
+
+    storage_account_name = f"{storage_account.split('.')[0]}"
+    account_url = accountURL(storage_account)
+
+    containers = permutation(company, storage_account_name, keywords, ranking)
+
+    if negatives is not None:
+        containers = (container for container in containers if "".join([storage_account_name, "/", container]) not in negatives)
+
+    if budget is not None:
+        containers = budget.cap(company, containers)
+
+    if deadline is not None:
+        containers = deadline.cap(company, containers)
+
+    # Get permutations for company and keywords
+    for container in containers:
+        yield "".join([account_url, "/", container, "?restype=container&comp=list"])
+
+
+
+async def streamContainers(storage_account: str, company: str, keywords: list[str], session: aiohttp.ClientSession, limiter: Optional[AdaptiveLimiter] = None, ranking: Optional[HitRates] = None, budget: Optional[Budget] = None, negatives: Optional["NegativeFilter"] = None, deadline: Optional[Deadline] = None, unknown: Optional[list[str]] = None, events: Optional[EventStream] = None) -> AsyncIterator[tuple[str, bytes]]:
+    """
+        Probes the container permutations of a storage account and yields every exposed container as soon as it answers.
+
+        Args:
+            storage_account (str): The storage account FQDN where the containers are searched.
+            company (str): The company name to be used in the container names.
+            keywords (list[str]): A list of keywords to be included in the container names.
+            session (aiohttp.ClientSession): The session shared by the whole run (see createSession).
+            limiter (AdaptiveLimiter, optional): The limiter shared by the whole run (see createLimiter).
+            ranking (HitRates, optional): The hit rates of previous runs, to probe the likely containers first.
+            budget (Budget, optional): The container probes left for the company.
+            negatives (NegativeFilter, optional): The containers that answered 404 in recent runs, skipped. New 404 answers are added to it.
+            deadline (Deadline, optional): The time left for the company.
+            unknown (list[str], optional): Where the URLs of the probes without an answer are appended.
+            events (EventStream, optional): Where the retries and the probes given up are reported.
+
+        Yields:
+            tuple[str, bytes]: The URL of an exposed container (HTTP status code 200) and the first page of its blob listing.
+    """
+
+    URLs = containerURLs(storage_account, company, keywords, ranking, budget, negatives, deadline)
+
+    async def probe(URL: str) -> Union[tuple[str, bytes], str, None]:
+        if deadline is not None:
+            # A probe still in flight (or retrying) when the deadline is reached is cut off: the container is unknown
+            result = await deadline.within(company, fetchContainer(session, URL, limiter, negatives, events), UNKNOWN)
+
+        else:
+            result = await fetchContainer(session, URL, limiter, negatives, events)
+
+        if result == UNKNOWN and unknown is not None:
+            unknown.append(URL)
+
+        return result
+
+    async for result in runBounded(probe, URLs, HTTP_CONCURRENCY):
+        if result is not None and result != UNKNOWN:
+            yield result
+
+
+
+def findContainers(storage_account: str, company: str, keywords: list[str], session: aiohttp.ClientSession, negatives: Optional["NegativeFilter"] = None, events: Optional[EventStream] = None) -> list[str]:
     """
         Finds valid Azure storage account names based on permutations of company name, keywords, and resources.
 
         Args:
+            storage_account (str): The storage account FQDN where the containers are searched.
             company (str): The company name to be used in the storage account names.
             keywords (list[str]): A list of keywords to be included in the storage account names.
-            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            session (aiohttp.ClientSession): The session shared by the whole run (see createSession).
+            negatives (NegativeFilter, optional): The containers that answered 404 in recent runs, skipped. New 404 answers are added to it.
+            events (EventStream, optional): Where the exposed containers, the retries and the probes given up are reported. Printed by default.
 
         Returns:
             list[str]: A list of valid Azure storage account FQDNs generated from the permutations.
     """
 
-    URLs = []
-    container_names = []
     valid_container_names = []
-    storage_account_name = f"{storage_account.split('.')[0]}"
+    console = None
 
-    # Get permutations for company and keywords
-    container_names = permutation(company, storage_account_name, keywords)
+    if events is None:
+        console = events = EventStream([ConsoleView()])
+
+    # URLs are built lazily from the permutations while the probes progress
+    URLs = containerURLs(storage_account, company, keywords, negatives=negatives)
+
+    async def check() -> list[str]:
+        found = await checkContainers(URLs, session, negatives=negatives, events=events)
 
-    # Append the storage accounts to each resource a build the URL
-    URLs.extend(["".join(["https://", storage_account, "/", container, "?restype=container&comp=list"]) for container in container_names])
+        for container in found:
+            await events.emit(ContainerExposed(company, storage_account, container))
+
+        return found
 
     # Check if URL (Container) is valid using asynchronous tasks
     loop = asyncio.get_event_loop()
-    valid_container_names .extend(loop.run_until_complete(checkContainers(URLs)))
+    valid_container_names .extend(loop.run_until_complete(check()))
+
+    if console is not None:
+        console.close()
 
     # Return the list of valid storage account FQDNs
     return valid_container_names 
@@ -0,0 +1,738 @@
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import time
+from collections import deque
+from pathlib import Path, PurePosixPath
+from typing import Optional
+from MicrosoftAzure.az import azurePipeline, printSummary
+from MicrosoftAzure.storageAccounts import storageAccountCandidates
+from config import INFO, WARNING, ERROR, NO_RESULTS, OUTPUT_FOLDER, JOURNAL_FILE, DISTRIBUTED_UNIT_SIZE, DISTRIBUTED_LEASE_SECONDS, DISTRIBUTED_MAX_ATTEMPTS, DISTRIBUTED_TOKEN, DISTRIBUTED_STATE_FILE, DISTRIBUTED_WORKERS_FOLDER
+from journal import Journal
+from events import createEventStream
+
+'''
+    Info
+
+    A scan can be spread across several hosts: a coordinator splits it into work units and workers scan them.
+
+        python ForgottenClouds.py --coordinator 0.0.0.0:8470 --token <secret>             (the host with the Data files)
+        python ForgottenClouds.py --worker <coordinator>:8470 --token <secret>             (every scanning host, as many as wanted)
+
+    A work unit is a range of DISTRIBUTED_UNIT_SIZE storage account candidates of a company, in wordlist order
+    (the ranking of a worker would give every host a different order). The worker runs the usual pipeline on it:
+    the storage accounts of the range are resolved, and the ones found are probed and listed as in a local run.
+
+    Coordinator and workers talk over a single TCP connection each, one JSON message per line, every request answered:
+
+        {"op": "hello", "token": ..., "worker": ...}             -> the keywords, resources, mode, ... of the scan
+        {"op": "lease"}                                          -> {"unit": {...}, "lease": ...}, {"wait": seconds} or {"done": true}
+        {"op": "renew", "lease": ...}                            -> {"ok": false} once the lease is lost: the unit is dropped
+        {"op": "file", "lease": ..., "path": ..., "offset": ..., "data": <base64>}   A chunk of an output file of the unit
+        {"op": "complete", "lease": ..., "results": [...]}       -> {"ok": false} if the lease was lost meanwhile
+        {"op": "fail", "lease": ..., "error": ...}               The unit goes back to the queue
+
+    A lease that is not renewed within DISTRIBUTED_LEASE_SECONDS (worker stopped, host lost) or whose connection
+    closes is handed out again, up to DISTRIBUTED_MAX_ATTEMPTS times. The output files of a unit are staged by the
+    coordinator and moved to its Output folder only when the unit completes, so a unit scanned twice is written once.
+
+    Every worker works in its own folder (Output and Cache), emptied of the files it uploads. The completed units are
+    recorded in DISTRIBUTED_STATE_FILE: the coordinator continues from them with --resume.
+    Budgets and --incremental scans stay per host, they are not available in distributed scans.
+
+    --local-workers starts workers on the coordinator host, to try it on a single machine (no other process needed).
+'''
+
+# Longest message line, a file chunk or the keywords of the hello answer
+MESSAGE_LIMIT = 64 * 1024 * 1024
+
+# Bytes of an output file sent in a single message
+FILE_CHUNK = 1024 * 1024
+
+# Seconds an idle worker waits before asking for a lease again
+IDLE_WAIT = 1
+
+# Seconds a worker keeps trying to reach the coordinator
+CONNECT_SECONDS = 60
+
+# Seconds the coordinator keeps answering "done" to the connected workers once every unit is completed
+DONE_GRACE = 10
+
+
+
+def parseAddress(address: str) -> tuple[str, int]:
+    """
+        Splits a "host:port" address. IPv6 hosts go in brackets, e.g. "[::1]:8470".
+    """
+
+    host, _, port = address.rpartition(":")
+
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address {address}, expected HOST:PORT")
+
+    return (host.strip("[]"), int(port))
+
+
+
+def scanDigest(companies: list[str], keywords: list[str], resources: list[str], mode: str) -> str:
+    """
+        Identifies the candidate space of a scan: the work units of another scan cover other candidates.
+    """
+
+    return hashlib.sha256(json.dumps([companies, keywords, resources, mode, DISTRIBUTED_UNIT_SIZE]).encode()).hexdigest()
+
+
+
+async def send(writer: asyncio.StreamWriter, message: dict):
+    """
+        Writes a message as a JSON line.
+    """
+
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+
+async def receive(reader: asyncio.StreamReader) -> Optional[dict]:
+    """
+        Reads the next JSON line, or None once the connection is closed.
+    """
+
+    line = await reader.readline()
+
+    return json.loads(line) if line else None
+
+
+
+class WorkUnit:
+    """
+        A range of storage account candidates of a company, and its lease.
+
+        Args:
+            index (int): Position of the unit in the scan.
+            company (str): The company name.
+            start (int): First candidate of the range.
+            stop (int): Candidate after the last one.
+    """
+
+    def __init__(self, index: int, company: str, start: int, stop: int):
+        self.index = index
+        self.company = company
+        self.start = start
+        self.stop = stop
+
+        self.lease = None
+        self.expires = 0.0
+        self.attempts = 0
+        self.done = False
+        self.abandoned = False
+
+
+    def describe(self) -> str:
+        return f"{self.company} candidates {self.start}-{self.stop}"
+
+
+
+class Coordinator:
+    """
+        Hands out the work units of a scan to the workers and merges what they find (see the top of the module).
+
+        Args:
+            companies (list[str]): The company names.
+            keywords (list[str]): A list of keywords to be included in the storage account and container names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            mode (str): How far the pipeline goes, one of az.MODES.
+            reprobe (bool): Probe again the containers that answered 404 in recent runs.
+            token (str, optional): Shared secret the workers must send. None to accept any worker.
+            resume (bool): Skip the units completed by a previous coordinator of the same scan (DISTRIBUTED_STATE_FILE).
+    """
+
+    def __init__(self, companies: list[str], keywords: list[str], resources: list[str], mode: str = "full", reprobe: bool = False, token: Optional[str] = DISTRIBUTED_TOKEN, resume: bool = False):
+        self.settings = {"keywords": keywords, "resources": resources, "mode": mode, "reprobe": reprobe, "lease_seconds": DISTRIBUTED_LEASE_SECONDS}
+        self.token = token
+        self.digest = scanDigest(companies, keywords, resources, mode)
+
+        self.units = []
+
+        for company in companies:
+            candidates = sum(1 for _ in storageAccountCandidates(company, keywords, resources))
+
+            for start in range(0, candidates, DISTRIBUTED_UNIT_SIZE):
+                self.units.append(WorkUnit(len(self.units), company, start, min(start + DISTRIBUTED_UNIT_SIZE, candidates)))
+
+        self.results = []
+        self.leases = {}
+        self.staging = Path(OUTPUT_FOLDER) / ".distributed"
+        self.connections = 0
+        self.finished = asyncio.Event()
+
+        completed = self.load() if resume else set()
+
+        for unit in self.units:
+            unit.done = unit.index in completed
+
+        self.pending = deque(unit.index for unit in self.units if not unit.done)
+
+        Path(DISTRIBUTED_STATE_FILE).parent.mkdir(parents=True, exist_ok=True)
+        self.state = open(DISTRIBUTED_STATE_FILE, "a" if resume else "w")
+
+        if not self.pending:
+            self.finished.set()
+
+
+    def load(self) -> set[int]:
+        """
+            Reads the units completed by a previous coordinator of the same scan and their results.
+        """
+
+        completed = set()
+
+        if not Path(DISTRIBUTED_STATE_FILE).exists():
+            return completed
+
+        with open(DISTRIBUTED_STATE_FILE, "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+
+                except json.JSONDecodeError:
+                    continue
+
+                if record.get("scan") == self.digest and record["unit"] < len(self.units) and record["unit"] not in completed:
+                    completed.add(record["unit"])
+                    self.results.extend(record["results"])
+
+        print(f"[{INFO}] Resuming from {DISTRIBUTED_STATE_FILE}: {len(completed)} of {len(self.units)} work units completed")
+
+        return completed
+
+
+    def remaining(self) -> int:
+        """
+            Returns the number of units neither completed nor given up.
+        """
+
+        return sum(1 for unit in self.units if not unit.done and not unit.abandoned)
+
+
+    def lease(self, worker: str) -> dict:
+        """
+            Leases the next unit to a worker.
+
+            Returns:
+                dict: The answer to a lease request.
+        """
+
+        now = time.monotonic()
+
+        for lease, unit in list(self.leases.items()):
+            if unit.expires < now:
+                self.release(lease, "lease expired")
+
+        if self.pending:
+            unit = self.units[self.pending.popleft()]
+            unit.lease = os.urandom(8).hex()
+            unit.expires = now + DISTRIBUTED_LEASE_SECONDS
+            unit.attempts += 1
+            self.leases[unit.lease] = unit
+
+            print(f"\t[{INFO}] Work unit {unit.index + 1}/{len(self.units)} leased to {worker}: {unit.describe()}")
+
+            return {"unit": {"company": unit.company, "start": unit.start, "stop": unit.stop}, "lease": unit.lease}
+
+        if self.remaining() > 0:
+            return {"wait": IDLE_WAIT}
+
+        return {"done": True}
+
+
+    def release(self, lease: str, reason: str):
+        """
+            Takes a unit back from its worker: it goes back to the queue, or is given up after DISTRIBUTED_MAX_ATTEMPTS leases.
+        """
+
+        unit = self.leases.pop(lease, None)
+
+        if unit is None:
+            return
+
+        unit.lease = None
+        shutil.rmtree(self.staging / lease, ignore_errors=True)
+
+        if unit.attempts >= DISTRIBUTED_MAX_ATTEMPTS:
+            unit.abandoned = True
+            print(f"\t[{ERROR}] Work unit {unit.index + 1} given up after {unit.attempts} attempts ({reason}): {unit.describe()}")
+
+        else:
+            self.pending.append(unit.index)
+            print(f"\t[{WARNING}] Work unit {unit.index + 1} back in the queue ({reason}): {unit.describe()}")
+
+        if self.remaining() == 0:
+            self.finished.set()
+
+
+    def renew(self, lease: str) -> bool:
+        """
+            Extends a lease. False if it was lost (expired and handed out again).
+        """
+
+        unit = self.leases.get(lease)
+
+        if unit is None:
+            return False
+
+        unit.expires = time.monotonic() + DISTRIBUTED_LEASE_SECONDS
+
+        return True
+
+
+    def stage(self, lease: str, path: str, offset: int, data: str) -> bool:
+        """
+            Writes a chunk of an output file of a unit to its staging folder.
+
+            Args:
+                lease (str): The lease of the unit.
+                path (str): The path of the file, relative to the Output folder of the worker.
+                offset (int): Where the chunk goes in the file. 0 starts the file.
+                data (str): The chunk, base64-encoded.
+
+            Returns:
+                bool: False if the lease was lost or the chunk doesn't fit the file.
+        """
+
+        if lease not in self.leases:
+            return False
+
+        # The path comes from the network: it must stay inside the staging folder
+        relative = PurePosixPath(path)
+        if relative.is_absolute() or ".." in relative.parts or not relative.parts or relative.parts[0] == ".distributed":
+            print(f"\t[{ERROR}] Output file rejected: {path}")
+            return False
+
+        file_path = self.staging / lease / relative
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if offset != (file_path.stat().st_size if offset > 0 and file_path.exists() else 0):
+            return False
+
+        with open(file_path, "wb" if offset == 0 else "ab") as file:
+            file.write(base64.b64decode(data))
+
+        return True
+
+
+    def complete(self, lease: str, results: list[str]) -> bool:
+        """
+            Completes a unit: its staged files go to the Output folder and its results are recorded.
+
+            Returns:
+                bool: False if the lease was lost, the unit is scanned by another worker.
+        """
+
+        unit = self.leases.pop(lease, None)
+
+        if unit is None:
+            return False
+
+        staged = self.staging / lease
+
+        if staged.exists():
+            for file_path in sorted(path for path in staged.rglob("*") if path.is_file()):
+                target = Path(OUTPUT_FOLDER) / file_path.relative_to(staged)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(file_path, target)
+
+            shutil.rmtree(staged, ignore_errors=True)
+
+        unit.done = True
+        unit.lease = None
+        self.results.extend(results)
+
+        self.state.write(json.dumps({"scan": self.digest, "unit": unit.index, "results": results}) + "\n")
+        self.state.flush()
+
+        print(f"\t[{INFO}] Work unit {unit.index + 1}/{len(self.units)} completed: {unit.describe()}, {len(results)} results, {self.remaining()} units left")
+
+        if self.remaining() == 0:
+            self.finished.set()
+
+        return True
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+            Answers the requests of a worker connection. The leases of the worker are released when it closes.
+        """
+
+        worker = "{}:{}".format(*writer.get_extra_info("peername")[:2])
+        leases = set()
+        self.connections += 1
+
+        try:
+            hello = await receive(reader)
+
+            if hello is None or hello.get("op") != "hello":
+                return
+
+            # As bytes: compare_digest refuses str with non-ASCII characters
+            if self.token is not None and not hmac.compare_digest(str(hello.get("token")).encode(), self.token.encode()):
+                print(f"\t[{WARNING}] Worker rejected, wrong token: {worker}")
+                await send(writer, {"ok": False, "error": "wrong token"})
+                return
+
+            worker = hello.get("worker") or worker
+            print(f"\t[{INFO}] Worker connected: {worker}")
+            await send(writer, {"ok": True, **self.settings})
+
+            while (message := await receive(reader)) is not None:
+                op = message.get("op")
+                lease = message.get("lease")
+
+                if op == "lease":
+                    answer = self.lease(worker)
+
+                    if "lease" in answer:
+                        leases.add(answer["lease"])
+
+                elif op == "renew":
+                    answer = {"ok": self.renew(lease)}
+
+                elif op == "file":
+                    answer = {"ok": self.stage(lease, message["path"], message["offset"], message["data"])}
+
+                elif op == "complete":
+                    answer = {"ok": self.complete(lease, message["results"])}
+                    leases.discard(lease)
+
+                elif op == "fail":
+                    self.release(lease, f"{worker} - {message.get('error')}")
+                    leases.discard(lease)
+                    answer = {"ok": True}
+
+                else:
+                    answer = {"ok": False, "error": f"unknown op {op}"}
+
+                await send(writer, answer)
+
+        except (ConnectionError, json.JSONDecodeError, KeyError, ValueError) as e:
+            print(f"\t[{WARNING}] Worker connection lost: {worker} - {e}")
+
+        finally:
+            self.connections -= 1
+
+            for lease in leases:
+                self.release(lease, f"{worker} disconnected")
+
+            writer.close()
+
+
+    async def serve(self, host: str, port: int, local_workers: int = 0) -> list[str]:
+        """
+            Listens for workers until every unit is completed or given up.
+
+            Args:
+                host (str): The address to listen on.
+                port (int): The TCP port.
+                local_workers (int): Worker processes to start on this host, in DISTRIBUTED_WORKERS_FOLDER/<n>.
+
+            Returns:
+                list[str]: What the workers found, as azurePipeline returns it.
+        """
+
+        server = await asyncio.start_server(self.handle, host, port, limit=MESSAGE_LIMIT)
+        address = f"{host}:{server.sockets[0].getsockname()[1]}"
+
+        print(f"[{INFO}] Coordinator listening on {address}: {len(self.units)} work units, {len(self.pending)} to scan")
+
+        if self.token is None and host not in ("127.0.0.1", "localhost", "::1"):
+            print(f"[{WARNING}] No token set: any client that reaches {address} can take work units")
+
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=workerProcess, args=(address, self.token, str(Path(DISTRIBUTED_WORKERS_FOLDER, str(index)).absolute())), daemon=True)
+            for index in range(local_workers)
+        ]
+
+        for process in processes:
+            process.start()
+
+        try:
+            while not self.finished.is_set():
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.finished.wait(), IDLE_WAIT)
+
+                if processes and not any(process.is_alive() for process in processes) and self.connections == 0:
+                    print(f"[{ERROR}] Every local worker stopped, {self.remaining()} work units left")
+                    break
+
+            # The connected workers ask for a lease once more and are told the scan is done
+            deadline = time.monotonic() + DONE_GRACE
+            while self.connections > 0 and time.monotonic() < deadline:
+                await asyncio.sleep(IDLE_WAIT / 10)
+
+        finally:
+            server.close()
+            self.state.close()
+
+            for process in processes:
+                process.join(DONE_GRACE)
+
+                if process.is_alive():
+                    process.terminate()
+
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+        abandoned = [unit for unit in self.units if unit.abandoned]
+        if abandoned:
+            print(f"[{ERROR}] {len(abandoned)} work units were not scanned: {', '.join(unit.describe() for unit in abandoned)}")
+
+        return self.results
+
+
+
+def outputFiles() -> list[Path]:
+    """
+        Returns the complete output files of the worker folder (Parquet part files being written start with a dot).
+    """
+
+    output = Path(OUTPUT_FOLDER)
+
+    return sorted(path for path in output.rglob("*") if path.is_file() and not path.name.startswith(".")) if output.exists() else []
+
+
+
+async def runWorker(address: str, token: Optional[str] = DISTRIBUTED_TOKEN):
+    """
+        Scans the work units of a coordinator until it tells the scan is done. Runs in the worker folder (see Worker).
+
+        Args:
+            address (str): "host:port" of the coordinator.
+            token (str, optional): The shared secret of the coordinator.
+    """
+
+    host, port = parseAddress(address)
+    deadline = time.monotonic() + CONNECT_SECONDS
+
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port, limit=MESSAGE_LIMIT)
+            break
+
+        except OSError as e:
+            if time.monotonic() > deadline:
+                print(f"[{ERROR}] Coordinator unreachable at {address} - {e}")
+                return
+
+            await asyncio.sleep(IDLE_WAIT)
+
+    # One request at a time on the connection: the lease renewals wait for the uploads
+    lock = asyncio.Lock()
+
+    async def call(message: dict) -> dict:
+        async with lock:
+            await send(writer, message)
+            answer = await receive(reader)
+
+        if answer is None:
+            raise ConnectionError("coordinator closed the connection")
+
+        return answer
+
+    try:
+        settings = await call({"op": "hello", "token": token, "worker": f"{socket.gethostname()}-{os.getpid()}"})
+
+        if not settings.get("ok"):
+            print(f"[{ERROR}] Coordinator refused the worker: {settings.get('error')}")
+            return
+
+        print(f"[{INFO}] Connected to coordinator {address}: {len(settings['keywords'])} keywords, mode {settings['mode']}")
+
+        while True:
+            answer = await call({"op": "lease"})
+
+            if answer.get("done"):
+                print(f"[{INFO}] Scan done, worker leaving")
+                return
+
+            if "wait" in answer:
+                await asyncio.sleep(answer["wait"])
+                continue
+
+            await runUnit(call, answer["unit"], answer["lease"], settings)
+
+    except ConnectionError as e:
+        print(f"[{ERROR}] Coordinator connection lost - {e}")
+
+    finally:
+        writer.close()
+
+
+
+async def runUnit(call, unit: dict, lease: str, settings: dict):
+    """
+        Scans a work unit while its lease is renewed, uploads its output files and completes it.
+
+        Args:
+            call (Callable): Sends a message to the coordinator and returns its answer.
+            unit (dict): The company, start and stop of the unit.
+            lease (str): The lease of the unit.
+            settings (dict): The keywords, resources, mode, ... of the scan.
+    """
+
+    print(f"[{INFO}] Scanning work unit: {unit['company']} candidates {unit['start']}-{unit['stop']}")
+
+    # Left by a unit that was interrupted
+    shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    stop = asyncio.Event()
+    lost = False
+
+    async def scan() -> list[str]:
+        # Every unit is a scan of its own, there is nothing to resume on this host
+        journal = Journal(JOURNAL_FILE, resume=False)
+        events = createEventStream()
+        summary = {}
+
+        try:
+            return await azurePipeline([unit["company"]], settings["keywords"], settings["resources"], journal, settings["mode"], reprobe=settings["reprobe"], candidate_range=(unit["start"], unit["stop"]), events=events, summary=summary)
+
+        finally:
+            journal.close()
+            events.close()
+            printSummary(summary)
+
+    pipeline = asyncio.create_task(scan())
+
+    async def heartbeat():
+        nonlocal lost
+
+        while not stop.is_set():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), settings["lease_seconds"] / 3)
+
+            if not stop.is_set() and not (await call({"op": "renew", "lease": lease}))["ok"]:
+                print(f"[{WARNING}] Lease lost, work unit dropped: {unit['company']} candidates {unit['start']}-{unit['stop']}")
+                lost = True
+                pipeline.cancel()
+                return
+
+    renewals = asyncio.create_task(heartbeat())
+
+    try:
+        try:
+            results = await pipeline
+
+        except asyncio.CancelledError:
+            if lost:
+                return
+            raise
+
+        except Exception as e:
+            await call({"op": "fail", "lease": lease, "error": str(e)})
+            print(f"[{ERROR}] runUnit - {e}")
+            return
+
+        for file_path in outputFiles():
+            relative = file_path.relative_to(OUTPUT_FOLDER).as_posix()
+
+            with open(file_path, "rb") as file:
+                offset = 0
+
+                while True:
+                    chunk = file.read(FILE_CHUNK)
+
+                    # Empty files are sent too, as a single empty chunk
+                    if not chunk and offset > 0:
+                        break
+
+                    if not (await call({"op": "file", "lease": lease, "path": relative, "offset": offset, "data": base64.b64encode(chunk).decode()}))["ok"]:
+                        print(f"[{WARNING}] Upload refused, work unit dropped: {relative}")
+                        return
+
+                    offset += len(chunk)
+
+                    if len(chunk) < FILE_CHUNK:
+                        break
+
+        stop.set()
+        await renewals
+
+        if (await call({"op": "complete", "lease": lease, "results": results}))["ok"]:
+            print(f"[{INFO}] Work unit completed: {len(results)} results")
+
+        else:
+            print(f"[{WARNING}] Lease lost before completion, the coordinator discards the work unit")
+
+    finally:
+        stop.set()
+
+        # Never cancelled in the middle of a request, the answer would be read by the next one
+        if not renewals.done():
+            await renewals
+
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+
+
+def Worker(address: str, token: Optional[str] = DISTRIBUTED_TOKEN, workdir: Optional[str] = None):
+    """
+        Runs a worker in its own folder, where its Output and Cache go.
+            Without workdir, a folder of the process is used and removed at the end: caches are not kept between runs.
+
+        Args:
+            address (str): "host:port" of the coordinator.
+            token (str, optional): The shared secret of the coordinator.
+            workdir (str, optional): The worker folder, reused between runs. It must not be shared with another worker.
+    """
+
+    temporary = workdir is None
+    folder = Path(workdir if workdir is not None else f"{DISTRIBUTED_WORKERS_FOLDER}/{os.getpid()}").absolute()
+    folder.mkdir(parents=True, exist_ok=True)
+    os.chdir(folder)
+
+    print(f"[{INFO}] Worker folder: {folder}")
+
+    try:
+        asyncio.run(runWorker(address, token))
+
+    finally:
+        if temporary:
+            os.chdir(folder.parent)
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+
+def workerProcess(address: str, token: Optional[str], workdir: str):
+    """
+        Entry point of the worker processes started by the coordinator (--local-workers).
+    """
+
+    Worker(address, token, workdir)
+
+
+
+def Distributed(companies: list[str], keywords: list[str], resources: list[str], address: str, local_workers: int = 0, token: Optional[str] = DISTRIBUTED_TOKEN, resume: bool = False, mode: str = "full", reprobe: bool = False):
+
+    print(f"[{INFO}] Coordinating the scan of companies: {', '.join(companies)}")
+
+    host, port = parseAddress(address)
+
+    async def coordinate() -> list[str]:
+        # Created in the event loop of the scan
+        coordinator = Coordinator(companies, keywords, resources, mode, reprobe, token, resume)
+
+        return await coordinator.serve(host, port, local_workers)
+
+    results = asyncio.run(coordinate())
+
+    if len(results) == 0:
+        print(f"[{NO_RESULTS}] No results found by the workers")
+
+    print(results.__str__())
@@ -1,6 +1,12 @@
 import asyncio
-import aiodns
-from config import AZURE_STORAGE
+from typing import Iterable, Iterator, Optional
+from config import AZURE_STORAGE, WARNING, DNS_CONCURRENCY
+from utils import runBounded
+from dnsCache import DNSCache
+from resolver import ResolverPool, FOUND, ABSENT, FAILED, UNKNOWN
+from metrics import METRICS
+from planner import HitRates, ACCOUNT, affixes
+from wordlists import VALID_STORAGE_ACCOUNT, ACCOUNT_MAX_LENGTH, ACCOUNT_PART, usableKeywords
 
 ''' 
     Info
@@ -9,9 +15,30 @@ from config import AZURE_STORAGE
         - Storage Account Name: Storage account names must be between 3 and 24 characters in length and may contain numbers and lowercase letters only.
 
         http://<mystorageaccount>.blob.core.windows.net
+
+    2. https://learn.microsoft.com/en-us/azure/storage/common/storage-account-overview#standard-endpoints
+        - The name of a storage account is unique in its cloud and every service of the account has its endpoint:
+
+        <mystorageaccount>.blob.core.windows.net
+        <mystorageaccount>.dfs.core.windows.net
+        <mystorageaccount>.file.core.windows.net
+        <mystorageaccount>.queue.core.windows.net
+        <mystorageaccount>.table.core.windows.net
+
+    So a name is resolved once, on one endpoint of its namespace (core.windows.net, core.usgovcloudapi.net, ...),
+    and only the accounts that exist are expanded into the other endpoints of the resources file.
+    The blob endpoint is the one resolved when it is in the resources file, since it is the one probed next.
+    The static website endpoint (<mystorageaccount>.z[0-9]+.web.core.windows.net) depends on the zone of the account, it can't be expanded.
 '''
 
-ALLOWED_CHARACTERS = "abcdefghijklmnopqrstuvwxyz0123456789"
+# How the storage account names are built from the company name and a keyword, in their default order (see planner.py)
+ACCOUNT_PATTERNS = {
+    "prefix": "{keyword}{company}", # <keyword><company_name>.<resource>
+    "suffix": "{company}{keyword}", # <company_name><keyword>.<resource>
+}
+
+# Services whose endpoints share the storage account name (see 2.)
+STORAGE_SERVICES = ("blob", "dfs", "file", "queue", "table")
 
 def validatePermutation(permutation: str) -> bool:
     """
@@ -26,107 +53,213 @@ def validatePermutation(permutation: str) -> bool:
             bool: True if the permutation is valid, False otherwise.
     """
 
-    # Set True by default
-    is_valid_permutation = True
+    return VALID_STORAGE_ACCOUNT.fullmatch(permutation) is not None
+
 
-    # length between 3 and 24
-    if 3 <= len(permutation) <= 24:
-        # All characters are allowed
-        if all(char in ALLOWED_CHARACTERS for char in permutation):
-            is_valid_permutation = True
+def permutation(company_name: str, keywords: Iterable[str], ranking: Optional[HitRates] = None) -> Iterator[str]:
+    """
+        Generates permutations of storage account names by combining company name and keywords (see ACCOUNT_PATTERNS).
+            Candidates are yielded lazily, only once each and only if they are valid storage account names.
+
+        Args:
+            company_name (str): The company name to be used in the storage account names.
+            keywords (Iterable[str]): The keywords to be included in the storage account names.
+            ranking (HitRates, optional): The hit rates of previous runs. The candidates come by expected yield instead of in wordlist order.
+
+        Yields:
+            str: A potential storage account built from the permutations.
+    """
+
+    # Storage account names are lowercase, the company name keeps its spelling everywhere else
+    company_name = company_name.lower()
+
+    # Candidates already yielded for this company (e.g. a keyword equal to the company name)
+    seen = set()
+
+    patterns = {pattern: affixes(template, company_name) for pattern, template in ACCOUNT_PATTERNS.items()}
+
+    def candidates() -> Iterator[tuple[str, Optional[str], Optional[str]]]:
+        # Add base case with company name as storage account
+        yield (company_name, None, None)
+
+        # Keywords that can't make a valid name with this company are left out before building anything
+        usable = usableKeywords(keywords, ACCOUNT_PART, ACCOUNT_MAX_LENGTH - len(company_name))
+
+        if ranking is None:
+            order = ((keyword, pattern) for keyword in usable for pattern in patterns)
 
         else:
-            # Invalid characters in Storage Account
-            is_valid_permutation = False
+            order = ranking.rank(ACCOUNT, list(usable), list(patterns))
 
-    else:
-        # Invalid Storage Account length
-        is_valid_permutation = False
+        for keyword, pattern in order:
+            before, after = patterns[pattern]
+            yield ("".join([before, keyword, after]), keyword, pattern)
+
+    for candidate, keyword, pattern in candidates():
+        if candidate not in seen and validatePermutation(candidate):
+            seen.add(candidate)
 
-    return is_valid_permutation
+            if ranking is not None and keyword is not None:
+                ranking.tried(ACCOUNT, keyword, pattern)
 
+            yield candidate
 
-def permutation(company_name: str, keywords: list[str]) -> list[str]:
+
+
+async def resolveStorageAccount(storage_account: str, resolver: ResolverPool, cache: Optional[DNSCache] = None) -> str:
     """
-        Generates permutations of storage account names by combining company name, keywords, and resources.
+        Resolves the given FQDN and tells apart names that don't exist from lookups that failed.
+            Nothing is printed, the caller reports the outcome (see az.discoveryStage and dnsLookup).
 
         Args:
-            company_name (str): The company name to be used in the storage account names.
-            keywords (list[str]): A list of keywords to be included in the storage account names.
+            storage_account (str): The FQDN of the Azure Storage Account.
+            resolver (ResolverPool): The resolvers shared by the whole run.
+            cache (DNSCache, optional): The DNS cache. Fresh answers are taken from it and new answers are saved in it.
+                Failed and unknown lookups are never cached.
 
         Returns:
-            list[str]: A list of potential storage account built from the permutations. 
+            str: FOUND, ABSENT, FAILED or UNKNOWN (see resolver.py).
     """
 
-    permutations = []
+    cached = cache.get(storage_account) if cache is not None else None
 
-    # Add base case with company name as storage account
-    permutations.append(f"{company_name}")
+    if cached is not None:
+        outcome = FOUND if cached else ABSENT
+        METRICS.increment("dns_cache_hits")
 
-    for keyword in keywords:
-        # Prepend company name to keywords and resource -> <keyword><company_name>.<resource>
-        permutation = None
-        permutation = f"{keyword}{company_name}"
-        # Validate permutation and add it to the list if valid
-        permutations.append(permutation) if validatePermutation(permutation) else None
+    else:
+        async with METRICS.track("dns"):
+            outcome = await resolver.resolve(storage_account)
 
-        # Append company name to keywords and resource -> <company_name><keyword>.<resource>
-        permutation = None
-        permutation = f"{company_name}{keyword}"
-        # Validate permutation and add it to the list if valid
-        permutations.append(permutation) if validatePermutation(permutation) else None
+        if cache is not None and outcome in (FOUND, ABSENT):
+            cache.store(storage_account, outcome == FOUND)
 
-    return permutations
+    return outcome
 
 
 
-async def dnsLookup(storage_account: str, resolver: aiodns.DNSResolver) -> str:
+async def dnsLookup(storage_account: str, resolver: ResolverPool, cache: Optional[DNSCache] = None) -> str:
     """
         Perform an async DNS lookup for the given FQDN.
 
         Args:
             storage_account (str): The FQDN of the Azure Storage Account.
-            resolver (aiodns.DNSResolver): An object to perform asynchronous DNS queries.
+            resolver (ResolverPool): The resolvers shared by the whole run.
+            cache (DNSCache, optional): The DNS cache. Fresh answers are taken from it and new answers are saved in it.
 
         Returns:
-            str: The storage_account (FQDN) if the DNS lookup is successful, otherwise raises an exception.
+            str: The storage_account (FQDN) if the DNS lookup is successful, otherwise None.
     """
 
-    try:
+    outcome = await resolveStorageAccount(storage_account, resolver, cache)
 
-        await resolver.query(storage_account, 'A')
+    if outcome == FOUND:
         print(f"\t[{AZURE_STORAGE}] Azure Storage Account found: {storage_account}")
-        
         return storage_account
-        
-    except aiodns.error.DNSError as e:
-        
-        #print(f"{e.args[1]} - Code {e.args[0]} - {storage_account}")
-        pass
 
+    if outcome in (FAILED, UNKNOWN):
+        print(f"\t[{WARNING}] DNS lookup {outcome} for: {storage_account}")
 
 
-async def checkAzureResources(storage_accounts: list[str]) -> list[str]:
+
+async def checkAzureResources(storage_accounts: list[str], cache: Optional[DNSCache] = None) -> list[str]:
     """
         Performs asynchronous DNS lookups for a list of Azure storage accounts.
 
         Args:
             storage_accounts (list[str]): A list of storage account FQDNs to check.
+            cache (DNSCache, optional): The DNS cache.
 
         Returns:
             list[str]: A list of storage account FQDNs that successfully resolved the DNS lookup.
     """
 
-    resolver = aiodns.DNSResolver()
+    resolver = ResolverPool()
+
+    try:
+        # Launch DNS queries for each storage account, DNS_CONCURRENCY at a time
+        results = runBounded(lambda storage_account: dnsLookup(storage_account, resolver, cache), storage_accounts, DNS_CONCURRENCY)
+
+        # Return only successful lookups
+        return [storage_account async for storage_account in results if storage_account is not None]
+
+    finally:
+        resolver.close()
+
+
+
+def endpointGroups(resources: list[str]) -> dict[str, list[str]]:
+    """
+        Groups the resources whose endpoints share the storage account name (see 2.).
+
+        Args:
+            resources (list[str]): A list of Azure resources, e.g. ["blob.core.windows.net", "file.core.windows.net"].
+
+        Returns:
+            dict[str, list[str]]: The resource resolved for each group and every resource of the group, starting with it.
+                Resources of other services are groups of their own.
+    """
+
+    groups = {}
+
+    # Repeated resources would only repeat the same lookups
+    for resource in dict.fromkeys(resources):
+        service, _, namespace = resource.partition(".")
+        groups.setdefault(namespace if service in STORAGE_SERVICES else resource, []).append(resource)
+
+    # The blob endpoint goes first when the group has one (sort is stable)
+    return {group[0]: group for group in (sorted(group, key=lambda resource: not resource.startswith("blob.")) for group in groups.values())}
+
+
+
+def serviceEndpoints(storage_account: str, resources: list[str]) -> list[str]:
+    """
+        Expands a storage account that exists into the endpoints of every service of its group, without any lookup.
+
+        Args:
+            storage_account (str): The FQDN that resolved, as yielded by storageAccountCandidates.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+
+        Returns:
+            list[str]: The FQDN of every endpoint of the account, starting with storage_account.
+    """
+
+    name, _, resource = storage_account.partition(".")
 
-    # Launch DNS queries for each storage account
-    tasks = [dnsLookup(storage_account, resolver) for storage_account in storage_accounts]
+    return ["".join([name, ".", endpoint]) for endpoint in endpointGroups(resources).get(resource, [resource])]
 
-    # Wait until all tasks are completed
-    results = await asyncio.gather(*tasks)
 
-    # Return only successful lookups (assuming dnsLookup raises for errors)
-    return [storage_account for storage_account in results if storage_account is not None]
+
+def isBlobEndpoint(storage_account: str) -> bool:
+    """
+        Tells if an endpoint is the blob endpoint of its account, the only one whose containers are probed.
+    """
+
+    return storage_account.split(".")[1:2] == ["blob"]
+
+
+
+def storageAccountCandidates(company: str, keywords: list[str], resources: list[str], ranking: Optional[HitRates] = None) -> Iterator[str]:
+    """
+        Yields the storage account FQDNs to be resolved for a company: every permutation combined with one resource of each group (see endpointGroups).
+            The other endpoints of the accounts that exist are given by serviceEndpoints.
+
+        Args:
+            company (str): The company name to be used in the storage account names.
+            keywords (list[str]): A list of keywords to be included in the storage account names.
+            resources (list[str]): A list of Azure resources to be appended to the storage account names.
+            ranking (HitRates, optional): The hit rates of previous runs, to yield the likely storage accounts first.
+
+        Yields:
+            str: A storage account FQDN, "<mystorageaccount>.<resource>".
+    """
+
+    resources = list(endpointGroups(resources))
+
+    # Get permutations for company and keywords, and append each storage account to each resource
+    for storage_account in permutation(company, keywords, ranking):
+        for resource in resources:
+            yield "".join([storage_account, ".", resource])
 
 
 
@@ -143,20 +276,17 @@ def findStorageAccounts(company: str, keywords: list[str], resources: list[str])
             list[str]: A list of valid Azure storage account FQDNs generated from the permutations.
     """
 
-    storage_accounts = []
     valid_storage_accounts  = []
-    fqdn = []
 
-    # Get permutations for company and keywords
-    storage_accounts = permutation(company, keywords)
-
-    for resource in resources:
-        # Append the storage accounts to each resource
-        fqdn.extend(["".join([storage_account, ".", resource]) for storage_account in storage_accounts])
+    # Storage account FQDNs built from the permutations of company and keywords
+    fqdn = storageAccountCandidates(company, keywords, resources)
 
     # Check if fqdn (storage account names) are valid using asynchronous tasks
     loop = asyncio.get_event_loop()
-    valid_storage_accounts .extend(loop.run_until_complete(checkAzureResources(fqdn)))
+
+    # Every endpoint of the storage accounts found
+    for storage_account in loop.run_until_complete(checkAzureResources(fqdn)):
+        valid_storage_accounts .extend(serviceEndpoints(storage_account, resources))
 
     # Return the list of valid storage account FQDNs
     return valid_storage_accounts 
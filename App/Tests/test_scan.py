@@ -0,0 +1,134 @@
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+'''
+    Info
+
+    End-to-end runs of the scan against the stand-ins of the benchmarks (Benchmarks/dnsServer.py and Benchmarks/blobServer.py):
+    nothing leaves the machine. Every run is a fresh interpreter, so what it imports and prints is its own.
+
+    Usage (from the App folder):
+
+        python -m pytest Tests
+'''
+
+APP_FOLDER = Path(__file__).resolve().parent.parent
+
+# Started in every run: the stand-ins, config pointed at them, and a throwaway working folder
+PRELUDE = """
+import asyncio, json, os, sys, tempfile, threading
+sys.path.insert(0, {app!r})
+import config
+from Benchmarks.dnsServer import startDNSServer
+
+loop = asyncio.new_event_loop()
+threading.Thread(target=loop.run_forever, daemon=True).start()
+
+async def start():
+    transport, _ = await startDNSServer({{"acmedata.blob.core.windows.net"}})
+    blob_port = None
+
+    if {blobs!r}:
+        from Benchmarks.blobServer import startBlobServer
+        _, blob_port = await startBlobServer({{("acmedata", "acme"): 1200}}, page_size=500)
+
+    return transport.get_extra_info("sockname")[1], blob_port
+
+dns_port, blob_port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+config.DNS_NAMESERVERS = ["127.0.0.1"]
+config.DNS_PORT = dns_port
+config.BLOB_ENDPOINT = f"http://127.0.0.1:{{blob_port}}"
+os.chdir({folder!r})
+
+result = {{}}
+"""
+
+EPILOGUE = """
+with open("result.json", "w") as file:
+    json.dump(result, file)
+"""
+
+
+
+def runScan(body: str, blobs: bool = True) -> tuple[str, dict]:
+    """
+        Runs a scan script in a new interpreter.
+
+        Args:
+            body (str): The script, run after the prelude. It puts what it measures in the `result` dict.
+            blobs (bool): Start the blob endpoint stand-in too (it loads aiohttp).
+
+        Returns:
+            tuple[str, dict]: The standard output of the run and its result.
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        script = PRELUDE.format(app=str(APP_FOLDER), blobs=blobs, folder=folder) + body + EPILOGUE
+        run = subprocess.run([sys.executable, "-c", script], cwd=folder, capture_output=True, text=True, timeout=300)
+
+        assert run.returncode == 0, run.stderr
+
+        return (run.stdout, json.loads(Path(folder, "result.json").read_text()))
+
+
+
+def test_accounts_mode_does_not_load_aiohttp():
+    stdout, result = runScan("""
+import MicrosoftAzure.az as az
+az.Azure(["acme"], ["data", "logs"], ["blob.core.windows.net"], mode="accounts")
+result["aiohttp"] = "aiohttp" in sys.modules
+""", blobs=False)
+
+    assert "acmedata.blob.core.windows.net" in stdout
+    assert result["aiohttp"] is False
+
+
+
+def test_scanEvents_prints_nothing():
+    stdout, result = runScan("""
+from MicrosoftAzure.az import scanEvents
+
+async def main():
+    kinds = {}
+
+    async for event in scanEvents(["acme"], ["data", "logs"], ["blob.core.windows.net"]):
+        kinds[type(event).__name__] = kinds.get(type(event).__name__, 0) + 1
+
+    return kinds
+
+result["events"] = asyncio.run(main())
+""")
+
+    assert stdout == ""
+    assert result["events"]["ContainerExposed"] == 1
+    assert result["events"]["PageListed"] >= 1
+    assert result["events"]["ScanNotice"] >= 1
+
+
+
+def test_partitioned_listing_lists_every_blob_once():
+    stdout, result = runScan("""
+from Benchmarks.blobServer import startBlobServer
+import MicrosoftAzure.containers as containers
+import MicrosoftAzure.blobs as blobs
+
+async def listing(folders):
+    _, port = await startBlobServer({("acmedata", "acme"): 3000}, page_size=200, folders=folders)
+    url = f"http://127.0.0.1:{port}/acmedata/acme?restype=container&comp=list"
+
+    async with await containers.createSession() as session:
+        serial = [blob.name async for page, _ in blobs.getBlobs("acmedata", url, session) for blob in page]
+        partitioned = [blob.name async for page, _ in blobs.getBlobsPartitioned("acmedata", url, session, concurrency=4) for blob in page]
+
+    return {"serial": serial, "partitioned": partitioned}
+
+result["flat"] = asyncio.run_coroutine_threadsafe(listing(0), loop).result()
+result["folders"] = asyncio.run_coroutine_threadsafe(listing(5), loop).result()
+""", blobs=False)
+
+    for listing in (result["flat"], result["folders"]):
+        assert len(listing["serial"]) == 3000
+        assert sorted(listing["partitioned"]) == listing["serial"]
@@ -0,0 +1,368 @@
+from config import OUTPUT_FOLDER, PARQUET_BATCH_ROWS, PARQUET_ROWS_PER_FILE
+from metrics import METRICS
+from utils import BlobRecord
+
+from datetime import date, datetime
+from pathlib import Path
+from typing import AsyncIterator, Callable, Union
+import os
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+
+except ImportError as e:
+    raise ImportError('OUTPUT_FORMAT = "parquet" needs pyarrow: pip install pyarrow') from e
+
+'''
+    Info
+
+    Parquet output, an alternative to one CSV file per container (OUTPUT_FORMAT = "parquet" in config.py).
+
+    The blobs of every container listed go to a dataset partitioned by company and scan date (Hive style):
+
+        Output/Parquet/blobs/company=<company>/scan_date=<YYYY-MM-DD>/part-<run>-<n>.parquet
+        Output/Parquet/changes/...          (--incremental scans, with the "change" column)
+
+    Columns are typed (size is int64, creation_time and last_modified are UTC timestamps), rows are written in
+    row groups of PARQUET_BATCH_ROWS, and a part file holds the blobs of many containers, up to PARQUET_ROWS_PER_FILE.
+    Tools like pyarrow.dataset, DuckDB or Spark read only the columns and partitions a query needs:
+
+        pyarrow.dataset.dataset("Output/Parquet/blobs", partitioning="hive").to_table(columns=["url", "size"], filter=pyarrow.compute.field("size") > 2**30)
+
+    A part file is written under a hidden name (dataset readers skip it) and renamed once it is complete.
+    A Parquet file is only readable once it is closed, so the containers it holds are recorded as listed in the
+    journal at that moment (see ParquetSink.done); after a crash, --resume lists them again.
+
+    Only complete listings go to a part file: the rows of a container are staged (see StagedContainer) until its
+    listing ends, and dropped if it fails, so a container listed again later is never in the dataset twice.
+    Rows beyond a row group are staged in a hidden Parquet file, so a large container doesn't stay in memory.
+'''
+
+BLOB_FIELDS = [
+    pyarrow.field("name", pyarrow.string()),
+    pyarrow.field("container", pyarrow.string()),
+    pyarrow.field("storage_account", pyarrow.string()),
+    pyarrow.field("url", pyarrow.string()),
+    pyarrow.field("creation_time", pyarrow.timestamp("s", tz="UTC")),
+    pyarrow.field("last_modified", pyarrow.timestamp("s", tz="UTC")),
+    pyarrow.field("blob_type", pyarrow.string()),
+    pyarrow.field("etag", pyarrow.string()),
+    pyarrow.field("size", pyarrow.int64()),
+    pyarrow.field("content_type", pyarrow.string()),
+    pyarrow.field("content_encoding", pyarrow.string()),
+    pyarrow.field("content_language", pyarrow.string()),
+    pyarrow.field("content_md5", pyarrow.string()),
+    pyarrow.field("status", pyarrow.string()),
+    pyarrow.field("state", pyarrow.string()),
+]
+
+BLOBS_SCHEMA = pyarrow.schema(BLOB_FIELDS)
+CHANGES_SCHEMA = pyarrow.schema([pyarrow.field("change", pyarrow.string())] + BLOB_FIELDS)
+
+# Format of the dates of the blob records, as in the List Blobs XML
+DATE_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+
+
+
+class PartFile:
+    """
+        A part file being written: its writer, the rows waiting for the next row group and the callbacks to run once it is complete.
+    """
+
+    def __init__(self, path: Path, schema: pyarrow.Schema):
+        self.path = path
+        self.temporary_path = path.with_name(f".{path.name}.tmp")
+        self.writer = pyarrow.parquet.ParquetWriter(self.temporary_path, schema, compression="zstd")
+        self.buffer = [] # (storage_account, container, change, BlobRecord)
+        self.rows = 0
+        self.callbacks = []
+
+
+
+class StagedContainer:
+    """
+        The rows of a container being listed, kept apart from the part file of its company until the listing is complete.
+
+        Args:
+            sink (ParquetSink): The sink the rows go to.
+            company (str): The company name.
+            storage_account (str): The storage account FQDN.
+            container (str): The container name.
+    """
+
+    def __init__(self, sink: "ParquetSink", company: str, storage_account: str, container: str):
+        self.sink = sink
+        self.company = company
+        self.storage_account = storage_account
+        self.container = container
+        self.buffer = [] # (storage_account, container, change, BlobRecord)
+        self.rows = 0
+        self.spill_path = None
+        self.spill = None
+
+
+    def write(self, blobs: list[Union[BlobRecord, tuple[str, BlobRecord]]]):
+        """
+            Adds blobs of the container. Past a row group, they are written to the staging file.
+
+            Args:
+                blobs (list): The blobs, as yielded by getBlobs (or (change, BlobRecord) for a changes sink).
+        """
+
+        if self.sink.changes:
+            self.buffer.extend((self.storage_account, self.container, change, blob) for change, blob in blobs)
+
+        else:
+            self.buffer.extend((self.storage_account, self.container, None, blob) for blob in blobs)
+
+        self.rows += len(blobs)
+
+        if len(self.buffer) >= self.sink.batch_rows:
+            if self.spill is None:
+                self.spill_path = self.sink.stagingPath()
+                self.spill = pyarrow.parquet.ParquetWriter(self.spill_path, self.sink.schema)
+
+            self.spill.write_table(self.sink.table(self.buffer), row_group_size=self.sink.batch_rows)
+            self.buffer = []
+
+
+    def discard(self):
+        """
+            Drops the rows of a listing that failed.
+        """
+
+        if self.spill is not None:
+            self.spill.close()
+            self.spill_path.unlink(missing_ok=True)
+            self.spill = None
+
+        self.buffer = []
+        self.rows = 0
+
+
+
+class ParquetSink:
+    """
+        Writes the listed blobs to a Parquet dataset partitioned by company and scan date (see the top of the module).
+            One part file per company is open at a time, shared by every container of the company.
+
+        Args:
+            folder (str): The root folder of the datasets.
+            changes (bool): The blobs are the changes of an --incremental scan.
+            batch_rows (int): Rows per row group.
+            rows_per_file (int): A part file is closed once it holds at least this many rows.
+    """
+
+    def __init__(self, folder: str = f"{OUTPUT_FOLDER}/Parquet", changes: bool = False, batch_rows: int = PARQUET_BATCH_ROWS, rows_per_file: int = PARQUET_ROWS_PER_FILE):
+        self.root = Path(folder) / ("changes" if changes else "blobs")
+        self.changes = changes
+        self.schema = CHANGES_SCHEMA if changes else BLOBS_SCHEMA
+        self.batch_rows = batch_rows
+        self.rows_per_file = rows_per_file
+
+        self.scan_date = date.today().isoformat()
+
+        # Several runs (and --workers processes) write to the same partitions, their part files must not collide
+        self.run = f"{datetime.now():%H%M%S%f}-{os.getpid()}"
+        self.files = 0
+
+        self.parts = {}
+        self.staged = 0
+        self.notices = [] # (level, message) of the part files completed, reported by the caller (see az.listingStage)
+
+
+    def stage(self, company: str, storage_account: str, container: str) -> StagedContainer:
+        """
+            Starts the rows of a container. They go to the part file of the company once the listing is complete (see done).
+
+            Args:
+                company (str): The company name.
+                storage_account (str): The storage account FQDN.
+                container (str): The container name.
+
+            Returns:
+                StagedContainer: Where the blobs of the container are written.
+        """
+
+        return StagedContainer(self, company, storage_account, container)
+
+
+    def stagingPath(self) -> Path:
+        """
+            Returns a new staging file, in a hidden folder that dataset readers skip.
+        """
+
+        folder = self.root / ".staging"
+        folder.mkdir(parents=True, exist_ok=True)
+
+        self.staged += 1
+
+        return folder / f"{self.run}-{self.staged}.parquet"
+
+
+    def partFile(self, company: str) -> PartFile:
+        """
+            Returns the part file of a company, a new one if none is open.
+        """
+
+        part = self.parts.get(company)
+
+        if part is None:
+            folder = self.root / f"company={company.replace('/', '_')}" / f"scan_date={self.scan_date}"
+            folder.mkdir(parents=True, exist_ok=True)
+
+            self.files += 1
+            part = self.parts[company] = PartFile(folder / f"part-{self.run}-{self.files}.parquet", self.schema)
+
+        return part
+
+
+    def table(self, rows: list) -> pyarrow.Table:
+        """
+            Converts buffered rows, (storage_account, container, change, BlobRecord), to a table of the schema of the sink.
+        """
+
+        storage_accounts, containers, changes, blobs = zip(*rows)
+
+        columns = {field: list(values) for field, values in zip(BlobRecord._fields, zip(*blobs))}
+        columns["change"] = changes
+        columns["container"] = containers
+        columns["storage_account"] = storage_accounts
+        columns["url"] = ["".join([storage_account, "/", container, "/", name]) for storage_account, container, name in zip(storage_accounts, containers, columns["name"])]
+        # Same spelling as the CSV files
+        columns["blob_type"] = [blob_type.upper() if blob_type else None for blob_type in columns["blob_type"]]
+
+        # The dates are kept as in the XML, they are parsed in a single vectorized call per column
+        arrays = []
+        for field in self.schema:
+            if pyarrow.types.is_timestamp(field.type):
+                parsed = pyarrow.compute.strptime(pyarrow.array(columns[field.name], pyarrow.string()), format=DATE_FORMAT, unit="s")
+                arrays.append(parsed.cast(field.type))
+
+            else:
+                arrays.append(pyarrow.array(columns[field.name], field.type))
+
+        return pyarrow.Table.from_arrays(arrays, schema=self.schema)
+
+
+    def flush(self, part: PartFile):
+        """
+            Writes the buffered rows of a part file as a row group.
+        """
+
+        if len(part.buffer) == 0:
+            return
+
+        part.writer.write_table(self.table(part.buffer), row_group_size=self.batch_rows)
+        part.rows += len(part.buffer)
+        part.buffer = []
+
+
+    def done(self, staged: StagedContainer, callback: Callable[[], None]):
+        """
+            Moves the rows of a container whose listing is complete to the part file of its company. The callback runs
+                once they are on disk, in a complete part file (right away if the container had no blobs and no part file is open).
+
+            Args:
+                staged (StagedContainer): The rows of the container.
+                callback (Callable[[], None]): e.g. recording the container as listed in the journal.
+        """
+
+        company = staged.company
+
+        if staged.rows == 0 and company not in self.parts:
+            callback()
+            return
+
+        part = self.partFile(company)
+
+        if staged.spill is not None:
+            staged.spill.close()
+
+            for batch in pyarrow.parquet.ParquetFile(staged.spill_path).iter_batches(batch_size=self.batch_rows):
+                # Parquet keeps second timestamps in milliseconds: back to the schema of the sink
+                part.writer.write_table(pyarrow.Table.from_batches([batch]).cast(self.schema), row_group_size=self.batch_rows)
+                part.rows += batch.num_rows
+
+            staged.spill_path.unlink(missing_ok=True)
+            staged.spill = None
+
+        part.buffer.extend(staged.buffer)
+        staged.buffer = []
+
+        if len(part.buffer) >= self.batch_rows:
+            self.flush(part)
+
+        part.callbacks.append(callback)
+
+        if part.rows + len(part.buffer) >= self.rows_per_file:
+            self.closePart(company)
+
+
+    def closePart(self, company: str):
+        """
+            Writes the last row group of the part file of a company, makes it visible and runs its callbacks.
+        """
+
+        part = self.parts.pop(company)
+
+        self.flush(part)
+        part.writer.close()
+        os.replace(part.temporary_path, part.path)
+
+        self.notices.append(("creation", f"File {part.path} has been created ({part.rows} blobs)"))
+
+        for callback in part.callbacks:
+            callback()
+
+
+    def close(self):
+        """
+            Completes every part file still open.
+        """
+
+        for company in list(self.parts):
+            self.closePart(company)
+
+
+
+async def writeParquet(pages: AsyncIterator[list[Union[BlobRecord, tuple[str, BlobRecord]]]], sink: ParquetSink, company: str, storage_account: str, container_name: str, listed: Callable[[], None]) -> int:
+    """
+        Gives the blobs of a container to the Parquet sink as the listing pages arrive, the counterpart of utils.writeBlobs.
+            They reach a part file only if the listing completes; if it fails, they are dropped and the exception goes on.
+
+        Args:
+            pages (AsyncIterator[list]): The listing pages, each one a list of BlobRecord (or of (change, BlobRecord) for a changes sink).
+            sink (ParquetSink): The sink shared by the whole run.
+            company (str): The company name.
+            storage_account (str): The storage account FQDN.
+            container_name (str): The container name.
+            listed (Callable[[], None]): Runs once the blobs are in a complete part file (see ParquetSink.done).
+
+        Returns:
+            int: The number of blobs written.
+    """
+
+    staged = sink.stage(company, storage_account, container_name)
+    written = 0
+
+    try:
+        async for blobs in pages:
+            if len(blobs) == 0:
+                continue
+
+            async with METRICS.track("write"):
+                staged.write(blobs)
+
+            written += len(blobs)
+
+    except BaseException:
+        staged.discard()
+        raise
+
+    sink.done(staged, listed)
+    METRICS.increment("blobs_written", written)
+
+    return written
@@ -3,6 +3,12 @@ from colorama import Fore, Style
 # Relevant Folders
 DATA = "Data" # Data Folder
 OUTPUT_FOLDER = "Output" # Output Folder
+CACHE_FOLDER = "Cache" # Cache Folder, kept between runs
+
+# Output of the blob listings
+OUTPUT_FORMAT = "csv" # "csv": one CSV file per container. "parquet": a Parquet dataset partitioned by company and scan date (needs pyarrow, see columnar.py)
+PARQUET_BATCH_ROWS = 50000 # Rows per Parquet row group
+PARQUET_ROWS_PER_FILE = 1000000 # A Parquet part file is completed once it holds this many rows (or at the end of the run)
 
 # Companies 
 companies_file = f"{DATA}/Companies.txt"
@@ -12,6 +18,101 @@ azure_resources_file = f"{DATA}/Azure_Resources.txt"
 keywords_file = f"{DATA}/Containers.txt"
 containers_file = f"{DATA}/Containers.txt"
 
+# Compiled wordlists (see wordlists.py)
+WORDLISTS_CACHE_ENABLED = True # Keep the compiled form of the wordlists, so the next runs with the same files don't parse and validate them again
+WORDLISTS_FOLDER = f"{CACHE_FOLDER}/Wordlists" # One compiled file per wordlist content
+
+# Checkpoint journal (see journal.py)
+JOURNAL_FILE = f"{CACHE_FOLDER}/journal.jsonl"
+
+# DNS Discovery
+DNS_CONCURRENCY = 200 # Maximum number of in-flight DNS queries for the whole run
+
+# DNS Resolvers (see resolver.py)
+DNS_NAMESERVERS = [] # Nameservers the queries are spread across, e.g. ["1.1.1.1", "8.8.8.8"]. Empty: system configuration
+DNS_PORT = 53 # Port of the nameservers
+DNS_TIMEOUT = 3 # Seconds to wait for the answer to a single query
+DNS_RETRIES = 2 # Extra attempts for timeouts, SERVFAIL and other transient errors (never for NXDOMAIN)
+DNS_CONCURRENCY_PER_RESOLVER = 100 # Maximum number of in-flight DNS queries per nameserver
+
+DNS_LOOKUP_DEADLINE = 15 # Seconds a DNS lookup may take, retries included. Past it, the name is unknown (neither found nor absent)
+
+# DNS Cache
+DNS_CACHE_ENABLED = True # Reuse DNS answers from previous runs
+DNS_CACHE_FILE = f"{CACHE_FOLDER}/dns_cache.sqlite3" # SQLite database with the DNS answers
+DNS_CACHE_POSITIVE_TTL = 7 * 24 * 3600 # Seconds a Storage Account that exists is trusted without asking again
+DNS_CACHE_NEGATIVE_TTL = 24 * 3600 # Seconds a Storage Account that does not exist (NXDOMAIN) is trusted without asking again
+
+# Candidate ordering (see planner.py)
+HIT_RATES_ENABLED = True # Probe the candidates by expected yield, from the keywords and patterns that produced hits in previous runs
+HIT_RATES_FILE = f"{CACHE_FOLDER}/hit_rates.sqlite3" # SQLite database with the tries and hits of every keyword and pattern
+
+# Negative filter of the container probes (see negativeFilter.py)
+NEGATIVE_FILTER_ENABLED = True # Skip the containers that answered 404 in recent runs (--reprobe probes them again)
+NEGATIVE_FILTER_FOLDER = f"{CACHE_FOLDER}/Negatives" # One Bloom filter file per generation
+NEGATIVE_FILTER_MB = 32 # Size of each generation, about 18 million pairs at 0.1% false positives
+NEGATIVE_FILTER_GENERATIONS = 4 # Generations kept: a 404 is probed again once its generation is dropped
+NEGATIVE_FILTER_DAYS = 7 # Days a generation takes new pairs (a full one is replaced earlier)
+NEGATIVE_FILTER_FALSE_POSITIVES = 0.001 # Target false positive rate of a generation: never-probed containers skipped by mistake
+
+# Inventory of the containers listed, for --incremental scans (see inventory.py)
+INVENTORY_FILE = f"{CACHE_FOLDER}/inventory.sqlite3" # SQLite database with the last known blobs of every container
+
+# Pipeline
+ACCOUNTS_QUEUE_SIZE = 100 # Storage Accounts waiting to be probed for containers
+CONTAINERS_QUEUE_SIZE = 100 # Exposed containers waiting to be listed, each one with its first listing page (up to 5000 blobs)
+PROBE_WORKERS = 4 # Storage Accounts probed for containers at the same time
+LISTING_WORKERS = 4 # Containers listed at the same time (blob listings run concurrently in the same event loop)
+LISTING_PARTITION_CONCURRENCY = 1 # Prefixes of a large container listed at the same time (see blobs.getBlobsPartitioned). 1: one page at a time, following the markers. Above 1, a listing stopped halfway starts over on --resume (its pages have no marker)
+LISTING_PARTITION_DEPTH = 3 # Levels of prefixes a large container can be split into
+LISTING_DELIMITER = "/" # Separator of the prefix levels ("folders") in the blob names
+
+# Blob endpoint
+BLOB_ENDPOINT = None # None: https://<mystorageaccount>.blob.core.windows.net. Set to e.g. "http://127.0.0.1:10000" to use path-style URLs against an emulator (Azurite, Benchmarks)
+
+# Storage REST API version of the probes and listings. The probe body is reused as the first listing page, so both must agree
+AZURE_STORAGE_API_VERSION = "2021-08-06"
+
+# HTTP Probing
+HTTP_CONCURRENCY = 100 # Maximum number of in-flight HTTP requests for the whole run
+HTTP_CONCURRENCY_PER_HOST = 20 # Maximum number of connections to a single <storage_account>.blob.core.windows.net
+HTTP_KEEPALIVE_TIMEOUT = 30 # Seconds an idle keep-alive connection stays in the pool
+
+# Deadlines and hedged probes (see planner.Deadline and containers.hedgedRequest)
+HTTP_TIMEOUT = 30 # Seconds a probe or listing request may wait to connect, and then for each read of the answer. It is retried like a dropped connection
+HTTP_REQUEST_DEADLINE = 120 # Seconds a request may take in all, waiting for a free connection included. Cuts off an answer that trickles in
+COMPANY_DEADLINE = None # Seconds the discovery, and then the container probing, may spend on a company. None: no deadline
+STAGE_DEADLINE = None # Seconds the discovery, and then the container probing, may take for the whole run. None: no deadline
+HEDGE_ENABLED = True # Send a second request for a probe slower than HEDGE_PERCENTILE of the probes, the first answer wins
+HEDGE_PERCENTILE = 0.95 # Latency percentile of the probes after which a probe is hedged
+HEDGE_MIN_SAMPLES = 200 # Probes measured before the percentile is trusted: no hedging before
+HEDGE_MAX_RATIO = 0.05 # Hedged probes at most, as a fraction of the probes sent
+
+# HTTP Retries and adaptive concurrency (see limiter.py)
+HTTP_RETRIES = 3 # Extra attempts for a probe that was throttled or lost its connection
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504) # HTTP status codes worth retrying
+HTTP_BACKOFF_BASE = 0.5 # Seconds of the first backoff, doubled on every attempt (with full jitter)
+HTTP_BACKOFF_MAX = 30 # Maximum seconds of a single backoff
+HTTP_ADAPTIVE_INITIAL = 50 # Starting number of in-flight probes, it grows up to HTTP_CONCURRENCY while errors stay low
+HTTP_ADAPTIVE_MINIMUM = 4 # The number of in-flight probes never shrinks below this value
+
+# Events of a scan (see events.py)
+EVENTS_QUEUE_SIZE = 1000 # Events waiting for the consumer of az.scanEvents: the stages wait while it is full
+CONSOLE_LINES_PER_SECOND = 50 # Findings and errors printed per second, the next ones are only counted (--events writes them all)
+
+# Distributed scans (see MicrosoftAzure/distributed.py)
+DISTRIBUTED_UNIT_SIZE = 5000 # Storage account candidates (DNS lookups) of a work unit
+DISTRIBUTED_LEASE_SECONDS = 120 # A work unit goes to another worker if its lease is not renewed in time (workers renew it every third of it)
+DISTRIBUTED_MAX_ATTEMPTS = 3 # Leases of a work unit that failed or expired before it is given up
+DISTRIBUTED_TOKEN = None # Shared secret of the coordinator and its workers (--token). None: any client that reaches the port is a worker
+DISTRIBUTED_STATE_FILE = f"{CACHE_FOLDER}/coordinator.jsonl" # Work units completed by the workers, for --resume of the coordinator
+DISTRIBUTED_WORKERS_FOLDER = f"{CACHE_FOLDER}/Workers" # Working folders of the workers (--local-workers, or --worker without --workdir)
+
+# Metrics and profiling (see metrics.py)
+METRICS_FILE = f"{CACHE_FOLDER}/metrics.json" # Periodic snapshot of the stage metrics, in Prometheus text format if it ends in .prom. None: no snapshots
+METRICS_INTERVAL = 10 # Seconds between two snapshots
+PROFILE_FOLDER = f"{CACHE_FOLDER}/Profile" # Where --profile writes the cProfile and tracemalloc results
+
 # Colorama Stile
 INFO = f'{Fore.BLUE}{Style.BRIGHT}INFO{Style.RESET_ALL}'
 AZURE_STORAGE = f'{Fore.GREEN}{Style.BRIGHT}AZURE STORAGE{Style.RESET_ALL}'
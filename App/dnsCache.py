@@ -0,0 +1,150 @@
+from config import DNS_CACHE_POSITIVE_TTL, DNS_CACHE_NEGATIVE_TTL
+
+from pathlib import Path
+from typing import Optional
+import sqlite3
+import time
+
+'''
+    Info
+
+    DNS answers are kept in a SQLite database between runs:
+        - Positive answers (the Storage Account exists) are trusted for DNS_CACHE_POSITIVE_TTL seconds.
+        - Negative answers (NXDOMAIN / no data) are trusted for DNS_CACHE_NEGATIVE_TTL seconds.
+        - Any other error (timeout, SERVFAIL, ...) is never cached.
+
+    The TTLs are applied when reading, so changing them in config.py takes effect on the next run.
+
+    With --workers, every process writes to the same database. It is in WAL mode, so reading never waits for a writer,
+    and new answers are kept in memory and written in one short transaction every COMMIT_EVERY answers or
+    COMMIT_SECONDS: no process holds the write lock while it resolves. When another process holds it longer than
+    LOCK_TIMEOUT, the answers stay in memory until the next write, instead of stalling the event loop.
+'''
+
+# Answers kept in memory before they are written
+COMMIT_EVERY = 100
+COMMIT_SECONDS = 1
+
+# Seconds a write waits for the lock held by another process
+LOCK_TIMEOUT = 0.05
+
+
+
+class DNSCache:
+    """
+        On-disk cache of DNS answers for the storage account discovery.
+
+        Args:
+            file_path (str): The path to the SQLite database. It is created if it doesn't exist.
+            positive_ttl (int): Seconds a positive answer stays fresh.
+            negative_ttl (int): Seconds a negative answer stays fresh.
+    """
+
+    def __init__(self, file_path: str, positive_ttl: int = DNS_CACHE_POSITIVE_TTL, negative_ttl: int = DNS_CACHE_NEGATIVE_TTL):
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.pending = {}
+        self.written_at = time.monotonic()
+
+        # The table is created with a long timeout: every process of the run starts at the same time
+        self.connection = sqlite3.connect(file_path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lookups (fqdn TEXT PRIMARY KEY, found INTEGER NOT NULL, resolved_at REAL NOT NULL)")
+        self.connection.commit()
+        self.connection.execute(f"PRAGMA busy_timeout = {int(LOCK_TIMEOUT * 1000)}")
+
+
+    def get(self, fqdn: str) -> Optional[bool]:
+        """
+            Looks up a fresh answer for the FQDN.
+
+            Args:
+                fqdn (str): The FQDN to look up.
+
+            Returns:
+                Optional[bool]: True if the name exists, False if it doesn't, None if there is no fresh answer.
+        """
+
+        row = self.pending.get(fqdn) or self.connection.execute("SELECT found, resolved_at FROM lookups WHERE fqdn = ?", (fqdn,)).fetchone()
+
+        if row is not None:
+            found, resolved_at = bool(row[0]), row[1]
+            ttl = self.positive_ttl if found else self.negative_ttl
+
+            if time.time() - resolved_at < ttl:
+                self.hits += 1
+                return found
+
+        self.misses += 1
+        return None
+
+
+    def store(self, fqdn: str, found: bool):
+        """
+            Saves the answer for the FQDN.
+
+            Args:
+                fqdn (str): The FQDN resolved.
+                found (bool): True if the name exists, False for NXDOMAIN / no data.
+        """
+
+        self.pending[fqdn] = (int(found), time.time())
+
+        if len(self.pending) >= COMMIT_EVERY or time.monotonic() - self.written_at >= COMMIT_SECONDS:
+            self.write()
+
+
+    def write(self, wait: bool = False) -> bool:
+        """
+            Writes the answers kept in memory, in a single transaction.
+
+            Args:
+                wait (bool): Wait for the lock as long as it takes (end of the run), instead of LOCK_TIMEOUT.
+
+            Returns:
+                bool: False if another process held the lock: the answers are kept for the next write.
+        """
+
+        self.written_at = time.monotonic()
+
+        if not self.pending:
+            return True
+
+        if wait:
+            self.connection.execute("PRAGMA busy_timeout = 30000")
+
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO lookups (fqdn, found, resolved_at) VALUES (?, ?, ?)",
+                    ((fqdn, found, resolved_at) for fqdn, (found, resolved_at) in self.pending.items()),
+                )
+
+        except sqlite3.OperationalError as e:
+            if wait or "locked" not in str(e):
+                raise
+
+            return False
+
+        self.pending.clear()
+
+        return True
+
+
+    def close(self) -> dict:
+        """
+            Writes the pending answers and closes the database.
+
+            Returns:
+                dict: The hits and misses of the run.
+        """
+
+        self.write(wait=True)
+        self.connection.close()
+
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,270 @@
+from config import INFO, WARNING, ERROR, NO_RESULTS, CREATION, DELETION, AZURE_STORAGE, BUCKET, CONSOLE_LINES_PER_SECOND
+from utils import BlobRecord
+
+from typing import NamedTuple, Optional, Union
+import asyncio
+import json
+import sys
+import time
+
+'''
+    Info
+
+    The pipeline reports what it finds as typed events instead of printing it:
+
+        AccountFound        A storage account endpoint exists
+        ContainerExposed    A container answered its anonymous listing
+        PageListed          A page of blobs was written (BlobRecord, or (change, BlobRecord) in --incremental scans)
+        ScanError           A DNS lookup, container probe or listing failed
+        ScanNotice          The progress of a stage: retries, budgets and deadlines reached, nothing found
+
+    An EventStream hands every event to its sinks and, for the library (see az.scanEvents), to a bounded queue:
+    when the consumer falls behind, the queue fills up and the stages wait for it.
+
+    Sinks:
+        - JSONLSink:   one JSON object per event (--events), e.g. {"event": "container", "company": ..., "storage_account": ..., "container": ...}
+        - ConsoleView: the findings, errors and notices as colored lines, at most CONSOLE_LINES_PER_SECOND a second.
+                       The lines beyond it are counted, not printed, so a burst of findings doesn't slow the stages down.
+'''
+
+
+
+class AccountFound(NamedTuple):
+    """
+        A storage account endpoint that exists (every endpoint of the account, see storageAccounts.serviceEndpoints).
+    """
+
+    company: str
+    storage_account: str
+
+
+
+class ContainerExposed(NamedTuple):
+    """
+        A container that answered its anonymous listing, with its URL.
+    """
+
+    company: str
+    storage_account: str
+    container: str
+
+
+
+class PageListed(NamedTuple):
+    """
+        A page of blobs written to the output, and the marker of the next page (None for the last one, and for the pages of a container listed by prefixes).
+    """
+
+    company: str
+    storage_account: str
+    container: str
+    blobs: list[Union[BlobRecord, tuple[str, BlobRecord]]]
+    marker: Optional[str]
+
+
+
+class ScanError(NamedTuple):
+    """
+        A DNS lookup, container probe or listing that failed.
+    """
+
+    stage: str # "dns", "probe" or "listing"
+    target: str # The FQDN, storage account or container URL
+    message: str
+
+
+
+class ScanNotice(NamedTuple):
+    """
+        The progress of a stage that is neither a finding nor an error, e.g. a request tried again or a company without storage accounts.
+    """
+
+    stage: str # "dns", "probe" or "listing"
+    target: str # The company, storage account or container URL
+    message: str
+    level: str = "info" # "info", "warning", "no_results", "creation" or "deletion" (files and folders of the output)
+
+
+
+Event = Union[AccountFound, ContainerExposed, PageListed, ScanError, ScanNotice]
+
+# Name of every event type in the JSONL records
+EVENT_KINDS = {AccountFound: "account", ContainerExposed: "container", PageListed: "page", ScanError: "error", ScanNotice: "notice"}
+
+# Indentation of the console lines of each stage
+STAGE_INDENTS = {"dns": "\t", "probe": "\t\t\t", "listing": "\t\t\t\t"}
+
+# Label of the console lines of each notice level
+NOTICE_LABELS = {"info": INFO, "warning": WARNING, "no_results": NO_RESULTS, "creation": CREATION, "deletion": DELETION}
+
+
+
+def eventRecord(event: Event) -> dict:
+    """
+        Converts an event into a JSON-serializable record.
+
+        Args:
+            event (Event): The event.
+
+        Returns:
+            dict: {"event": <kind>, ...the fields of the event}. The blobs of a page are objects with the BlobRecord fields (and "change").
+    """
+
+    record = {"event": EVENT_KINDS[type(event)], **event._asdict()}
+
+    if isinstance(event, PageListed):
+        record["blobs"] = [blob._asdict() if isinstance(blob, BlobRecord) else {"change": blob[0], **blob[1]._asdict()} for blob in event.blobs]
+
+    return record
+
+
+
+class JSONLSink:
+    """
+        Writes every event as a JSON line.
+
+        Args:
+            file_path (str): The file, "-" for the standard output.
+            append (bool): Keep the events already in the file (--resume, worker processes).
+    """
+
+    def __init__(self, file_path: str, append: bool = False):
+        self.file = sys.stdout if file_path == "-" else open(file_path, "a" if append else "w")
+
+
+    def write(self, event: Event):
+        # A single write per line: worker processes append to the same file
+        self.file.write(json.dumps(eventRecord(event)) + "\n")
+        self.file.flush()
+
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+
+class ConsoleView:
+    """
+        Prints the findings and errors, at most lines_per_second a second (see the top of the module).
+
+        Args:
+            lines_per_second (int): The lines printed in a second, the next ones are only counted.
+    """
+
+    def __init__(self, lines_per_second: int = CONSOLE_LINES_PER_SECOND):
+        self.lines_per_second = lines_per_second
+        self.window = time.monotonic()
+        self.shown = 0
+        self.hidden = 0
+
+
+    def line(self, event: Event) -> Optional[str]:
+        """
+            Returns the console line of an event, None for the events that are not shown (blob pages).
+        """
+
+        if isinstance(event, AccountFound):
+            return f"\t[{AZURE_STORAGE}] Azure Storage Account found: {event.storage_account}"
+
+        if isinstance(event, ContainerExposed):
+            return f"\t\t\t[{BUCKET}] Exposed container found in: {event.container}"
+
+        if isinstance(event, ScanError):
+            if event.stage == "dns":
+                return f"\t[{WARNING}] {event.message} for: {event.target}"
+
+            return f"{STAGE_INDENTS[event.stage]}[{ERROR}] {event.stage}Stage - {event.target} - {event.message}"
+
+        if isinstance(event, ScanNotice):
+            return f"{STAGE_INDENTS[event.stage]}[{NOTICE_LABELS[event.level]}] {event.message}"
+
+        return None
+
+
+    def report(self):
+        """
+            Prints how many lines of the last window were not shown.
+        """
+
+        if self.hidden > 0:
+            print(f"[{INFO}] {self.hidden} lines not shown (at most {self.lines_per_second} a second, --events writes every event)")
+            self.hidden = 0
+
+
+    def write(self, event: Event):
+        line = self.line(event)
+
+        if line is None:
+            return
+
+        now = time.monotonic()
+
+        if now - self.window >= 1:
+            self.report()
+            self.window = now
+            self.shown = 0
+
+        if self.shown < self.lines_per_second:
+            print(line)
+            self.shown += 1
+
+        else:
+            self.hidden += 1
+
+
+    def close(self):
+        self.report()
+
+
+
+class EventStream:
+    """
+        Hands the events of a scan to its sinks and to the queue of the library consumer.
+
+        Args:
+            sinks (list, optional): Objects with write(event) and close(), e.g. JSONLSink and ConsoleView.
+            queue (asyncio.Queue, optional): The queue read by az.scanEvents. Emitting waits while it is full.
+    """
+
+    def __init__(self, sinks: Optional[list] = None, queue: Optional[asyncio.Queue] = None):
+        self.sinks = sinks or []
+        self.queue = queue
+
+
+    async def emit(self, event: Event):
+        for sink in self.sinks:
+            sink.write(event)
+
+        if self.queue is not None:
+            await self.queue.put(event)
+
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+
+def createEventStream(events_file: Optional[str] = None, quiet: bool = False, append: bool = False) -> EventStream:
+    """
+        Creates the event stream of a command-line run.
+
+        Args:
+            events_file (str, optional): The JSONL file of the events (--events), "-" for the standard output. None for no file.
+            quiet (bool): Don't print the findings and errors. They are not printed either when the events go to the standard output.
+            append (bool): Keep the events already in the file.
+
+        Returns:
+            EventStream: The stream, to be closed at the end of the run.
+    """
+
+    sinks = []
+
+    if events_file is not None:
+        sinks.append(JSONLSink(events_file, append))
+
+    if not quiet and events_file != "-":
+        sinks.append(ConsoleView())
+
+    return EventStream(sinks)
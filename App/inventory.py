@@ -0,0 +1,221 @@
+from utils import BlobRecord
+
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import hashlib
+import sqlite3
+
+'''
+    Info
+
+    Last known inventory of every container, kept in a SQLite database between runs for --incremental scans.
+
+    Every listing of a container is a new scan. Each blob of the listing is compared with the inventory:
+        - added:    the blob is not in the inventory.
+        - modified: its etag or last_modified changed.
+        - removed:  a blob of the inventory that the listing didn't return (known once the listing is complete).
+
+    Blob listings have no change token that an anonymous client can ask for, so a container can only be skipped
+    when it fits in the first page: the probe body (see containers.fetchContainer) is compared with the digest of
+    the previous one, and an identical answer means nothing changed.
+
+    A listing interrupted and continued with --resume keeps its scan number, so the blobs seen before the
+    interruption are not reported as removed.
+
+    Dates are kept as they come in the List Blobs XML ("Mon, 01 Jan 2024 10:00:00 GMT"), like in BlobRecord.
+'''
+
+# Version of the database layout (PRAGMA user_version)
+#   0: last_modified formatted as in the CSV files ("2024-01-01 10:00:00")
+#   1: last_modified as in the List Blobs XML
+SCHEMA_VERSION = 1
+
+# Names looked up per query, below the SQLite limit of bound parameters
+LOOKUP_CHUNK = 500
+
+CHANGE_ADDED = "added"
+CHANGE_MODIFIED = "modified"
+CHANGE_REMOVED = "removed"
+
+
+
+class Inventory:
+    """
+        On-disk inventory of the blobs of every container listed.
+
+        Args:
+            file_path (str): The path to the SQLite database. It is created if it doesn't exist.
+    """
+
+    def __init__(self, file_path: str):
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.counts = {CHANGE_ADDED: 0, CHANGE_MODIFIED: 0, CHANGE_REMOVED: 0}
+        self.unchanged_containers = 0
+
+        self.connection = sqlite3.connect(file_path, timeout=30)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS blobs (container TEXT NOT NULL, name TEXT NOT NULL, url TEXT, etag TEXT, last_modified TEXT, scan INTEGER NOT NULL, PRIMARY KEY (container, name)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS listings (container TEXT PRIMARY KEY, scan INTEGER NOT NULL, complete INTEGER NOT NULL, digest TEXT)")
+        self.migrate()
+        self.connection.commit()
+
+
+    def migrate(self):
+        """
+            Brings a database written by a previous version to SCHEMA_VERSION, so the next scan doesn't report every blob as modified.
+        """
+
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+
+        if version < 1:
+            def xmlDate(value: Optional[str]) -> Optional[str]:
+                return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").strftime("%a, %d %b %Y %H:%M:%S GMT") if value else value
+
+            self.connection.create_function("xmlDate", 1, xmlDate)
+            self.connection.execute("UPDATE blobs SET last_modified = xmlDate(last_modified)")
+
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+    def unchanged(self, container: str, first_page: bytes) -> bool:
+        """
+            Tells if a single-page container answers exactly as in its last complete listing.
+
+            Args:
+                container (str): The container URL.
+                first_page (bytes): The body of the container probe.
+
+            Returns:
+                bool: True if the container can be skipped.
+        """
+
+        row = self.connection.execute("SELECT complete, digest FROM listings WHERE container = ?", (container,)).fetchone()
+
+        if row is not None and row[0] and row[1] == hashlib.sha256(first_page).hexdigest():
+            self.unchanged_containers += 1
+            return True
+
+        return False
+
+
+    def start(self, container: str, resumed: bool = False) -> int:
+        """
+            Starts a scan of the container.
+
+            Args:
+                container (str): The container URL.
+                resumed (bool): The listing continues from a marker of an interrupted run: its scan goes on.
+
+            Returns:
+                int: The scan number, to be given to diff and finish.
+        """
+
+        row = self.connection.execute("SELECT scan, complete FROM listings WHERE container = ?", (container,)).fetchone()
+
+        if row is not None and resumed and not row[1]:
+            return row[0]
+
+        scan = row[0] + 1 if row is not None else 1
+
+        self.connection.execute("INSERT OR REPLACE INTO listings (container, scan, complete, digest) VALUES (?, ?, 0, NULL)", (container, scan))
+        self.connection.commit()
+
+        return scan
+
+
+    def diff(self, container: str, scan: int, blobs: list[BlobRecord]) -> list[tuple[str, BlobRecord]]:
+        """
+            Compares a listing page with the inventory and saves it.
+
+            Args:
+                container (str): The container URL.
+                scan (int): The scan number (see start).
+                blobs (list[BlobRecord]): The blobs of the page, as yielded by getBlobs or getBlobsPartitioned.
+
+            Returns:
+                list[tuple[str, BlobRecord]]: The blobs added or modified since the last scan, with their change.
+        """
+
+        if len(blobs) == 0:
+            return []
+
+        # Only the names of the page are looked up: the pages of a listing by prefixes (see blobs.getBlobsPartitioned)
+        # are not ranges of the container, a delimiter page can hold a blob at each end of it
+        names = [blob.name for blob in blobs]
+        known = {}
+
+        for start in range(0, len(names), LOOKUP_CHUNK):
+            chunk = names[start:start + LOOKUP_CHUNK]
+
+            for name, etag, last_modified in self.connection.execute(
+                f"SELECT name, etag, last_modified FROM blobs WHERE container = ? AND name IN ({', '.join('?' * len(chunk))})", (container, *chunk)
+            ):
+                known[name] = (etag, last_modified)
+
+        changes = []
+
+        for blob in blobs:
+            previous = known.get(blob.name)
+
+            if previous is None:
+                changes.append((CHANGE_ADDED, blob))
+
+            elif previous != (blob.etag, blob.last_modified):
+                changes.append((CHANGE_MODIFIED, blob))
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO blobs (container, name, etag, last_modified, scan) VALUES (?, ?, ?, ?, ?)",
+            ((container, blob.name, blob.etag, blob.last_modified, scan) for blob in blobs),
+        )
+        self.connection.commit()
+
+        for change, _ in changes:
+            self.counts[change] += 1
+
+        return changes
+
+
+    def finish(self, container: str, scan: int, digest_of: Optional[bytes] = None) -> list[tuple[str, BlobRecord]]:
+        """
+            Ends a complete scan: the blobs it didn't see are removed from the inventory.
+
+            Args:
+                container (str): The container URL.
+                scan (int): The scan number (see start).
+                digest_of (bytes, optional): The probe body, when the whole listing fit in it, to skip the container next time (see unchanged).
+
+            Returns:
+                list[tuple[str, BlobRecord]]: The blobs removed since the last scan, with their change.
+        """
+
+        removed = [
+            (CHANGE_REMOVED, BlobRecord(name, last_modified=last_modified, etag=etag))
+            for name, etag, last_modified in self.connection.execute(
+                "SELECT name, etag, last_modified FROM blobs WHERE container = ? AND scan != ?", (container, scan)
+            )
+        ]
+
+        self.connection.execute("DELETE FROM blobs WHERE container = ? AND scan != ?", (container, scan))
+
+        digest = hashlib.sha256(digest_of).hexdigest() if digest_of is not None else None
+        self.connection.execute("UPDATE listings SET complete = 1, digest = ? WHERE container = ?", (digest, container))
+        self.connection.commit()
+
+        self.counts[CHANGE_REMOVED] += len(removed)
+
+        return removed
+
+
+    def close(self) -> dict:
+        """
+            Closes the database.
+
+            Returns:
+                dict: The blobs added, modified and removed, and the containers unchanged.
+        """
+
+        self.connection.commit()
+        self.connection.close()
+
+        return {"added": self.counts[CHANGE_ADDED], "modified": self.counts[CHANGE_MODIFIED], "removed": self.counts[CHANGE_REMOVED], "unchanged_containers": self.unchanged_containers}
@@ -0,0 +1,167 @@
+from pathlib import Path
+from typing import Optional
+import json
+
+'''
+    Info
+
+    The journal is an append-only JSONL file where the pipeline records the work that is done, so an interrupted
+    run (Ctrl-C, OOM, unhandled exception) can continue with --resume instead of starting from the first company.
+
+    Records:
+        {"event": "account", "company": ..., "storage_account": ...}                  A storage account was found
+        {"event": "discovered", "company": ...}                                       Every storage account candidate of the company was resolved
+        {"event": "container", "company": ..., "storage_account": ..., "container": ...} An exposed container was found
+        {"event": "probed", "company": ..., "storage_account": ...}                   Every container candidate of the storage account was probed
+        {"event": "page", "company": ..., "container": ..., "marker": ...}            A listing page was written, the listing continues from marker
+        {"event": "listed", "company": ..., "container": ...}                         The listing of the container is complete
+
+    Every record is flushed as soon as it is written, so it survives the process being killed.
+    With --workers, every worker process appends to the same journal; records are small single-line writes.
+'''
+
+
+
+class Journal:
+    """
+        Checkpoint journal of a scan.
+
+        Args:
+            file_path (str): The path to the journal file.
+            resume (bool): Load the records of the previous run and keep appending to them. Otherwise a new journal is started.
+    """
+
+    def __init__(self, file_path: str, resume: bool = False):
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.discovered = set()
+        self.accounts = {}
+        self.probed = set()
+        self.containers = {}
+        self.markers = {}
+        self.listed = set()
+
+        truncated = False
+
+        if resume and Path(file_path).exists():
+            truncated = self.load(file_path)
+
+        self.file = open(file_path, "a" if resume else "w")
+
+        # Do not glue the next record to a truncated line
+        if truncated:
+            self.file.write("\n")
+
+
+    def load(self, file_path: str) -> bool:
+        """
+            Rebuilds the state from the records of a previous run.
+                A truncated last line (the process died while writing it) is ignored.
+
+            Args:
+                file_path (str): The path to the journal file.
+
+            Returns:
+                bool: True if the last line is truncated.
+        """
+
+        line = ""
+
+        with open(file_path, "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+
+                except json.JSONDecodeError:
+                    continue
+
+                self.apply(record)
+
+        return line != "" and not line.endswith("\n")
+
+
+    def apply(self, record: dict):
+        """
+            Updates the state with a record.
+
+            Args:
+                record (dict): A journal record.
+        """
+
+        event = record["event"]
+
+        if event == "account":
+            self.accounts.setdefault(record["company"], []).append(record["storage_account"])
+
+        elif event == "discovered":
+            self.discovered.add(record["company"])
+
+        elif event == "container":
+            self.containers.setdefault((record["company"], record["storage_account"]), []).append(record["container"])
+
+        elif event == "probed":
+            self.probed.add((record["company"], record["storage_account"]))
+
+        elif event == "page":
+            self.markers[(record["company"], record["container"])] = record["marker"]
+
+        elif event == "listed":
+            self.listed.add((record["company"], record["container"]))
+            self.markers.pop((record["company"], record["container"]), None)
+
+
+    def record(self, event: str, **fields: str):
+        """
+            Appends a record to the journal and applies it to the state.
+
+            Args:
+                event (str): The record type.
+                **fields (str): The record fields.
+        """
+
+        record = {"event": event, **fields}
+        self.apply(record)
+
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+
+    def foundAccounts(self, company: str) -> list[str]:
+        """
+            Returns the storage accounts recorded for a company.
+        """
+
+        return self.accounts.get(company, [])
+
+
+    def foundContainers(self, company: str, storage_account: str) -> list[str]:
+        """
+            Returns the exposed containers recorded for a storage account.
+        """
+
+        return self.containers.get((company, storage_account), [])
+
+
+    def listingMarker(self, company: str, container: str) -> Optional[str]:
+        """
+            Returns the continuation marker of a partial listing, or None if the listing hasn't started.
+        """
+
+        return self.markers.get((company, container))
+
+
+    def summary(self) -> str:
+        """
+            Returns a one-line description of the work recorded.
+        """
+
+        return f"{len(self.discovered)} companies discovered, {len(self.probed)} storage accounts probed, {len(self.listed)} containers listed"
+
+
+    def close(self):
+        """
+            Closes the journal file.
+        """
+
+        self.file.close()
+
@@ -0,0 +1,118 @@
+from collections import deque
+import asyncio
+import time
+
+'''
+    Info
+
+    AIMD (Additive Increase, Multiplicative Decrease) concurrency control, the same idea TCP uses for its window:
+        - Every request that goes well adds 1/limit to the limit, so the limit grows by about one per round of requests.
+        - A throttling signal (429, 503, connection reset, ...) multiplies the limit by decrease_factor.
+          Only one decrease happens per cooldown, so a burst of errors from the same congestion counts once.
+
+    The limit stays between minimum and maximum.
+'''
+
+
+
+class AdaptiveLimiter:
+    """
+        Limits the number of requests in flight to a value that adapts to the throttling signals of the endpoint.
+
+        Args:
+            initial (int): The starting limit.
+            minimum (int): The lowest limit.
+            maximum (int): The highest limit.
+            decrease_factor (float): The limit is multiplied by this value when the endpoint throttles.
+            cooldown (float): Minimum seconds between two decreases.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.waiters = deque()
+        self.last_decrease = 0.0
+
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+    async def acquire(self):
+        """
+            Waits until there is room for one more request under the current limit.
+        """
+
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+
+            try:
+                await waiter
+
+            except asyncio.CancelledError:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+                # Woken up, then cancelled before it took the slot (e.g. the losing attempt of a hedged probe): the next waiter gets it
+                elif waiter.done() and not waiter.cancelled():
+                    self.wakeUp()
+
+                raise
+
+        self.in_flight += 1
+
+
+    def release(self):
+        """
+            Frees the slot of a finished request.
+        """
+
+        self.in_flight -= 1
+        self.wakeUp()
+
+
+    def success(self):
+        """
+            Additive increase: the request went well.
+        """
+
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.wakeUp()
+
+
+    def throttled(self):
+        """
+            Multiplicative decrease: the endpoint is throttling or dropping connections.
+        """
+
+        now = time.monotonic()
+
+        if now - self.last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self.last_decrease = now
+
+
+    def wakeUp(self):
+        """
+            Wakes up as many waiting requests as there are free slots.
+        """
+
+        free = int(self.limit) - self.in_flight
+
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
@@ -0,0 +1,415 @@
+from config import INFO
+
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+import asyncio
+import cProfile
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import time
+import tracemalloc
+
+'''
+    Info
+
+    Instrumentation of the scanning stages. Every process has a single registry, METRICS, that the stages report to:
+
+        - dns:     one DNS lookup of a storage account, retries included (cache hits are counted apart, they don't touch the network).
+        - http:    one container probe request, retries included as separate requests.
+        - listing: one blob listing page, from the request to the last blob parsed.
+        - write:   one listing page written and flushed to the CSV file.
+
+    For each stage it keeps a latency histogram, the requests in flight (and the peak), the errors by type and the
+    bytes received (http, listing) or written (write). Gauges hold values that go up and down, like the adaptive limit of the probes.
+
+    The registry is written periodically to METRICS_FILE: Prometheus text format when the file ends in .prom, JSON otherwise.
+    Worker processes (--workers) write their own file, with their pid before the extension.
+
+    --profile records the run with cProfile and tracemalloc (see profiling).
+'''
+
+# Upper bounds of the histogram buckets, in seconds: from 0.1 ms growing 25% each, up to about 30 minutes.
+# Fine enough for the p50/p99 estimates to stay within a few percent of the real value
+BUCKET_BOUNDS = [0.0001 * 1.25 ** index for index in range(76)]
+
+# Only every EXPORT_EVERY bound goes to the Prometheus text, so each stage exports about twenty buckets
+EXPORT_EVERY = 4
+
+
+
+class Histogram:
+    """
+        Latency histogram with fixed, exponentially growing buckets.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+    def observe(self, value: float):
+        """
+            Adds a measure, in seconds.
+        """
+
+        self.buckets[bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+    def quantile(self, fraction: float) -> float:
+        """
+            Estimates the value below which the given fraction of the measures fall, interpolating inside its bucket.
+
+            Args:
+                fraction (float): Between 0 and 1, e.g. 0.99 for the p99.
+
+            Returns:
+                float: The estimate, in seconds. 0 when there are no measures.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+
+        for index, count in enumerate(self.buckets):
+            if count > 0 and seen + count >= rank:
+                lower = BUCKET_BOUNDS[index - 1] if index > 0 else 0.0
+                upper = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+
+            seen += count
+
+        return self.max
+
+
+
+class Metrics:
+    """
+        Registry of the measures of the scanning stages (see the top of the module).
+    """
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        """
+            Forgets every measure.
+        """
+
+        self.started_at = time.time()
+        self.latency = {}
+        self.in_flight = {}
+        self.peak_in_flight = {}
+        self.errors = {}
+        self.bytes = {}
+        self.counters = {}
+        self.gauges = {}
+
+
+    @asynccontextmanager
+    async def track(self, stage: str):
+        """
+            Measures the block as one operation of the stage: its latency, the operations in flight, and its exception (if any) as an error.
+
+            Args:
+                stage (str): The stage name.
+        """
+
+        start = self.begin(stage)
+
+        try:
+            yield
+
+        except BaseException as e:
+            # A cancelled task is not an error of the stage
+            if not isinstance(e, asyncio.CancelledError):
+                self.error(stage, type(e).__name__)
+            raise
+
+        finally:
+            self.end(stage, start)
+
+
+    def begin(self, stage: str) -> float:
+        """
+            Starts an operation of the stage, for the operations that don't fit in a block (see track).
+
+            Returns:
+                float: The start time, to be given to end.
+        """
+
+        self.in_flight[stage] = self.in_flight.get(stage, 0) + 1
+        self.peak_in_flight[stage] = max(self.peak_in_flight.get(stage, 0), self.in_flight[stage])
+
+        return time.perf_counter()
+
+
+    def end(self, stage: str, start: float, observe: bool = True):
+        """
+            Ends an operation of the stage started with begin, and adds its latency to the histogram.
+
+            Args:
+                stage (str): The stage name.
+                start (float): The value returned by begin.
+                observe (bool): False when the operation turned out to be nothing to measure (e.g. the end of a listing).
+        """
+
+        if observe:
+            self.observe(stage, time.perf_counter() - start)
+
+        self.in_flight[stage] -= 1
+
+
+    def observe(self, stage: str, seconds: float):
+        """
+            Adds a latency measure to the histogram of the stage.
+        """
+
+        if stage not in self.latency:
+            self.latency[stage] = Histogram()
+
+        self.latency[stage].observe(seconds)
+
+
+    def error(self, stage: str, kind: str):
+        """
+            Counts an error of the stage, e.g. ("http", "HTTP 503") or ("dns", "ARES_ETIMEOUT").
+        """
+
+        key = (stage, kind)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+    def addBytes(self, stage: str, count: int):
+        """
+            Counts bytes received (http, listing) or written (write) by the stage.
+        """
+
+        self.bytes[stage] = self.bytes.get(stage, 0) + count
+
+
+    def increment(self, name: str, count: int = 1):
+        """
+            Increments a counter, e.g. the DNS cache hits or the blobs written.
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + count
+
+
+    def gauge(self, name: str, value: float):
+        """
+            Sets a gauge, e.g. the adaptive limit of the probes or the length of a queue.
+        """
+
+        self.gauges[name] = value
+
+
+    def snapshot(self) -> dict:
+        """
+            Returns every measure as a dictionary ready to be dumped to JSON. Latencies are in milliseconds.
+        """
+
+        stages = sorted(set(self.latency) | set(self.in_flight) | set(self.bytes) | {stage for stage, _ in self.errors})
+
+        def stageSnapshot(stage: str) -> dict:
+            histogram = self.latency.get(stage, Histogram())
+
+            return {
+                "count": histogram.count,
+                "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                "p50_ms": round(histogram.quantile(0.50) * 1000, 3),
+                "p90_ms": round(histogram.quantile(0.90) * 1000, 3),
+                "p99_ms": round(histogram.quantile(0.99) * 1000, 3),
+                "max_ms": round(histogram.max * 1000, 3),
+                "in_flight": self.in_flight.get(stage, 0),
+                "peak_in_flight": self.peak_in_flight.get(stage, 0),
+                "bytes": self.bytes.get(stage, 0),
+                "errors": {kind: count for (error_stage, kind), count in sorted(self.errors.items()) if error_stage == stage},
+            }
+
+        return {
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "stages": {stage: stageSnapshot(stage) for stage in stages},
+            "counters": dict(sorted(self.counters.items())),
+            "gauges": dict(sorted(self.gauges.items())),
+        }
+
+
+    def prometheus(self) -> str:
+        """
+            Returns every measure in the Prometheus text exposition format. Latencies are in seconds.
+        """
+
+        lines = [
+            "# TYPE forgottenclouds_latency_seconds histogram",
+        ]
+
+        for stage, histogram in sorted(self.latency.items()):
+            cumulative = 0
+
+            for index, bound in enumerate(BUCKET_BOUNDS):
+                cumulative += histogram.buckets[index]
+
+                if index % EXPORT_EVERY == EXPORT_EVERY - 1:
+                    lines.append(f'forgottenclouds_latency_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+
+            lines.append(f'forgottenclouds_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'forgottenclouds_latency_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'forgottenclouds_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        lines.append("# TYPE forgottenclouds_in_flight gauge")
+        lines.extend(f'forgottenclouds_in_flight{{stage="{stage}"}} {value}' for stage, value in sorted(self.in_flight.items()))
+
+        lines.append("# TYPE forgottenclouds_errors_total counter")
+        lines.extend(f'forgottenclouds_errors_total{{stage="{stage}",type="{kind}"}} {count}' for (stage, kind), count in sorted(self.errors.items()))
+
+        lines.append("# TYPE forgottenclouds_bytes_total counter")
+        lines.extend(f'forgottenclouds_bytes_total{{stage="{stage}"}} {count}' for stage, count in sorted(self.bytes.items()))
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE forgottenclouds_{name}_total counter")
+            lines.append(f"forgottenclouds_{name}_total {value}")
+
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"# TYPE forgottenclouds_{name} gauge")
+            lines.append(f"forgottenclouds_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def write(self, file_path: str):
+        """
+            Writes a snapshot to the file, replacing it atomically: Prometheus text when it ends in .prom, JSON otherwise.
+
+            Args:
+                file_path (str): The path of the snapshot.
+        """
+
+        path = Path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        content = self.prometheus() if path.suffix == ".prom" else json.dumps(self.snapshot(), indent=4)
+
+        # Readers (a Prometheus node exporter, a watch command, ...) never see a half written file
+        temporary = path.with_name(f".{path.name}.tmp")
+        temporary.write_text(content)
+        os.replace(temporary, path)
+
+
+    def summary(self) -> str:
+        """
+            Returns a one-line summary per stage, to be printed at the end of a run.
+        """
+
+        lines = []
+
+        for stage, values in self.snapshot()["stages"].items():
+            errors = sum(values["errors"].values())
+            lines.append(f"{stage}: {values['count']} ops, p50 {values['p50_ms']} ms, p99 {values['p99_ms']} ms, peak in flight {values['peak_in_flight']}, {values['bytes']} bytes, {errors} errors")
+
+        return "\n".join(lines)
+
+
+
+# The registry of the current process
+METRICS = Metrics()
+
+
+
+def metricsFilePath(file_path: str) -> str:
+    """
+        Returns the snapshot path of the current process: the given one in the main process,
+            and the same one with the pid before the extension in a worker process.
+
+        Args:
+            file_path (str): The snapshot path from config.py.
+
+        Returns:
+            str: e.g. "Cache/metrics.json" or "Cache/metrics.12345.json".
+    """
+
+    if multiprocessing.parent_process() is None:
+        return file_path
+
+    path = Path(file_path)
+
+    return str(path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}"))
+
+
+
+async def reportPeriodically(file_path: str, interval: float, gauges: Optional[Callable[[], dict]] = None):
+    """
+        Writes a snapshot of METRICS every interval seconds, until it is cancelled.
+
+        Args:
+            file_path (str): The path of the snapshot (see Metrics.write).
+            interval (float): Seconds between two snapshots.
+            gauges (Callable[[], dict], optional): Called before every snapshot, its values are set as gauges (e.g. queue lengths).
+    """
+
+    while True:
+        await asyncio.sleep(interval)
+
+        for name, value in (gauges() if gauges is not None else {}).items():
+            METRICS.gauge(name, value)
+
+        METRICS.write(file_path)
+
+
+
+@contextmanager
+def profiling(folder: str, top: int = 30) -> Iterator[None]:
+    """
+        Records the block with cProfile and tracemalloc and writes the results to the folder:
+            - cprofile.prof: the raw cProfile stats (snakeviz, pstats, ...).
+            - cprofile.txt:  the top functions by cumulative time.
+            - tracemalloc.txt: the peak memory and the top allocation sites still alive at the end.
+
+        Only the current process is recorded, not the --workers processes.
+
+        Args:
+            folder (str): Where the results are written. It is created if it doesn't exist.
+            top (int): The number of functions and allocation sites in the text reports.
+    """
+
+    path = Path(folder)
+    path.mkdir(parents=True, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+
+    try:
+        yield
+
+    finally:
+        profiler.disable()
+        allocations = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(path / "cprofile.prof")
+
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        (path / "cprofile.txt").write_text(report.getvalue())
+
+        lines = [f"Peak traced memory: {peak / (1024 * 1024):.1f} MB", ""]
+        lines.extend(str(statistic) for statistic in allocations.statistics("lineno")[:top])
+        (path / "tracemalloc.txt").write_text("\n".join(lines) + "\n")
+
+        print(f"[{INFO}] Profile written to {path}: cprofile.prof, cprofile.txt, tracemalloc.txt")
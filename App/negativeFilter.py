@@ -0,0 +1,302 @@
+from config import NEGATIVE_FILTER_MB, NEGATIVE_FILTER_GENERATIONS, NEGATIVE_FILTER_DAYS, NEGATIVE_FILTER_FALSE_POSITIVES
+from metrics import METRICS
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''
+    Info
+
+    Container probes that answered 404 are remembered between runs in Bloom filters, so the same
+    <mystorageaccount>/<mycontainer> pairs are not asked again on every run (see containers.containerURLs).
+
+    The pairs go to generations, one file each in the negative filter folder:
+
+        Cache/Negatives/<YYYYmmddHHMMSS>.bloom      16 bytes of header (magic, pairs added) and the bits
+
+    A generation takes the new pairs for NEGATIVE_FILTER_DAYS days, or until it holds as many pairs as its
+    NEGATIVE_FILTER_MB allow at NEGATIVE_FILTER_FALSE_POSITIVES. Then a new one starts and the oldest beyond
+    NEGATIVE_FILTER_GENERATIONS is deleted: its pairs are probed again, and the ones still missing go to the new generation.
+    The memory is fixed (generations x size, memory-mapped), whatever the number of pairs:
+    32 MB generations hold about 18 million pairs each at 0.1% false positives.
+
+    A false positive skips a container that was never probed. Exposed containers are never added.
+
+    With --workers, the processes map the same files. A generation is written under a temporary name and linked to its
+    own once complete, never over an existing file, so no process truncates a file another one maps. The rotation runs
+    under a lock on the folder (Cache/Negatives/.lock, where fcntl exists) and first picks up the generations the other
+    processes started or deleted. Two processes setting bits of the same byte at once can still lose one: its pair is probed again.
+'''
+
+MAGIC = b"FCBLOOM1"
+HEADER = struct.Struct("<8sQ")
+
+# Pairs added between two checks of the capacity of the current generation
+CAPACITY_CHECK_EVERY = 10000
+
+
+
+class Generation:
+    """
+        A Bloom filter file, memory-mapped.
+
+        Args:
+            path (Path): The file. It is created with size_bytes of bits if it doesn't exist (another process may create it first).
+            size_bytes (int): The size of the bits of a new file.
+    """
+
+    def __init__(self, path: Path, size_bytes: int = 0):
+        if not path.exists():
+            temporary = path.with_suffix(f".{os.getpid()}.tmp")
+
+            with open(temporary, "wb") as file:
+                file.write(HEADER.pack(MAGIC, 0))
+                file.truncate(HEADER.size + size_bytes)
+
+            # Complete before it has its name, and never over the file of another process
+            try:
+                os.link(temporary, path)
+
+            except FileExistsError:
+                pass
+
+            finally:
+                temporary.unlink()
+
+        self.path = path
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+        magic, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a negative filter generation")
+
+        self.bits = (len(self.map) - HEADER.size) * 8
+        self.created = datetime.strptime(path.stem, "%Y%m%d%H%M%S")
+
+
+    @property
+    def count(self) -> int:
+        """
+            Returns the number of pairs added to the generation.
+        """
+
+        return HEADER.unpack_from(self.map, 0)[1]
+
+
+    def positions(self, digest: bytes, hashes: int) -> list[int]:
+        """
+            Returns the bits of a key (double hashing of its 128-bit digest).
+        """
+
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        return [(first + index * second) % self.bits for index in range(hashes)]
+
+
+    def contains(self, digest: bytes, hashes: int) -> bool:
+        """
+            Tells if every bit of a key is set.
+        """
+
+        data = self.map
+
+        return all(data[HEADER.size + (bit >> 3)] & (1 << (bit & 7)) for bit in self.positions(digest, hashes))
+
+
+    def add(self, digest: bytes, hashes: int):
+        """
+            Sets the bits of a key.
+        """
+
+        data = self.map
+
+        for bit in self.positions(digest, hashes):
+            data[HEADER.size + (bit >> 3)] |= 1 << (bit & 7)
+
+        HEADER.pack_into(data, 0, MAGIC, self.count + 1)
+
+
+    def close(self):
+        """
+            Writes the bits to disk and closes the file.
+        """
+
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+
+class NegativeFilter:
+    """
+        Container probes that answered 404 in recent runs (see the top of the module).
+
+        Args:
+            folder (str): The folder of the generation files. It is created if it doesn't exist.
+            size_mb (int): Size of the bits of each generation, in megabytes.
+            generations (int): Generations kept.
+            days (int): Days a generation takes new pairs.
+            false_positives (float): Target false positive rate of a generation, it decides its capacity and the number of hashes.
+            reprobe (bool): Skip nothing: every container is probed again, and the 404 answers still fill the filter.
+    """
+
+    def __init__(self, folder: str, size_mb: int = NEGATIVE_FILTER_MB, generations: int = NEGATIVE_FILTER_GENERATIONS, days: int = NEGATIVE_FILTER_DAYS, false_positives: float = NEGATIVE_FILTER_FALSE_POSITIVES, reprobe: bool = False):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        self.size_bytes = size_mb * 1024 * 1024
+        self.generations = generations
+        self.lifetime = timedelta(days=days)
+        self.reprobe = reprobe
+
+        # Optimal number of hashes and capacity for the target rate: k = log2(1/p), n = m * ln(2)^2 / ln(1/p)
+        self.hashes = max(1, round(-math.log2(false_positives)))
+        self.capacity = int(self.size_bytes * 8 * math.log(2) ** 2 / -math.log(false_positives))
+
+        self.skipped = 0
+        self.added = 0
+
+        self.live = []
+        self.rotate()
+
+
+    @contextmanager
+    def locked(self):
+        """
+            Holds the lock of the folder, shared by the processes of a run (nothing to hold without fcntl).
+        """
+
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.folder / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def refresh(self):
+        """
+            Maps the generations started by other processes and closes the ones they deleted.
+        """
+
+        paths = sorted(self.folder.glob("*.bloom"))
+        known = {generation.path: generation for generation in self.live}
+
+        for generation in self.live:
+            if generation.path not in paths:
+                generation.close()
+
+        self.live = [known[path] if path in known else Generation(path) for path in paths]
+
+
+    def rotate(self):
+        """
+            Starts a new generation if the current one is too old or full, and deletes the generations beyond the ones kept.
+                Only one process at a time rotates, from the generations on disk.
+        """
+
+        with self.locked():
+            self.refresh()
+
+            current = self.live[-1] if self.live else None
+
+            if current is not None and datetime.now() - current.created < self.lifetime and current.count < self.capacity:
+                return
+
+            path = self.folder / f"{datetime.now():%Y%m%d%H%M%S}.bloom"
+
+            # A generation filled within a second keeps taking pairs until the next one
+            if current is None or current.path != path:
+                self.live.append(Generation(path, self.size_bytes))
+
+            while len(self.live) > self.generations:
+                oldest = self.live.pop(0)
+                oldest.close()
+                oldest.path.unlink(missing_ok=True)
+
+
+    def digest(self, key: str) -> bytes:
+        """
+            Returns the 128-bit hash of a key, the same for every generation.
+        """
+
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+    def __contains__(self, key: str) -> bool:
+        """
+            Tells if the pair answered 404 in a live generation, i.e. its probe can be skipped.
+
+            Args:
+                key (str): "<mystorageaccount>/<mycontainer>"
+        """
+
+        if self.reprobe:
+            return False
+
+        digest = self.digest(key)
+
+        if any(generation.contains(digest, self.hashes) for generation in self.live):
+            self.skipped += 1
+            METRICS.increment("negatives_skipped")
+            return True
+
+        return False
+
+
+    def add(self, key: str):
+        """
+            Records a pair that answered 404 in the current generation.
+
+            Args:
+                key (str): "<mystorageaccount>/<mycontainer>"
+        """
+
+        digest = self.digest(key)
+
+        # Probed again (--reprobe): the pair would only be counted twice toward the capacity
+        if self.live[-1].contains(digest, self.hashes):
+            return
+
+        self.live[-1].add(digest, self.hashes)
+
+        self.added += 1
+        METRICS.increment("negatives_added")
+
+        if self.added % CAPACITY_CHECK_EVERY == 0:
+            self.rotate()
+
+
+    def close(self) -> dict:
+        """
+            Writes the generations to disk and closes them.
+
+            Returns:
+                dict: The probes skipped and the 404 answers added by the run, the pairs and the generations kept.
+        """
+
+        pairs = sum(generation.count for generation in self.live)
+
+        for generation in self.live:
+            generation.close()
+
+        return {"skipped": self.skipped, "added": self.added, "pairs": pairs, "generations": len(self.live)}
@@ -0,0 +1,384 @@
+from metrics import METRICS
+
+from pathlib import Path
+from typing import Any, Awaitable, Iterable, Iterator, Optional
+import asyncio
+import heapq
+import sqlite3
+import time
+
+'''
+    Info
+
+    Candidate ordering and probe budgets.
+
+    Every storage account and container candidate is built from a keyword of the wordlist and a pattern
+    (ACCOUNT_PATTERNS in storageAccounts.py, CONTAINER_PATTERNS below). HitRates keeps, between runs,
+    how many candidates of every (keyword, pattern) were tried and how many of them existed, and hands out the
+    candidates of the next run by expected yield:
+
+        yield(keyword, pattern) = rate(keyword) * rate(pattern) / rate(kind)
+
+    Every rate is smoothed toward the rate of its kind (storage accounts or containers) with PRIOR_WEIGHT tries,
+    so a keyword without history keeps its place in the wordlist, and a single hit doesn't send a keyword to the top.
+    Without any history, the candidates come in wordlist order. The candidates are merged lazily from one sorted
+    sequence per pattern: the keyword x pattern space is never built in memory.
+
+    A Budget caps the DNS lookups or container probes of each company. With the likely candidates first,
+    a small budget finds most of what the whole candidate space would. A Deadline caps their time instead,
+    so a company full of slow endpoints doesn't hold up the end of the run.
+
+    The mean latencies of the last run are kept too, for the estimated duration printed before a run (see az.estimateRun).
+'''
+
+# Kinds of candidates
+ACCOUNT = "account"
+CONTAINER = "container"
+
+# How the container names are built from the company name and a keyword, in their default order (see containers.permutation).
+# Here rather than in containers.py, which loads aiohttp: the estimate of a run needs them in every mode
+CONTAINER_PATTERNS = {
+    "keyword": "{keyword}", # Keyword as container name
+    "prefix": "{keyword}{company}", # <keyword><company_name>
+    "prefix-dash": "{keyword}-{company}", # <keyword>-<company_name>
+    "suffix": "{company}{keyword}", # <company_name><keyword>
+    "suffix-dash": "{company}-{keyword}", # <company_name>-<keyword>
+}
+
+# Tries of the rate of the kind every keyword and pattern rate starts from
+PRIOR_WEIGHT = 20
+
+# Latency of a single DNS lookup and container probe when no previous run measured it, in seconds
+DEFAULT_LATENCY = {"dns": 0.05, "http": 0.2}
+
+
+
+def affixes(template: str, company: str) -> tuple[str, str]:
+    """
+        Splits a pattern around its keyword, for a company.
+
+        Args:
+            template (str): The pattern, e.g. "{keyword}-{company}".
+            company (str): The company name.
+
+        Returns:
+            tuple[str, str]: What goes before and after the keyword, e.g. ("", "-<company>").
+    """
+
+    before, after = template.format(company=company, keyword="\0").split("\0")
+
+    return (before, after)
+
+
+
+class HitRates:
+    """
+        Tries and hits of every (keyword, pattern), kept in a SQLite database between runs.
+
+        Args:
+            file_path (str): The path to the SQLite database. It is created if it doesn't exist.
+    """
+
+    def __init__(self, file_path: str):
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(file_path, timeout=30)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS hits (kind TEXT NOT NULL, pattern TEXT NOT NULL, keyword TEXT NOT NULL, tries INTEGER NOT NULL, hits INTEGER NOT NULL, PRIMARY KEY (kind, pattern, keyword)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS latency (stage TEXT PRIMARY KEY, seconds REAL NOT NULL)")
+        self.connection.commit()
+
+        # History of previous runs, as [tries, hits]
+        self.kinds = {}
+        self.patterns = {}
+        self.keywords = {}
+
+        for kind, pattern, keyword, tries, hits in self.connection.execute("SELECT kind, pattern, keyword, tries, hits FROM hits"):
+            for counts, key in ((self.kinds, kind), (self.patterns, (kind, pattern)), (self.keywords, (kind, keyword))):
+                total = counts.setdefault(key, [0, 0])
+                total[0] += tries
+                total[1] += hits
+
+        self.latency = {**DEFAULT_LATENCY, **dict(self.connection.execute("SELECT stage, seconds FROM latency"))}
+        self.measured = {stage for (stage,) in self.connection.execute("SELECT stage FROM latency")}
+
+        # Counts of this run, saved on close
+        self.pending = {}
+
+        # Keywords of the wordlist, to tell which pattern produced a hit
+        self.wordlists = {}
+
+
+    def rate(self, kind: str) -> Optional[float]:
+        """
+            Returns the fraction of the candidates of a kind that existed in previous runs, or None without history.
+        """
+
+        tries, hits = self.kinds.get(kind, (0, 0))
+
+        return hits / tries if tries > 0 else None
+
+
+    def smoothed(self, counts: Optional[list[int]], base: float) -> float:
+        """
+            Returns a hit rate pulled toward base by PRIOR_WEIGHT tries.
+        """
+
+        tries, hits = counts if counts is not None else (0, 0)
+
+        return (hits + PRIOR_WEIGHT * base) / (tries + PRIOR_WEIGHT)
+
+
+    def rank(self, kind: str, keywords: list[str], patterns: list[str]) -> Iterator[tuple[str, str]]:
+        """
+            Yields every (keyword, pattern) by expected yield. Ties keep the wordlist order, keyword by keyword.
+
+            Args:
+                kind (str): ACCOUNT or CONTAINER.
+                keywords (list[str]): The wordlist.
+                patterns (list[str]): The pattern names, in their default order.
+
+            Yields:
+                tuple[str, str]: A keyword and a pattern.
+        """
+
+        if kind not in self.wordlists:
+            self.wordlists[kind] = set(keywords)
+
+        # The prior of the kind keeps the rates of unseen keywords and patterns above zero
+        tries, hits = self.kinds.get(kind, (0, 0))
+        base = (hits + 1) / (tries + 2)
+
+        ranked = sorted(
+            ((self.smoothed(self.keywords.get((kind, keyword)), base), index, keyword) for index, keyword in enumerate(keywords)),
+            key=lambda item: (-item[0], item[1]),
+        )
+
+        def sequence(pattern_index: int, pattern: str) -> Iterator[tuple[tuple[float, int, int], str, str]]:
+            weight = self.smoothed(self.patterns.get((kind, pattern)), base) / base
+
+            for keyword_rate, index, keyword in ranked:
+                yield ((-keyword_rate * weight, index, pattern_index), keyword, pattern)
+
+        for _, keyword, pattern in heapq.merge(*(sequence(index, pattern) for index, pattern in enumerate(patterns))):
+            yield (keyword, pattern)
+
+
+    def tried(self, kind: str, keyword: str, pattern: str):
+        """
+            Counts a candidate that was handed out to be probed.
+        """
+
+        counts = self.pending.setdefault((kind, pattern, keyword), [0, 0])
+        counts[0] += 1
+
+
+    def hit(self, kind: str, name: str, company: str, patterns: dict[str, str]):
+        """
+            Counts a candidate that exists for every (keyword, pattern) of the wordlist that builds it.
+
+            Args:
+                kind (str): ACCOUNT or CONTAINER.
+                name (str): The storage account or container name found.
+                company (str): The company name.
+                patterns (dict[str, str]): The patterns of the kind, by name.
+        """
+
+        wordlist = self.wordlists.get(kind, set())
+
+        for pattern, template in patterns.items():
+            # The candidates were built from the lowercase company name (see the permutations)
+            before, after = affixes(template, company.lower())
+
+            if len(name) > len(before) + len(after) and name.startswith(before) and name.endswith(after):
+                keyword = name[len(before):len(name) - len(after)]
+
+                if keyword in wordlist:
+                    counts = self.pending.setdefault((kind, pattern, keyword), [0, 0])
+                    counts[1] += 1
+
+
+    def close(self, save: bool = True) -> Optional[dict]:
+        """
+            Saves the counts and latencies of this run and closes the database.
+
+            Args:
+                save (bool): False to close without saving anything (e.g. after the estimate of a run).
+
+            Returns:
+                dict: The candidates tried and found of every kind, {"tries": {ACCOUNT: ..., CONTAINER: ...}, "hits": {...}}. None without saving.
+        """
+
+        if not save:
+            self.connection.close()
+            return None
+
+        self.connection.executemany(
+            "INSERT INTO hits (kind, pattern, keyword, tries, hits) VALUES (?, ?, ?, ?, ?) ON CONFLICT (kind, pattern, keyword) DO UPDATE SET tries = tries + excluded.tries, hits = hits + excluded.hits",
+            ((kind, pattern, keyword, tries, hits) for (kind, pattern, keyword), (tries, hits) in self.pending.items()),
+        )
+
+        # Only the stages this run measured replace the previous latencies
+        for stage in DEFAULT_LATENCY:
+            histogram = METRICS.latency.get(stage)
+
+            if histogram is not None and histogram.count > 0:
+                self.connection.execute("INSERT OR REPLACE INTO latency (stage, seconds) VALUES (?, ?)", (stage, histogram.sum / histogram.count))
+
+        self.connection.commit()
+        self.connection.close()
+
+        tries = {ACCOUNT: 0, CONTAINER: 0}
+        hits = {ACCOUNT: 0, CONTAINER: 0}
+        for (kind, _, _), counts in self.pending.items():
+            tries[kind] += counts[0]
+            hits[kind] += counts[1]
+
+        return {"tries": tries, "hits": hits}
+
+
+
+class Budget:
+    """
+        Caps the probes (DNS lookups or container probes) of each company.
+
+        Args:
+            limit (int, optional): Probes per company. None for no limit.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.spent = {}
+        self.reached = set()
+
+
+    def cap(self, company: str, items: Iterable) -> Iterator:
+        """
+            Yields the items while the company has budget left, one probe each.
+
+            Args:
+                company (str): The company name.
+                items (Iterable): The candidates to probe.
+
+            Yields:
+                Any: The items within the budget.
+        """
+
+        for item in items:
+            if self.limit is not None:
+                if self.spent.get(company, 0) >= self.limit:
+                    self.reached.add(company)
+                    return
+
+                self.spent[company] = self.spent.get(company, 0) + 1
+
+            yield item
+
+
+    def exhausted(self, company: str) -> bool:
+        """
+            Tells if candidates of the company were left out because of the budget.
+        """
+
+        return company in self.reached
+
+
+
+class Deadline:
+    """
+        Caps the time a stage (DNS discovery or container probing) spends on each company and on the whole run.
+            No candidate starts past it (see cap), and the lookups and probes in flight are cut off when it is reached (see within).
+            The candidates left out when it runs out are unknown: the company is not recorded as done, so --resume continues it.
+
+        Args:
+            company_seconds (float, optional): Seconds per company, from its first candidate. None for no limit.
+            stage_seconds (float, optional): Seconds for the whole stage, from the first candidate of any company. None for no limit.
+    """
+
+    def __init__(self, company_seconds: Optional[float] = None, stage_seconds: Optional[float] = None):
+        self.company_seconds = company_seconds
+        self.stage_seconds = stage_seconds
+        self.stage_started = None
+        self.started = {}
+        self.reached = set()
+
+
+    def cap(self, company: str, items: Iterable) -> Iterator:
+        """
+            Yields the items while the company and the stage have time left.
+
+            Args:
+                company (str): The company name.
+                items (Iterable): The candidates to probe.
+
+            Yields:
+                Any: The items within the deadline.
+        """
+
+        now = time.monotonic()
+
+        if self.stage_started is None:
+            self.stage_started = now
+
+        started = self.started.setdefault(company, now)
+
+        for item in items:
+            now = time.monotonic()
+
+            if (self.company_seconds is not None and now - started > self.company_seconds) or (self.stage_seconds is not None and now - self.stage_started > self.stage_seconds):
+                self.reached.add(company)
+                return
+
+            yield item
+
+
+    def remaining(self, company: str) -> Optional[float]:
+        """
+            Returns the seconds left to the company (and to the stage), None if neither has a limit.
+        """
+
+        now = time.monotonic()
+        left = []
+
+        if self.company_seconds is not None and company in self.started:
+            left.append(self.started[company] + self.company_seconds - now)
+
+        if self.stage_seconds is not None and self.stage_started is not None:
+            left.append(self.stage_started + self.stage_seconds - now)
+
+        return min(left) if left else None
+
+
+    async def within(self, company: str, awaitable: Awaitable, default: Any) -> Any:
+        """
+            Awaits a lookup or probe of the company until the deadline. Past it, the request is cancelled and the deadline reached.
+
+            Args:
+                company (str): The company name.
+                awaitable (Awaitable): The lookup or probe, e.g. containers.fetchContainer.
+                default (Any): The result of a request cut off, e.g. UNKNOWN.
+
+            Returns:
+                Any: The result of the request, or default.
+        """
+
+        left = self.remaining(company)
+
+        if left is None:
+            return await awaitable
+
+        try:
+            return await asyncio.wait_for(awaitable, max(left, 0))
+
+        except asyncio.TimeoutError:
+            self.reached.add(company)
+            METRICS.increment("deadline_cutoffs")
+
+            return default
+
+
+    def exceeded(self, company: str) -> bool:
+        """
+            Tells if candidates of the company were left out because of the deadline.
+        """
+
+        return company in self.reached
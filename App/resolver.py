@@ -0,0 +1,155 @@
+from config import DNS_NAMESERVERS, DNS_PORT, DNS_TIMEOUT, DNS_RETRIES, DNS_CONCURRENCY_PER_RESOLVER, DNS_LOOKUP_DEADLINE
+
+from metrics import METRICS
+
+from itertools import cycle
+from typing import Optional
+from pycares.errno import errorcode
+import asyncio
+import random
+import aiodns
+
+'''
+    Info
+
+    The pool keeps one aiodns resolver per nameserver in DNS_NAMESERVERS (or a single one using the system
+    configuration when the list is empty), and spreads the queries across them in turn.
+
+    Every query ends with one of four outcomes:
+        - FOUND: the name resolves.
+        - ABSENT: the nameserver says the name does not exist (NXDOMAIN, no data, bad name).
+        - FAILED: the question could not be answered (timeout, SERVFAIL, refused, ...), even after the retries.
+        - UNKNOWN: the lookup, retries included, ran past DNS_LOOKUP_DEADLINE.
+
+    Only the transient errors are retried, each time on the next nameserver. A FAILED or UNKNOWN lookup says nothing
+    about the name, so it must not be treated (or cached) as ABSENT. The container probes use UNKNOWN the same way
+    (see containers.fetchContainer).
+'''
+
+FOUND = "found"
+ABSENT = "absent"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+# Answers meaning that the name doesn't exist
+ABSENT_ERRORS = (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA, aiodns.error.ARES_EBADNAME)
+
+# Errors worth asking again
+TRANSIENT_ERRORS = (
+    aiodns.error.ARES_ETIMEOUT,
+    aiodns.error.ARES_ESERVFAIL,
+    aiodns.error.ARES_EREFUSED,
+    aiodns.error.ARES_ECONNREFUSED,
+    aiodns.error.ARES_EBADRESP,
+    aiodns.error.ARES_EOF,
+    aiodns.error.ARES_EFORMERR,
+)
+
+
+
+class ResolverPool:
+    """
+        Pool of DNS resolvers with per-query timeouts, retries of transient errors and a limit of in-flight queries per resolver.
+
+        Args:
+            nameservers (list[str]): The nameservers to use. An empty list uses the system configuration.
+            timeout (float): Seconds to wait for an answer to a single query.
+            retries (int): Extra attempts for a query that failed with a transient error.
+            concurrency (int): Maximum in-flight queries per resolver.
+            port (int): UDP/TCP port of the nameservers.
+            deadline (float, optional): Seconds a lookup may take, retries included. None for no deadline.
+    """
+
+    def __init__(self, nameservers: list[str] = DNS_NAMESERVERS, timeout: float = DNS_TIMEOUT, retries: int = DNS_RETRIES, concurrency: int = DNS_CONCURRENCY_PER_RESOLVER, port: int = DNS_PORT, deadline: Optional[float] = DNS_LOOKUP_DEADLINE):
+        self.retries = retries
+        self.deadline = deadline
+
+        # [None] means a single resolver with the system nameservers
+        self.resolvers = [
+            (
+                aiodns.DNSResolver(nameservers=[nameserver] if nameserver else None, timeout=timeout, tries=1, udp_port=port, tcp_port=port),
+                asyncio.Semaphore(concurrency),
+            )
+            for nameserver in (nameservers or [None])
+        ]
+        self.next_resolver = cycle(self.resolvers)
+
+        self.counts = {FOUND: 0, ABSENT: 0, FAILED: 0, UNKNOWN: 0}
+
+
+    async def resolve(self, fqdn: str) -> str:
+        """
+            Resolves the A record of the FQDN, within the deadline of the pool.
+
+            Args:
+                fqdn (str): The name to resolve.
+
+            Returns:
+                str: FOUND, ABSENT, FAILED or UNKNOWN.
+        """
+
+        try:
+            outcome = await asyncio.wait_for(self.attempts(fqdn), self.deadline)
+
+        except asyncio.TimeoutError:
+            outcome = UNKNOWN
+            METRICS.error("dns", "deadline")
+
+        self.counts[outcome] += 1
+        METRICS.increment(f"dns_{outcome}")
+
+        return outcome
+
+
+    async def attempts(self, fqdn: str) -> str:
+        """
+            Asks the nameservers in turn until one answers or the retries run out.
+
+            Returns:
+                str: FOUND, ABSENT or FAILED.
+        """
+
+        outcome = FAILED
+
+        for attempt in range(self.retries + 1):
+            resolver, semaphore = next(self.next_resolver)
+
+            try:
+                async with semaphore:
+                    await resolver.query(fqdn, 'A')
+
+                outcome = FOUND
+                break
+
+            except aiodns.error.DNSError as e:
+                code = e.args[0] if e.args else None
+
+                if code in ABSENT_ERRORS:
+                    outcome = ABSENT
+                    break
+
+                # NXDOMAIN is an answer, anything else is an error worth counting
+                METRICS.error("dns", errorcode.get(code, str(code)))
+
+                if code not in TRANSIENT_ERRORS:
+                    break
+
+            if attempt < self.retries:
+                # Small jittered pause, the next attempt goes to the next nameserver anyway
+                await asyncio.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+        return outcome
+
+
+    def close(self) -> dict:
+        """
+            Releases the resolvers.
+
+            Returns:
+                dict: The number of lookups of every outcome (FOUND, ABSENT, FAILED and UNKNOWN), printed by the command line (see az.printSummary).
+        """
+
+        for resolver, _ in self.resolvers:
+            resolver.cancel()
+
+        return dict(self.counts)
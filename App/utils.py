@@ -1,35 +1,144 @@
-from config import CREATION, ERROR, DELETION, OUTPUT_FOLDER
+from config import OUTPUT_FOLDER
+from metrics import METRICS
 
 from pathlib import Path
 from datetime import datetime
-import pandas as pd
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, NamedTuple, Optional, Union
+import asyncio
+import csv
+
+# Relevant columns written in the blobs CSV files
+BLOB_COLUMNS = [
+    'name',
+    'container',
+    'url',
+    'creation_time',
+    'last_modified',
+    'blob_type',
+    'etag',
+    'size',
+    'content_type',
+    'content_encoding',
+    'content_language',
+    'content_md5',
+    'status',
+    'state',
+]
+
+# Columns of the changes CSV files of --incremental scans (see inventory.py)
+CHANGE_COLUMNS = ['change'] + BLOB_COLUMNS
+
+# Month numbers of the dates of the List Blobs XML
+MONTHS = {month: f"{number:02d}" for number, month in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
+
+
+
+class BlobRecord(NamedTuple):
+    """
+        A blob of a listing, with its fields as they come in the List Blobs XML (see blobs.parseListing).
+            The container and URL are known from the listing, and the dates and blob type are formatted only when the blob is written (see blobRow).
+    """
+
+    name: str
+    creation_time: Optional[str] = None # "Mon, 01 Jan 2024 10:00:00 GMT"
+    last_modified: Optional[str] = None
+    blob_type: Optional[str] = None # "BlockBlob"
+    etag: Optional[str] = None
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    content_encoding: Optional[str] = None
+    content_language: Optional[str] = None
+    content_md5: Optional[str] = None # Base64, as in the XML
+    status: Optional[str] = None
+    state: Optional[str] = None
+
+
+
+def formatDate(value: Optional[str]) -> Optional[str]:
+    """
+        Converts a date of the List Blobs XML to the format of the output files, without strptime/strftime.
+
+        Args:
+            value (str): "Mon, 01 Jan 2024 10:00:00 GMT"
+
+        Returns:
+            str: "2024-01-01 10:00:00", or None if there is no date.
+    """
 
+    if not value:
+        return None
 
+    return "".join([value[12:16], "-", MONTHS[value[8:11]], "-", value[5:7], " ", value[17:25]])
 
-def readTXTFile(file_path: str) -> list[str]:
+
+
+def blobRow(blob: BlobRecord, storage_account: str, container_name: str) -> list:
     """
-        Reads a TXT file and returns a list with the values it contains.
-            If the line startswith the character '#', we will treat the line as a comment.
+        Formats a blob as a row of the output files, in the order of BLOB_COLUMNS.
 
         Args:
-            file_path (str): The path to the TXT file you want to read.
+            blob (BlobRecord): The blob.
+            storage_account (str): The storage account FQDN.
+            container_name (str): The container name.
 
         Returns:
-            list[str]: A list with the values from the TXT file, where each value represents a line in the file.
+            list: The values of the row.
+    """
+
+    return [
+        blob.name,
+        container_name,
+        "".join([storage_account, "/", container_name, "/", blob.name]),
+        formatDate(blob.creation_time),
+        formatDate(blob.last_modified),
+        # Same spelling as the previous outputs (the SDK enum names): BlockBlob -> BLOCKBLOB
+        blob.blob_type.upper() if blob.blob_type else None,
+        blob.etag,
+        blob.size,
+        blob.content_type,
+        blob.content_encoding,
+        blob.content_language,
+        blob.content_md5,
+        blob.status,
+        blob.state,
+    ]
+
+
+
+async def runBounded(function: Callable[[Any], Awaitable[Any]], items: Iterable[Any], limit: int) -> AsyncIterator[Any]:
+    """
+        Runs an async function over the items keeping at most `limit` calls in flight and yields the results as they complete.
+            Items are pulled lazily from the iterable, so the number of pending tasks never grows with the number of items.
+
+        Args:
+            function (Callable): The async function to call once per item.
+            items (Iterable): The items to process. It can be a generator.
+            limit (int): The maximum number of concurrent calls.
+
+        Yields:
+            Any: The result of each call, in completion order.
     """
 
+    items = iter(items)
+
+    # Start the first batch of tasks
+    pending = {asyncio.ensure_future(function(item)) for item in islice(items, limit)}
+
     try:
-        with open(file_path, "r") as file:
-            lines = file.readlines()
-            # Remove line breaks from each line
-            return [line.strip() for line in lines if not line.startswith('#')]
-        
-    except FileNotFoundError as e:
-        
-        raise FileNotFoundError(f"\t[{ERROR}] File not found: {file_path}") from e
-    
-    except Exception as e:
-        raise Exception(f"\t[{ERROR}] Error reading file: {file_path}") from e
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            # Refill the free slots before handing the results back
+            pending.update(asyncio.ensure_future(function(item)) for item in islice(items, len(done)))
+
+            for task in done:
+                yield task.result()
+
+    finally:
+        # The consumer stopped early or something failed: do not leave orphan tasks behind
+        for task in pending:
+            task.cancel()
 
 
 
@@ -54,13 +163,14 @@ def getDateTime() -> datetime:
 
 
 
-def checkPaths(company: str) -> Path:
+def checkPaths(company: str, notices: Optional[list[tuple[str, str]]] = None) -> Path:
     """
         Check if the "Output" folder exists. If not, create it.
         Check if the company folder exists. If not, create it.
 
         Args:
             company (str): The company name.
+            notices (list, optional): Where the folders created and the errors are appended, as (level, message) (see events.ScanNotice).
             
         Returns:
             company_path (Path): The path to the company folder.
@@ -75,79 +185,130 @@ def checkPaths(company: str) -> Path:
     # Company Path
     company_path = output_path / company
 
+    notices = notices if notices is not None else []
+
     # If Output directory doens't exist let's create it
     if not output_path.exists():
         try:
-            Path.mkdir(output_path)
-            print(f'\t\t\t\t[{CREATION}] Created a new folder for script output: {output_path}')
+            # Another worker process may create it at the same time
+            Path.mkdir(output_path, exist_ok=True)
+            notices.append(("creation", f"Created a new folder for script output: {output_path}"))
 
         except Exception as e:
-            print(f'\t\t\t\t[{ERROR}] checkPaths - output_path - {e}')
+            notices.append(("warning", f"checkPaths - output_path - {e}"))
             
     if not company_path.exists():
         try:
-            Path.mkdir(company_path)
-            print(f'\t\t\t\t[{CREATION}] Created a new folder for the company: {company_path}')
+            Path.mkdir(company_path, exist_ok=True)
+            notices.append(("creation", f"Created a new folder for the company: {company_path}"))
 
         except Exception as e:
-            print(f'\t\t\t\t[{ERROR}] checkPaths - company_path - {e}')
+            notices.append(("warning", f"checkPaths - company_path - {e}"))
 
     return company_path
 
 
 
-def writeBlobs(blobs: list[dict], company: str, storage_account: str, container_name: str):
+async def writeBlobs(pages: AsyncIterator[list[Union[BlobRecord, tuple[str, BlobRecord]]]], company: str, storage_account: str, container_name: str, append: bool = False, changes: bool = False, notices: Optional[list[tuple[str, str]]] = None) -> int:
     """
-        Writes a list of blobs to a CSV file. File name will be a mix of the storage account name and container name.
+        Writes the blobs of a container to a CSV file as the listing pages arrive. File name will be a mix of the storage account name and container name.
+            Every page is flushed to disk before the next one is requested, so memory stays bounded by the page size
+            and the rows written so far survive a crash in the middle of the listing.
+            The file is only created once the first blob arrives.
 
         Args:
-            blobs (list[dict]): A list of dictionaries containing blob information.
-            storage_account (str): The storage account name.
+            pages (AsyncIterator[list]): The listing pages, each one a list of BlobRecord (or of (change, BlobRecord) with changes).
+            company (str): The company name.
+            storage_account (str): The storage account FQDN.
             container_name (str): The container name.
+            append (bool): Append to an existing file instead of replacing it, to continue a partial listing.
+            changes (bool): The pages are the changes of an --incremental scan, written to a "_changes" file with CHANGE_COLUMNS.
+            notices (list, optional): Where the files and folders created or deleted are appended, as (level, message).
+                The caller reports them (see az.listingStage). A file that can't be opened raises.
+
+        Returns:
+            int: The number of blobs written.
     """
 
-    # Relevant columns use in the DataFrame
-    columns = [
-        'name',
-        'container',
-        'url',
-        'creation_time',
-        'last_modified',
-        'blob_type',
-        'etag',
-        'size',
-        'content_type',
-        'content_encoding',
-        'content_language',
-        'content_md5',
-        'status',
-        'state',
-    ]
+    file = None
+    writer = None
+    written = 0
+
+    try:
+        async for blobs in pages:
+            if len(blobs) == 0:
+                continue
+
+            if file is None:
+                file_path = blobsFilePath(company, storage_account, container_name, append, changes, notices)
+                appending = append and file_path.exists()
+
+                file = open(file_path, "a" if appending else "w", newline="")
+                writer = csv.writer(file)
+
+                if not appending:
+                    writer.writerow(CHANGE_COLUMNS if changes else BLOB_COLUMNS)
+                    if notices is not None:
+                        notices.append(("creation", f"File {file_path} has been created"))
+
+            async with METRICS.track("write"):
+                position = file.tell()
+
+                # The blobs are formatted here, one page at a time
+                if changes:
+                    writer.writerows([change] + blobRow(blob, storage_account, container_name) for change, blob in blobs)
+
+                else:
+                    writer.writerows(blobRow(blob, storage_account, container_name) for blob in blobs)
+
+                file.flush()
+
+                METRICS.addBytes("write", file.tell() - position)
+
+            METRICS.increment("blobs_written", len(blobs))
+            written += len(blobs)
+
+    finally:
+        if file is not None:
+            file.close()
 
-    # Create a DataFrame from the blobs to save in the csv
-    df = pd.DataFrame(blobs, columns=columns)
+    return written
+
+
+
+def blobsFilePath(company: str, storage_account: str, container_name: str, keep: bool = False, changes: bool = False, notices: Optional[list[tuple[str, str]]] = None) -> Path:
+    """
+        Returns the path of the CSV file of a container, deleting the file if it already exists.
+
+        Args:
+            company (str): The company name.
+            storage_account (str): The storage account name.
+            container_name (str): The container name.
+            keep (bool): Don't delete the existing file.
+            changes (bool): The path of the changes file of an --incremental scan.
+            notices (list, optional): Where the files and folders created or deleted are appended, as (level, message).
+
+        Returns:
+            Path: The path to the CSV file.
+    """
+
+    notices = notices if notices is not None else []
 
     # Check if all the Paths are created and if not, create them
-    company_path = checkPaths(company)
+    company_path = checkPaths(company, notices)
 
-   # Filename
-    filename = company + '_' + storage_account.split(".")[0] + '_' + container_name + getDateTime() + '.csv'
+    # Filename
+    filename = company + '_' + storage_account.split(".")[0] + '_' + container_name + ('_changes' if changes else '') + getDateTime() + '.csv'
     file_path = company_path / filename
 
     # If the file already exist, first we need to delete it
-    if file_path.exists():
-        try: 
+    if file_path.exists() and not keep:
+        try:
             # Remove the file
-            file_path.unlink() 
-            print(f'\t\t\t\t[{DELETION}] File {file_path} already exist. Deleting...')
+            file_path.unlink()
+            notices.append(("deletion", f"File {file_path} already exist. Deleting..."))
 
         except Exception as e:
-            print(f'\t\t\t\t[{ERROR}] writeBlobs - file_path - {e}')
-
-    # File creation
-    try:
-        df.to_csv(file_path, index=False)
-        print(f'\t\t\t\t[{CREATION}] File {file_path} has been created')
+            notices.append(("warning", f"writeBlobs - file_path - {e}"))
 
-    except Exception as e:
-        print(f'\t\t\t\t[{ERROR}] writeBlobs - df.to_csv - {e}')
\ No newline at end of file
+    return file_path
@@ -0,0 +1,260 @@
+from config import INFO, ERROR, WORDLISTS_FOLDER
+from metrics import METRICS
+
+from pathlib import Path
+from typing import Iterable, Optional
+import hashlib
+import os
+import re
+import struct
+
+'''
+    Info
+
+    Wordlists (keywords, containers, resources, companies) are compiled once and kept in the wordlists folder,
+    one file per content and rules: the next runs with the same text file load the compiled form instead of parsing it again.
+
+        Cache/Wordlists/<blake2b of RULES_VERSION, the lowercase option and the text file>.words
+
+    Compiling normalizes the lines (stripped, lowercase, '#' comments, blank lines and duplicates removed, wordlist order kept)
+    and decides, once for every entry, what it can be used for:
+
+        ACCOUNT_PART      Lowercase letters and numbers, short enough for a storage account name with a company name
+        CONTAINER_PART    Lowercase letters, numbers and single dashes, short enough for a container name
+        ACCOUNT_NAME      A valid storage account name by itself
+        CONTAINER_NAME    A valid container name by itself
+
+    A keyword without ACCOUNT_PART (or CONTAINER_PART) can't make a valid candidate with any company name, so the permutations
+    skip it (see usableKeywords). The candidates they yield are still validated: the flags only save the work of building them.
+
+    The company names keep their spelling (lowercase=False): they name the output folders and the journal entries,
+    and the permutations lowercase them when they build the candidates.
+
+    File layout: a header (magic, entries), a flags byte and a length (uint16) per entry, then the entries joined by "\n" in UTF-8.
+'''
+
+MAGIC = b"FCWORDS1"
+HEADER = struct.Struct("<8sI")
+
+# Version of the normalization and of the naming rules below. Changing it compiles every wordlist again
+RULES_VERSION = 1
+
+# Flags of an entry
+ACCOUNT_PART = 1
+CONTAINER_PART = 2
+ACCOUNT_NAME = 4
+CONTAINER_NAME = 8
+
+# Naming rules, compiled once (see the Info of storageAccounts.py and containers.py)
+
+# Storage account names: 3 to 24 lowercase letters and numbers.
+# A part shares the name with at least one character of the company name
+ACCOUNT_MAX_LENGTH = 24
+VALID_STORAGE_ACCOUNT = re.compile(r"[a-z0-9]{3,24}")
+VALID_ACCOUNT_PART = re.compile(r"[a-z0-9]{1,23}")
+
+# Container names: 3 to 63 lowercase letters, numbers and dashes, starting and ending with a letter or number,
+# without consecutive dashes. A part can start or end with a dash, next to the company name
+VALID_CONTAINER = re.compile(r"(?!.*--)[a-z0-9][a-z0-9-]{1,61}[a-z0-9]")
+VALID_CONTAINER_PART = re.compile(r"(?!.*--)[a-z0-9-]{1,63}")
+
+
+
+class Wordlist(list):
+    """
+        The entries of a compiled wordlist, with their flags and lengths. It is a list of str everywhere else.
+
+        Args:
+            entries (list[str]): The normalized entries.
+            flags (bytes): The flags of every entry.
+            lengths (list[int]): The length of every entry.
+    """
+
+    def __init__(self, entries: list[str], flags: bytes, lengths: list[int]):
+        super().__init__(entries)
+        self.flags = flags
+        self.lengths = lengths
+        self.selections = {}
+
+
+    def select(self, flag: int, max_length: Optional[int] = None) -> list[str]:
+        """
+            Returns the entries with the flag (and at most max_length long), in wordlist order. The selections are kept.
+
+            Args:
+                flag (int): ACCOUNT_PART, CONTAINER_PART, ACCOUNT_NAME or CONTAINER_NAME.
+                max_length (int, optional): The maximum length of the entries, None for any.
+        """
+
+        key = (flag, max_length)
+
+        if key not in self.selections:
+            self.selections[key] = [
+                entry for entry, flags, length in zip(self, self.flags, self.lengths)
+                if flags & flag and (max_length is None or length <= max_length)
+            ]
+
+        return self.selections[key]
+
+
+
+def entryFlags(entry: str) -> int:
+    """
+        Returns the flags of a normalized entry (see the top of the module).
+    """
+
+    flags = 0
+
+    if VALID_ACCOUNT_PART.fullmatch(entry):
+        flags |= ACCOUNT_PART
+
+    if VALID_CONTAINER_PART.fullmatch(entry):
+        flags |= CONTAINER_PART
+
+    if VALID_STORAGE_ACCOUNT.fullmatch(entry):
+        flags |= ACCOUNT_NAME
+
+    if VALID_CONTAINER.fullmatch(entry):
+        flags |= CONTAINER_NAME
+
+    return flags
+
+
+
+def usableKeywords(keywords: Iterable[str], flag: int, max_length: Optional[int] = None) -> Iterable[str]:
+    """
+        Leaves out the keywords that can't make a valid candidate, when their flags are known.
+
+        Args:
+            keywords (Iterable[str]): The keywords, a Wordlist or any other iterable (taken as it is).
+            flag (int): ACCOUNT_PART or CONTAINER_PART.
+            max_length (int, optional): The room left by the company name in the candidate.
+
+        Returns:
+            Iterable[str]: The keywords to build candidates from.
+    """
+
+    return keywords.select(flag, max_length) if isinstance(keywords, Wordlist) else keywords
+
+
+
+def compileWordlist(text: str, lowercase: bool = True) -> Wordlist:
+    """
+        Normalizes the lines of a text wordlist and computes the flags of every entry.
+
+        Args:
+            text (str): The content of the text file.
+            lowercase (bool): Lowercase the entries. False for the company names.
+
+        Returns:
+            Wordlist: The entries, in the order of their first line.
+    """
+
+    entries = list(dict.fromkeys(
+        entry for entry in (line.strip().lower() if lowercase else line.strip() for line in text.splitlines())
+        if entry and not entry.startswith("#")
+    ))
+
+    return Wordlist(entries, bytes(entryFlags(entry) for entry in entries), [len(entry) for entry in entries])
+
+
+
+def writeCompiled(wordlist: Wordlist, path: Path):
+    """
+        Writes a compiled wordlist. The file is written next to its final path and renamed, so a reader never sees half of it.
+    """
+
+    count = len(wordlist)
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, count))
+        file.write(wordlist.flags)
+        file.write(struct.pack(f"<{count}H", *(min(length, 0xFFFF) for length in wordlist.lengths)))
+        file.write("\n".join(wordlist).encode())
+
+    os.replace(temporary, path)
+
+
+
+def readCompiled(path: Path) -> Optional[Wordlist]:
+    """
+        Reads a compiled wordlist.
+
+        Returns:
+            Wordlist: The wordlist, or None if the file is not a compiled wordlist of this version.
+    """
+
+    data = path.read_bytes()
+
+    if len(data) < HEADER.size:
+        return None
+
+    magic, count = HEADER.unpack_from(data, 0)
+
+    if magic != MAGIC:
+        return None
+
+    flags_end = HEADER.size + count
+    lengths_end = flags_end + 2 * count
+
+    flags = data[HEADER.size:flags_end]
+    lengths = list(struct.unpack_from(f"<{count}H", data, flags_end))
+    entries = data[lengths_end:].decode().split("\n") if count > 0 else []
+
+    if len(entries) != count:
+        return None
+
+    return Wordlist(entries, flags, lengths)
+
+
+
+def loadWordlist(file_path: str, folder: Optional[str] = WORDLISTS_FOLDER, lowercase: bool = True) -> Wordlist:
+    """
+        Reads a text wordlist, from its compiled form when this content was already compiled (see the top of the module).
+
+        Args:
+            file_path (str): The path to the TXT file.
+            folder (str, optional): The folder of the compiled wordlists, None to compile without keeping the result.
+            lowercase (bool): Lowercase the entries. False for the company names.
+
+        Returns:
+            Wordlist: The normalized entries, with their flags.
+    """
+
+    try:
+        with open(file_path, "rb") as file:
+            content = file.read()
+
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"\t[{ERROR}] File not found: {file_path}") from e
+
+    compiled = None
+
+    if folder is not None:
+        # The same text compiled with other rules or options is another file
+        rules = struct.pack("<I?", RULES_VERSION, lowercase)
+        compiled = Path(folder) / f"{hashlib.blake2b(rules + content, digest_size=16).hexdigest()}.words"
+
+        if compiled.exists():
+            wordlist = readCompiled(compiled)
+
+            if wordlist is not None:
+                METRICS.increment("wordlists_cached")
+                return wordlist
+
+    try:
+        wordlist = compileWordlist(content.decode(), lowercase)
+
+    except Exception as e:
+        raise Exception(f"\t[{ERROR}] Error reading file: {file_path}") from e
+
+    METRICS.increment("wordlists_compiled")
+
+    if compiled is not None:
+        compiled.parent.mkdir(parents=True, exist_ok=True)
+        writeCompiled(wordlist, compiled)
+
+        print(f"[{INFO}] Wordlist compiled: {file_path} ({len(wordlist)} entries) to {compiled}")
+
+    return wordlist